@@ -1,28 +1,26 @@
-import argparse
-import copy
-import logging
-import pathlib
-import shutil
-import sys
-import tarfile
-import unittest
+import importlib
 
-from .base import Profile, Target, Scope
-from .build import Build
-from .config import ConfigDict
-from .tests import Skip, TestCase
-from . import compilers, targets
+_exports = {
+	'Profile': 'base',
+	'Target': 'base',
+	'Scope': 'base',
+	'Build': 'build',
+	'ConfigDict': 'config',
+	'Skip': 'tests',
+	'TestCase': 'tests',
+	'compilers': None,
+	'targets': None
+}
 
-if not any([ '.xz' in i[1] for i in shutil.get_unpack_formats() ]):
-	def _extract_xz(filename, extract_dir):
-		try:
-			tarobj = tarfile.open(filename)
-		except tarfile.TarError as e:
-			raise ReadError('{} is not a tar file'.format(filename)) from e
+__all__ = list(_exports)
 
-		try:
-			tarobj.extractall(extract_dir)
-		finally:
-			tarobj.close()
+def __getattr__(name):
+	if name not in _exports:
+		raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+	module = importlib.import_module('.'+(_exports[name] or name), __package__)
+	value = module if _exports[name] is None else getattr(module, name)
+	globals()[name] = value
+	return value
 
-	shutil.register_unpack_format('XZ file', ['.xz'], _extract_xz, [], 'Tar file compressed with XZ (LZMA) algorithm')
+def __dir__():
+	return sorted(set(globals()) | set(_exports))
@@ -0,0 +1,99 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+Sample = collections.namedtuple('Sample', ['memory_some', 'memory_full', 'cpu_some', 'memory_available', 'load'])
+
+def _pressure(resource):
+	try:
+		lines = open('/proc/pressure/{}'.format(resource)).read().splitlines()
+	except OSError:
+		return dict()
+	pressure = dict()
+	for line in lines:
+		kind, *fields = line.split()
+		pressure[kind] = float(dict(i.split('=') for i in fields)['avg10'])
+	return pressure
+
+def _memory_available():
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1])*1024
+	except OSError:
+		pass
+	return None
+
+def probe():
+	memory = _pressure('memory')
+	load = os.getloadavg()[0] if hasattr(os, 'getloadavg') else None
+	return Sample(memory.get('some'), memory.get('full'), _pressure('cpu').get('some'), _memory_available(), load)
+
+class Admission:
+	memory_some_limit = 10.0
+	memory_full_limit = 1.0
+	cpu_some_limit = 80.0
+	load_factor = 1.5
+	interval = 2.0
+
+	def __init__(self, jobs, cpus, probe=probe):
+		self.jobs = jobs
+		self.cpus = cpus
+		self.limit = jobs
+		self.probe = probe
+		self._reserved = dict()
+		self._changed = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _pressured(self, sample):
+		if sample.memory_full is not None and sample.memory_full > self.memory_full_limit:
+			return 'memory stalls {:.1f}%'.format(sample.memory_full)
+		if sample.memory_some is not None and sample.memory_some > self.memory_some_limit:
+			return 'memory pressure {:.1f}%'.format(sample.memory_some)
+		if sample.cpu_some is not None and sample.cpu_some > self.cpu_some_limit:
+			return 'CPU pressure {:.1f}%'.format(sample.cpu_some)
+		if sample.load is not None and sample.load > self.cpus*self.load_factor:
+			return 'load {:.1f}'.format(sample.load)
+		return None
+
+	def _adjust(self, sample, running):
+		now = time.monotonic()
+		if now - self._changed < self.interval:
+			return
+		reason = self._pressured(sample)
+		if reason is not None and self.limit > 1:
+			self.limit = max(1, min(self.limit, running)//2)
+			self._changed = now
+			logging.log(logging.DEBUG-1, 'Admission: backing off to {} job(s), {}'.format(self.limit, reason))
+		elif reason is None and self.limit < self.jobs and running >= self.limit:
+			self.limit += 1
+			self._changed = now
+			logging.log(logging.DEBUG-1, 'Admission: ramping up to {} job(s)'.format(self.limit))
+
+	def _admissible(self, memory):
+		running = len(self._reserved)
+		if running == 0:
+			return True
+		sample = self.probe()
+		self._adjust(sample, running)
+		if running >= self.limit:
+			return False
+		if memory and sample.memory_available is not None:
+			return memory <= sample.memory_available - sum(self._reserved.values())
+		return True
+
+	def admit(self, memory=None):
+		with self._lock:
+			if not self._admissible(memory):
+				return None
+			token = object()
+			self._reserved[token] = memory or 0
+			return token
+
+	def finish(self, token):
+		with self._lock:
+			del self._reserved[token]
+
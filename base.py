@@ -1,11 +1,18 @@
-import copy
-import inspect
+import glob
+import hashlib
 import logging
 import pathlib
 
-from .config import Config, ConfigDict
+from .config import Config, ConfigDict, DefaultedDict, FrozenDict
+from .locks import TargetLock
 from .process import Process
-from .tests import Result, TestCase, _fn_log
+from .scheduler import available_cpus
+from . import staging
+from .log import _fn_log
+
+def _contains(directory, path):
+	directory, path = pathlib.Path(directory), pathlib.Path(path)
+	return directory == path or directory in path.parents
 
 def _code_from_name(name):
 	return name.lower().replace(' ', '_').replace('.', '_').replace('-', '_')
@@ -37,6 +44,8 @@ class Scope:
 	Auto = 'Auto'
 
 class TargetConfig:
+	__slots__ = ('target', 'config')
+
 	def __init__(self, target, config):
 		self.target = target
 		self.config = config
@@ -91,14 +100,70 @@ class TargetConfig:
 	def __iter__(self):
 		return iter(self.config)
 
+class Steps:
+	def __init__(self, target):
+		self.target = target
+		self.state = target._state
+		self.recorded = self.state.steps(target.code) if self.state is not None else []
+		self.position = 0
+		self.dirty = False
+
+	def files(self, directory, patterns, exclude=None):
+		paths = set()
+		for pattern in patterns:
+			paths.update(glob.glob(str(pathlib.Path(directory)/pattern), recursive=True))
+		if exclude is not None:
+			exclude = pathlib.Path(exclude)
+			paths = { i for i in paths if exclude not in pathlib.Path(i).parents }
+		if self.state is None or not paths:
+			return None
+		return self.state.hash_paths(sorted(paths), self.target.config['directory.root'])
+
+	def run(self, name, fingerprint, function, outputs=()):
+		fingerprint = hashlib.sha256(repr(fingerprint).encode('utf-8')).hexdigest()
+		position = self.position
+		self.position += 1
+		if not self.dirty and position < len(self.recorded) and self.recorded[position] == (name, fingerprint) \
+				and all(pathlib.Path(i).exists() for i in outputs):
+			self.target.log(logging.INFO, '{} is up to date.'.format(name))
+			return
+		self.dirty = True
+		if self.state is not None:
+			self.state.record_step(self.target.code, position, name, None)
+		self.target.log(logging.INFO, '{}...'.format(name))
+		function()
+		if self.state is not None:
+			self.state.record_step(self.target.code, position, name, fingerprint)
+
 class Target:
+	__slots__ = ('name', 'code', 'dependencies', 'config', '_config',
+		'_telemetry', '_state', '_destdir', '_cpus', '__dict__')
+
 	GlobalTargetLevel = 'target'
 
 	local_config_keys = set()
-	local_config_defaults = dict()
+	local_config_defaults = FrozenDict()
+	input_config_keys = set()
+	output_config_keys = set()
+	declared_config_keys = {'inputs', 'outputs'}
+
+	cacheable = False
+	staged = False
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls.local_config_defaults = FrozenDict(cls.local_config_defaults)
 
 	def _local_config_key(self, key):
-		return 'target.{}.{}'.format(self.code, key)
+		return self._config.prefix+key
+
+	def _attributes(self):
+		attributes = dict(self.__dict__)
+		for cls in type(self).__mro__:
+			for name in cls.__dict__.get('__slots__', ()):
+				if name not in ('__dict__', '__weakref__') and hasattr(self, name):
+					attributes[name] = getattr(self, name)
+		return attributes
 
 	def __init__(self, name, dependencies=None, config=None):
 		config = config if config is not None else dict()
@@ -107,15 +172,113 @@ class Target:
 		self.name = name
 		self.code = _code_from_name(name)
 		self.dependencies = dependencies if dependencies is not None else set()
-		self._config = { k: v for k, v in config.items() if k not in self.local_config_keys }
-		self._config.update({ self._local_config_key(k): v for k, v in config.items() if k in self.local_config_keys })
-		self._config.update({ self._local_config_key(k): v for k, v in self.local_config_defaults.items() if k not in config  })
+		self._telemetry = None
+		self._state = None
+		self._destdir = None
+		self._cpus = None
+		local_config_keys = self.local_config_keys | self.declared_config_keys
+		prefix = 'target.{}.'.format(self.code)
+		self._config = DefaultedDict(((prefix+k if k in local_config_keys else k, v)
+			for k, v in config.items()), prefix, self.local_config_defaults)
+
+	@property
+	def outdated_reason(self):
+		state = self._state.get(self.code)
+		if state is None:
+			return 'never built'
+		for output in sorted(set(state.outputs) | set(self._declared(self.output_config_keys | {'outputs'}))):
+			if not pathlib.Path(output).exists():
+				return 'output {} does not exist'.format(output)
+		inputs = self._inputs_fingerprint()
+		if inputs is not None and inputs != state.inputs:
+			return 'inputs changed' if state.inputs is not None else 'inputs not recorded'
+		return None
 
 	@property
 	def outdated(self):
-		return not self._stamp_file().exists()
+		return self.outdated_reason is not None
+
+	def fingerprint(self):
+		config = sorted((k, repr(v)) for k, v in self._config.items() if not callable(v))
+		return hashlib.sha256(repr((self.__class__.__qualname__, config)).encode('utf-8')).hexdigest()
+
+	def _declared(self, keys):
+		paths = []
+		for key in sorted(keys):
+			if self._local_config_key(key) not in self._config:
+				continue
+			value = self.config[key, Scope.Local]
+			paths.extend(map(str, value) if isinstance(value, (list, tuple, set)) else [str(value)])
+		return paths
+
+	def inputs(self):
+		inputs = []
+		for path in self._declared(self.input_config_keys | {'inputs'}):
+			inputs.extend(sorted(glob.glob(path, recursive=True)) if any(i in path for i in '*?[') else [path])
+		return inputs
+
+	def _inputs_fingerprint(self, exclude=()):
+		inputs = [ i for i in self.inputs() if not any(_contains(j, i) for j in exclude) ]
+		return self._state.hash_paths(inputs, self.config['directory.root']) if inputs else None
+
+	def _generated(self, config):
+		return []
+
+	def _cache_inputs(self, configs, state):
+		generated = [ i for dependency in self.dependencies for i in dependency._generated(configs[dependency]) ]
+		saved = (self.config, self._state)
+		self.config = TargetConfig(self, configs[self])
+		self._state = state
+		try:
+			return self._inputs_fingerprint(generated)
+		finally:
+			self.config, self._state = saved
+
+	def outputs(self):
+		outputs = self._declared(self.output_config_keys | {'outputs'})
+		for key in ('file.output', 'directory.output'):
+			try:
+				outputs.append(str(self.config[key, Scope.Local, Target.GlobalTargetLevel]))
+			except KeyError:
+				try:
+					outputs.append(str(self.config[key, Scope.Local]))
+				except KeyError:
+					pass
+		return outputs
+
+	def cpus(self):
+		if self._cpus is not None:
+			return self._cpus
+		return available_cpus()
+
+	def _hint(self, config, key):
+		config = TargetConfig(self, config)
+		if self._local_config_key(key) in self._config:
+			return config[key, Scope.Local]
+		try:
+			return config[key, Scope.Global]
+		except KeyError:
+			return None
+
+	def _parallelism(self, config, state):
+		parallelism = self._hint(config, 'parallelism')
+		if parallelism is not None:
+			return float(parallelism)
+		recorded = state.get(self.code)
+		if recorded is not None and recorded.parallelism is not None:
+			return recorded.parallelism
+		return 1.0
+
+	def _memory(self, config):
+		memory = self._hint(config, 'memory')
+		return int(float(memory)*1024**2) if memory is not None else None
+
+	def steps(self):
+		return Steps(self)
 
 	def call(self, *args, **kwargs):
+		if not 'affinity' in kwargs and self._cpus is not None and self.config['process.affinity']:
+			kwargs['affinity'] = self._cpus
 		if not 'echo_stdout' in kwargs:
 			kwargs['echo_stdout'] = self.config['process.echo.stdout']
 		if not 'echo_stderr' in kwargs:
@@ -124,7 +287,11 @@ class Target:
 		env.update(kwargs.pop('env', dict()))
 		kwargs['env'] = env
 		process = Process(*args, **kwargs)
-		process.communicate()
+		try:
+			return process.communicate()
+		finally:
+			if self._telemetry is not None:
+				self._telemetry.add_process(process.rusage)
 
 	def log(self, level, message):
 		logging.log(level, '{}: {}'.format(self.name, message))
@@ -135,66 +302,115 @@ class Target:
 	def post_build(self):
 		pass
 
-	def _stamp_file(self):
-		return pathlib.Path(self.config['directory.stamps'])/'.stamp-{}'.format(self.code)
-
-	def _build(self, config):
-		config = Config('target.{}'.format(self.code), self._config, config)
+	def _configure(self, config):
+		return Config(self._config.prefix[:-1], self._config, config)
 
-		self.log(logging.DEBUG, 'processing dependencies...')
-		for dependency in self.dependencies:
-			dependency._build(config)
-		self.log(logging.DEBUG, 'dependencies ready.')
+	def _rebuild_reason(self):
+		if self.config['always_outdated']:
+			return 'always outdated'
+		if self.outdated:
+			return self.outdated_reason or 'outdated'
+		return None
 
+	def _plan(self, config, state):
+		self.config = TargetConfig(self, config)
+		self._state = state
+		try:
+			return self._rebuild_reason()
+		except Exception as e:
+			return 'undetermined before dependencies are built ({}: {})'.format(e.__class__.__qualname__, e)
+		finally:
+			self._state = None
+			self.config = None
+
+	def _staging(self):
+		return pathlib.Path(self.config['directory.staging'])/self.code
+
+	def _run_build(self, scheduler):
+		root = self.config['directory.root']
+		stage = self._staging() if self.staged else None
+		if stage is not None:
+			staging.uninstall(self.code, root, stage, scheduler.state)
+
+		cache = scheduler.cache if self.cacheable else None
+		if cache is not None:
+			key = cache.key(self, scheduler.configs, lambda target: target._cache_inputs(scheduler.configs, scheduler.state))
+			if cache.restore(key, stage if stage is not None else root):
+				self.log(logging.INFO, 'restored from artifact cache.')
+				if stage is not None:
+					staging.compose(self.code, root, stage, scheduler.state)
+				return False
+			isolation = scheduler.isolation()
+			snapshot = cache.snapshot(stage, ['.']) if stage is not None else cache.snapshot(root)
+
+		if stage is not None:
+			self._destdir = staging.destdir(stage)
+		try:
+			built_remotely = scheduler.remote is not None and scheduler.remote.build(self)
+			if not built_remotely:
+				self.build()
+		finally:
+			self._destdir = None
+
+		if stage is not None:
+			staging.relocate(root, stage)
+			staging.compose(self.code, root, stage, scheduler.state)
+		if cache is not None:
+			if stage is not None or (isolation[1] == 1 and scheduler.isolation() == isolation):
+				cache.store(key, snapshot)
+			else:
+				self.log(logging.DEBUG, 'not stored in artifact cache, other targets were building concurrently')
+		return built_remotely
+
+	def _build(self, config, record, scheduler):
 		self.log(logging.DEBUG, 'processing...')
 		self.config = TargetConfig(self, config)
+		self._state = scheduler.state
+
+		lock = TargetLock(scheduler.state.path.parent/'locks', self.code)
+		stale = lock.acquire(lambda owner: self.log(logging.INFO, 'waiting for another build ({}) to finish it...'.format(owner)))
+		try:
+			if stale is not None:
+				self.log(logging.WARNING, 'previous build ({}) was interrupted.'.format(stale))
+			scheduler.state.refresh(self.code)
+			self._build_locked(record, scheduler)
+		finally:
+			lock.release()
+
+		self._state = None
+		self.config = None
+		self.log(logging.DEBUG, 'processed.')
 
-		rebuild = self.config['always_outdated'] or self.outdated
+	def _build_locked(self, record, scheduler):
+		reason = self._rebuild_reason()
+		rebuild = reason is not None
 
 		self.config['build', Scope.Local, Target.GlobalTargetLevel] = rebuild
-		self.config['file.stamp', Scope.Local, Target.GlobalTargetLevel] = self._stamp_file()
 
+		self._telemetry = record
+		built_remotely = False
 		if rebuild:
+			self.log(logging.DEBUG, 'outdated: {}'.format(reason))
 			self.log(logging.INFO, 'building...')
+			record.built = True
 			try:
-				self.build()
+				with record.phase('build'):
+					built_remotely = self._run_build(scheduler)
 			except Exception as e:
 				raise Exception('Building target "{}" failed'.format(self.name)) from e
-
-			try:
-				self._stamp_file().parent.mkdir(parents=True)
-			except FileExistsError:
-				pass
-
-			self._stamp_file().touch()
 			self.log(logging.INFO, 'built.')
-		self.post_build()
+		if not built_remotely:
+			with record.phase('post_build'):
+				self.post_build()
 
-		self.config = None
-		self.log(logging.DEBUG, 'processed.')
+		if scheduler.inputs is not None:
+			scheduler.inputs[self] = self.inputs()
+
+		if rebuild:
+			duration = record.duration('build')
+			parallelism = (record.cpu_user+record.cpu_system)/duration if record.processes and duration > 0 else None
+			scheduler.state.record(self.code, fingerprint=self.fingerprint(), duration=duration,
+				outputs=self.outputs(), inputs=self._inputs_fingerprint(), parallelism=parallelism)
+			scheduler.state.flush(self.code)
 
-class TargetTestCase(TestCase):
-	def mock_build(self, cls, config=None):
-		if config is None:
-			config = dict()
-		config = Config._flatten_dict(config)
-		if not 'directory.root' in config:
-			config['directory.root'] = self.root_dir.name
-		return cls(config=config)
-
-	def mock_target(self, cls, *args, **kwargs):
-		target = cls(*args, **kwargs)
-		runtime_config_result = Result()
-
-		old_build = target.build if target.build.__func__ != Target.build else lambda: None
-		def build():
-			old_build()
-			runtime_config_result.value = copy.deepcopy(target.config)
-		target.build = build
-		return target, runtime_config_result
-
-	def run_target(self, target, build_config=None):
-		from .build import Build
-		build = self.mock_build(Build, config=build_config)
-		build.targets |= {target}
-		build()
+		self._telemetry = None
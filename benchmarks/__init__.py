@@ -0,0 +1,41 @@
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+def timed(fn, *args, **kwargs):
+	start = time.perf_counter()
+	result = fn(*args, **kwargs)
+	return time.perf_counter() - start, result
+
+def peak_rss_kb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def environment():
+	return {
+		'python': platform.python_version(),
+		'implementation': platform.python_implementation(),
+		'platform': platform.platform(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+	}
+
+def run_isolated(module, args, timeout):
+	try:
+		process = subprocess.run([sys.executable, '-m', module]+list(args),
+			stdout=subprocess.PIPE, timeout=timeout, check=True)
+	except subprocess.TimeoutExpired:
+		return { 'timeout': timeout }
+	except subprocess.CalledProcessError as e:
+		return { 'error': e.returncode }
+	return json.loads(process.stdout.decode('utf-8'))
+
+def write_results(name, results, output=None):
+	document = { 'benchmark': name, 'environment': environment(), 'results': results }
+	if output is None:
+		json.dump(document, sys.stdout, indent=1)
+		sys.stdout.write('\n')
+	else:
+		with open(output, 'w') as f:
+			json.dump(document, f, indent=1)
@@ -0,0 +1,138 @@
+import argparse
+import json
+import tempfile
+import tracemalloc
+
+from . import peak_rss_kb, run_isolated, timed, write_results
+from ..base import Target
+from ..build import Build
+from ..config import Config, ConfigDict
+
+class NoOp(Target):
+	def build(self):
+		pass
+
+def chain(size):
+	target = NoOp('chain 0')
+	for i in range(1, size):
+		target = NoOp('chain {}'.format(i), dependencies={target})
+	return {target}
+
+def fan_out(size):
+	leaves = { NoOp('leaf {}'.format(i)) for i in range(size-1) }
+	return {NoOp('root', dependencies=leaves)}
+
+def diamonds(size):
+	top = NoOp('diamond 0 top')
+	for i in range((size-1)//3):
+		left = NoOp('diamond {} left'.format(i), dependencies={top})
+		right = NoOp('diamond {} right'.format(i), dependencies={top})
+		top = NoOp('diamond {} top'.format(i+1), dependencies={left, right})
+	return {top}
+
+shapes = {
+	'chain': chain,
+	'fan-out': fan_out,
+	'diamonds': diamonds
+}
+
+def scenario(shape, size):
+	tracemalloc.start()
+	graph_time, targets = timed(shapes[shape], size)
+	graph_memory, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	with tempfile.TemporaryDirectory() as root:
+		build = Build(config={'directory.root': root})
+		build.targets |= targets
+		collect_time, collected = timed(build.collect_targets)
+		build_time, _ = timed(build, [])
+		noop_time, _ = timed(build, [])
+
+	return {
+		'shape': shape,
+		'size': size,
+		'targets': len(collected),
+		'graph_s': graph_time,
+		'graph_memory_bytes': graph_memory,
+		'collect_targets_s': collect_time,
+		'build_s': build_time,
+		'noop_build_s': noop_time,
+		'peak_rss_kb': peak_rss_kb()
+	}
+
+def footprint(shape, size):
+	tracemalloc.start()
+	targets = shapes[shape](size)
+	graph_memory, _ = tracemalloc.get_traced_memory()
+	with tempfile.TemporaryDirectory() as root:
+		build = Build(config={'directory.root': root})
+		build.targets |= targets
+		tracemalloc.reset_peak()
+		build([])
+		retained_memory, peak_memory = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		'shape': shape,
+		'size': size,
+		'graph_bytes_per_target': graph_memory/size,
+		'build_peak_bytes_per_target': (peak_memory-graph_memory)/size,
+		'retained_bytes_per_target': (retained_memory-graph_memory)/size
+	}
+
+def config_throughput(operations):
+	config = Config('default', Build._default_config)
+	config = Config('main', ConfigDict({'directory.root': '/tmp'}), config)
+	config = Config(Target.GlobalTargetLevel, {}, config)
+
+	def lookups():
+		for _ in range(operations):
+			config['process.echo.stdout']
+	def subtree_lookups():
+		for _ in range(operations):
+			config['process.echo']
+	def sets():
+		for i in range(operations):
+			config['benchmark.value'] = i
+
+	per_second = lambda fn: operations/timed(fn)[0]
+	return {
+		'operations': operations,
+		'lookups_per_s': per_second(lookups),
+		'subtree_lookups_per_s': per_second(subtree_lookups),
+		'sets_per_s': per_second(sets)
+	}
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Benchmark of build engine overhead, using no-op targets')
+	parser.add_argument('--shapes', nargs='+', choices=sorted(shapes), default=sorted(shapes))
+	parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+	parser.add_argument('--config-operations', type=int, default=100000)
+	parser.add_argument('--timeout', type=float, default=600,
+		help='Time limit for a single scenario, in seconds')
+	parser.add_argument('--output', metavar='FILE', help='Write JSON results to FILE instead of stdout')
+	parser.add_argument('--scenario', metavar='SHAPE:SIZE', help=argparse.SUPPRESS)
+	parser.add_argument('--footprint', metavar='SHAPE:SIZE', help=argparse.SUPPRESS)
+	args = parser.parse_args(args)
+
+	if args.scenario:
+		shape, size = args.scenario.split(':')
+		print(json.dumps(scenario(shape, int(size))))
+		return
+	if args.footprint:
+		shape, size = args.footprint.split(':')
+		print(json.dumps(footprint(shape, int(size))))
+		return
+
+	results = { 'config': config_throughput(args.config_operations), 'graphs': [], 'footprint': [] }
+	for shape in args.shapes:
+		for size in args.sizes:
+			for name, option in (('graphs', '--scenario'), ('footprint', '--footprint')):
+				result = { 'shape': shape, 'size': size }
+				result.update(run_isolated(__spec__.name, [option, '{}:{}'.format(shape, size)], args.timeout))
+				results[name].append(result)
+	write_results('engine', results, args.output)
+
+if __name__ == '__main__':
+	main()
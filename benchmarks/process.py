@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+
+from . import run_isolated, timed, write_results
+from ..process import Process
+
+_child = '''import os, sys
+size, pattern = int(sys.argv[1]), sys.argv[2]
+block = b'x'*(65536 if pattern == 'burst' else 79)+(b'' if pattern == 'burst' else b'\\n')
+fd = 1
+while size > 0:
+	size -= os.write(fd, block[:size])
+	fd = 3 - fd
+'''
+
+patterns = ('burst', 'lines')
+modes = ('capture', 'echo')
+
+def _parse_size(size):
+	units = { 'K': 1024, 'M': 1024**2, 'G': 1024**3 }
+	if size[-1].upper() in units:
+		return int(size[:-1])*units[size[-1].upper()]
+	return int(size)
+
+def _cpu_time():
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+@contextlib.contextmanager
+def _echo_to_null():
+	stdout, stderr = sys.stdout, sys.stderr
+	with open(os.devnull, 'w') as null:
+		sys.stdout = sys.stderr = null
+		try:
+			yield
+		finally:
+			sys.stdout, sys.stderr = stdout, stderr
+
+def _run(args, mode):
+	capture = (mode == 'capture')
+	process = Process(args, echo_stdout=not capture, echo_stderr=not capture,
+		capture_stdout=capture, capture_stderr=capture)
+	return process.communicate()
+
+def throughput(size, pattern, mode):
+	cpu = _cpu_time()
+	with _echo_to_null():
+		wall, (stdout, stderr) = timed(_run, [sys.executable, '-c', _child, str(size), pattern], mode)
+	cpu = _cpu_time() - cpu
+	megabytes = size/1024**2
+	return {
+		'size': size,
+		'pattern': pattern,
+		'mode': mode,
+		'wall_s': wall,
+		'mb_per_s': megabytes/wall,
+		'cpu_s': cpu,
+		'cpu_s_per_mb': cpu/megabytes,
+		'captured_bytes': len(stdout)+len(stderr)
+	}
+
+def latency(count, mode):
+	executable = shutil.which('true')
+	samples = []
+	with _echo_to_null():
+		for _ in range(count):
+			samples.append(timed(_run, [executable], mode)[0])
+	samples.sort()
+	return {
+		'mode': mode,
+		'processes': count,
+		'total_s': sum(samples),
+		'processes_per_s': count/sum(samples),
+		'median_s': statistics.median(samples),
+		'p95_s': samples[int(0.95*(count-1))],
+		'max_s': samples[-1]
+	}
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Benchmark of Process output handling and spawn latency')
+	parser.add_argument('--sizes', nargs='+', default=['1K', '1M', '64M', '1G'],
+		help='Amounts of output produced by the child, with optional K, M or G suffix')
+	parser.add_argument('--patterns', nargs='+', choices=patterns, default=list(patterns))
+	parser.add_argument('--modes', nargs='+', choices=modes, default=list(modes))
+	parser.add_argument('--storm', type=int, default=1000,
+		help='Number of short-lived processes run for latency measurement')
+	parser.add_argument('--timeout', type=float, default=300,
+		help='Time limit for a single measurement, in seconds')
+	parser.add_argument('--output', metavar='FILE', help='Write JSON results to FILE instead of stdout')
+	parser.add_argument('--throughput', nargs=3, metavar=('SIZE', 'PATTERN', 'MODE'), help=argparse.SUPPRESS)
+	parser.add_argument('--latency', nargs=2, metavar=('COUNT', 'MODE'), help=argparse.SUPPRESS)
+	args = parser.parse_args(args)
+
+	if args.throughput:
+		size, pattern, mode = args.throughput
+		print(json.dumps(throughput(int(size), pattern, mode)))
+		return
+	if args.latency:
+		count, mode = args.latency
+		print(json.dumps(latency(int(count), mode)))
+		return
+
+	results = { 'throughput': [], 'latency': [] }
+	for mode in args.modes:
+		for pattern in args.patterns:
+			for size in map(_parse_size, args.sizes):
+				result = { 'size': size, 'pattern': pattern, 'mode': mode }
+				result.update(run_isolated(__spec__.name,
+					['--throughput', str(size), pattern, mode], args.timeout))
+				results['throughput'].append(result)
+		result = { 'mode': mode, 'processes': args.storm }
+		result.update(run_isolated(__spec__.name, ['--latency', str(args.storm), mode], args.timeout))
+		results['latency'].append(result)
+	write_results('process', results, args.output)
+
+if __name__ == '__main__':
+	main()
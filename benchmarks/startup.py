@@ -0,0 +1,86 @@
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from . import timed, write_results
+
+_package = __package__.split('.')[0]
+
+_noop_build = '''import sys
+from {package}.base import Target
+from {package}.build import Build
+
+class NoOp(Target):
+	def build(self):
+		pass
+
+build = Build(config={{'directory.root': sys.argv[1]}})
+build.targets |= {{ NoOp('target {{}}'.format(i)) for i in range(int(sys.argv[2])) }}
+build([])
+'''.format(package=_package)
+
+scenarios = {
+	'interpreter': 'pass',
+	'import': 'import {}'.format(_package),
+	'import-build': 'import {}.build'.format(_package),
+	'import-targets': 'import {}.targets'.format(_package),
+	'noop-build': _noop_build
+}
+
+def _environment():
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join([str(pathlib.Path(__file__).parent.parent.parent)]+[ i for i in sys.path if i ])
+	return env
+
+def _run(code, args=(), options=()):
+	return subprocess.run([sys.executable]+list(options)+['-c', code]+list(args), env=_environment(),
+		stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+
+def startup(scenario, repeat, targets):
+	with tempfile.TemporaryDirectory() as root:
+		args = [root, str(targets)] if scenario == 'noop-build' else []
+		_run(scenarios[scenario], args)
+		samples = sorted(timed(_run, scenarios[scenario], args)[0] for _ in range(repeat))
+	return {
+		'scenario': scenario,
+		'repeat': repeat,
+		'median_s': statistics.median(samples),
+		'min_s': samples[0],
+		'max_s': samples[-1]
+	}
+
+def imports(module, count):
+	stderr = _run('import {}'.format(module), options=['-X', 'importtime']).stderr.decode('utf-8')
+	modules = []
+	for line in stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		modules.append((int(cumulative), name.strip()))
+	modules.sort(reverse=True)
+	return [ { 'module': name, 'cumulative_us': cumulative } for cumulative, name in modules[:count] ]
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Benchmark of interpreter startup, package import and no-op build time')
+	parser.add_argument('--scenarios', nargs='+', choices=sorted(scenarios), default=sorted(scenarios))
+	parser.add_argument('--repeat', type=int, default=20,
+		help='Number of measured runs of each scenario')
+	parser.add_argument('--targets', type=int, default=10,
+		help='Number of up-to-date targets in the no-op build')
+	parser.add_argument('--imports', type=int, default=15,
+		help='Number of slowest imports of the build module to report')
+	parser.add_argument('--output', metavar='FILE', help='Write JSON results to FILE instead of stdout')
+	args = parser.parse_args(args)
+
+	results = {
+		'startup': [ startup(i, args.repeat, args.targets) for i in args.scenarios ],
+		'imports': imports('{}.build'.format(_package), args.imports)
+	}
+	write_results('startup', results, args.output)
+
+if __name__ == '__main__':
+	main()
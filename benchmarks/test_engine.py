@@ -0,0 +1,19 @@
+import unittest
+
+from .engine import config_throughput, footprint, scenario
+
+class TestEngineBenchmark(unittest.TestCase):
+	def test_shapes(self):
+		for shape, size in (('chain', 10), ('fan-out', 10), ('diamonds', 10)):
+			result = scenario(shape, size)
+			self.assertEqual(size, result['targets'], msg=shape)
+			self.assertGreater(result['graph_memory_bytes'], 0)
+
+	def test_footprint(self):
+		result = footprint('fan-out', 10)
+		self.assertGreater(result['graph_bytes_per_target'], 0)
+		self.assertGreater(result['build_peak_bytes_per_target'], 0)
+
+	def test_config_throughput(self):
+		result = config_throughput(10)
+		self.assertGreater(result['lookups_per_s'], 0)
@@ -0,0 +1,22 @@
+import unittest
+
+from .process import _parse_size, latency, throughput
+
+class TestProcessBenchmark(unittest.TestCase):
+	def test_throughput(self):
+		result = throughput(4096, 'burst', 'capture')
+		self.assertEqual(4096, result['captured_bytes'])
+		result = throughput(4096, 'lines', 'capture')
+		self.assertGreaterEqual(result['captured_bytes'], 4096)
+		result = throughput(1024, 'lines', 'echo')
+		self.assertEqual(0, result['captured_bytes'])
+
+	def test_latency(self):
+		result = latency(3, 'capture')
+		self.assertEqual(3, result['processes'])
+		self.assertLessEqual(result['median_s'], result['max_s'])
+
+	def test_parse_size(self):
+		self.assertEqual(1024, _parse_size('1K'))
+		self.assertEqual(3*1024**3, _parse_size('3G'))
+		self.assertEqual(100, _parse_size('100'))
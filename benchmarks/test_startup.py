@@ -0,0 +1,12 @@
+import unittest
+
+from .startup import _package, imports, startup
+
+class TestStartupBenchmark(unittest.TestCase):
+	def test_startup(self):
+		result = startup('noop-build', 1, 2)
+		self.assertGreater(result['median_s'], 0)
+
+	def test_imports(self):
+		result = imports('{}.config'.format(_package), 100)
+		self.assertIn('{}.config'.format(_package), [ i['module'] for i in result ])
@@ -1,12 +1,19 @@
 import argparse
+import concurrent.futures
 import copy
 import logging
+import os
 import pathlib
 import sys
 
-from .base import Profile, Scope, Target, TargetTestCase
+from .base import Profile, Target
 from .config import Config, ConfigDict
-from . import compilers
+from .scheduler import Resources, Scheduler
+from .state import State
+from .telemetry import Telemetry
+from . import compilers, staging
+
+AuthkeyVariable = 'BUILDER_WORKER_AUTHKEY'
 
 def _init_logger(verbosity):
 	def verbosity_to_level(verbosity):
@@ -34,6 +41,20 @@ def _init_logger(verbosity):
 	logging.getLogger().addHandler(handler)
 	logging.debug('Logger configured')
 
+class Session:
+	def __init__(self):
+		self.profiles = dict()
+
+	def profile(self, key, create):
+		if key not in self.profiles:
+			self.profiles[key] = create()
+		return self.profiles[key]
+
+	def close(self):
+		for _, state, _ in self.profiles.values():
+			state.close()
+		self.profiles.clear()
+
 class Build:
 	_default_warnings = ConfigDict(
 		errors=False,
@@ -50,14 +71,24 @@ class Build:
 	)
 	_default_config = ConfigDict(
 		always_outdated=False,
+		memory=None,
+		parallelism=None,
+		scratch=ConfigDict(
+			directory=None,
+			size=1024
+		),
 		directory=ConfigDict(
 			binaries =lambda config: str(pathlib.Path(config['directory.root'])/'bin'),
 			include  =lambda config: str(pathlib.Path(config['directory.root'])/'include'),
-			packages =lambda config: str(pathlib.Path(config['directory.root'])/'packages'),
+			packages =lambda config: str(pathlib.Path(config['directory.shared'])/'packages'),
+			shared   =lambda config: str(pathlib.Path(config['directory.root']).parent),
 			source   =lambda config: str(pathlib.Path(config['directory.root'])/'src'),
-			stamps   =lambda config: str(pathlib.Path(config['directory.root'])/'stamps')
+			staging  =lambda config: str(pathlib.Path(config['directory.root'])/'staging'),
+			stamps   =lambda config: str(pathlib.Path(config['directory.root'])/'stamps'),
+			store    =lambda config: str(pathlib.Path(config['directory.shared'])/'store')
 		),
 		process=ConfigDict(
+			affinity=True,
 			echo=ConfigDict(
 				stdout=False,
 				stderr=False
@@ -87,8 +118,45 @@ class Build:
 		parser = argparse.ArgumentParser(description='Builder - Integration-centered build system')
 		parser.add_argument('-v', '--verbose', action='count', default=0,
 				help='Verbose output')
-		parser.add_argument('-p', '--profile', action='store', default='default',
-				help='Select build profile')
+		parser.add_argument('-p', '--profile', action='append',
+				help='Select build profile, may be given multiple times to build profiles concurrently (default: default)')
+		parser.add_argument('--all-profiles', action='store_true',
+				help='Build all profiles concurrently')
+		parser.add_argument('-j', '--jobs', action='store', type=int, default=None,
+				help='Number of targets built concurrently (default: 1, or number of workers)')
+		parser.add_argument('-k', '--keep-going', action='store_true',
+				help='After a target fails, keep building targets that do not depend on it')
+		parser.add_argument('--no-admission', action='store_false', dest='admission',
+				help='Start ready targets whenever a job is free, ignoring memory and CPU pressure and declared memory use')
+		parser.add_argument('--workers', action='store', type=int, default=0, metavar='N',
+				help='Build targets in N local worker processes')
+		parser.add_argument('--listen', action='store', metavar='ADDRESS',
+				help='Accept workers connecting to HOST:PORT or Unix socket path; '+
+					'the shared key is read from {}'.format(AuthkeyVariable))
+		parser.add_argument('--cache', action='store', metavar='DIRECTORY',
+				help='Restore installed outputs of cacheable targets from, and store them in, artifact cache in DIRECTORY')
+		parser.add_argument('--cache-size', action='store', type=int, default=4096, metavar='MB',
+				help='Maximal size of artifact cache, least recently used artifacts are evicted (default: 4096)')
+		parser.add_argument('--scratch', action='store', metavar='DIRECTORY',
+				help='Put out-of-tree build directories of configured targets on tmpfs DIRECTORY, such as /dev/shm/builder')
+		parser.add_argument('--scratch-size', action='store', type=int, default=None, metavar='MB',
+				help='Size budget of scratch directory, build directories exceeding it stay on disk (default: 1024)')
+		parser.add_argument('--critical-path', action='store_true',
+				help='Print critical path and slack of each target, estimated from earlier builds')
+		parser.add_argument('-n', '--dry-run', '--plan', action='store_true', dest='dry_run',
+				help='Print outdated targets, the reasons and the estimated order, without building')
+		parser.add_argument('--uninstall', action='store_true',
+				help='Remove files installed by the target(s) from the root directory and mark them as not built')
+		parser.add_argument('--daemon', action='store', metavar='SOCKET',
+				help='Stay running and build on requests of clients connecting to Unix socket SOCKET')
+		parser.add_argument('--watch', action='store_true',
+				help='With --daemon, rebuild targets whose input files change')
+		parser.add_argument('--connect', action='store', metavar='SOCKET',
+				help='Ask daemon listening on SOCKET to build, and print its output')
+		parser.add_argument('--trace', action='store', metavar='FILE',
+				help='Write Chrome trace of the build (chrome://tracing, Perfetto)')
+		parser.add_argument('--summary', action='store', metavar='FILE',
+				help='Write JSON summary of per-target build times and resources')
 		parser.add_argument('target', nargs='*', type=str, metavar='TARGET',
 				help='Target(s) to build (all, if nothing passed)')
 		return parser
@@ -98,23 +166,41 @@ class Build:
 		self.profiles = {Profile('default')}
 		self.targets = set()
 
-	def __call__(self, args=None):
+	def __call__(self, args=None, invalidate=(), inputs=None, session=None):
 		parser = self._arguments_parser()
+		argv = list(args) if args is not None else sys.argv[1:]
 		args = parser.parse_args(args)
 
+		if args.connect is not None:
+			from . import daemon
+			return daemon.request(args.connect, daemon.strip_arguments(argv, {'--connect': 1}))
+		if args.daemon is not None:
+			from . import daemon
+			_init_logger(args.verbose)
+			return daemon.serve(self, args.daemon, daemon.strip_arguments(argv, {'--daemon': 1, '--watch': 0}),
+				verbosity=args.verbose, watch=args.watch)
+
 		config = Config('default', self._default_config)
 		config = Config('main', self.config, config)
-
-		try:
-			profile = next(i for i in self.profiles if i.name == args.profile)
-			config = Config('profile.{}'.format(profile.code), profile.config, config)
-		except StopIteration as e:
-			raise Exception('Profile not found: {}'.format(args.profile)) from e
+		arguments = ConfigDict()
+		if args.scratch is not None:
+			arguments['scratch.directory'] = args.scratch
+		if args.scratch_size is not None:
+			arguments['scratch.size'] = args.scratch_size
+		if arguments:
+			config = Config('arguments', arguments, config)
 
 		if 'directory.root' not in config:
 			raise Exception('Option "directory.root" does not exist')
 
-		config['directory.root'] = str(pathlib.Path(config['directory.root'])/profile.code)
+		profiles = []
+		for name in args.profile or ['default']:
+			try:
+				profiles.append(next(i for i in self.profiles if i.name == name))
+			except StopIteration as e:
+				raise Exception('Profile not found: {}'.format(name)) from e
+		if args.all_profiles:
+			profiles = sorted(self.profiles, key=lambda i: i.name)
 
 		_init_logger(args.verbose)
 
@@ -128,135 +214,96 @@ class Build:
 				except StopIteration as e:
 					raise Exception('Global target "{}" not found'.format(i)) from e
 
-		for target in targets:
-			config = Config(Target.GlobalTargetLevel, {}, config)
-			target._build(config)
-
-	def collect_targets(self, start=None):
-		if start is None:
-			result = []
-			start = self.targets
-		else:
-			result = [start]
-			start = start.dependencies
-		for i in start:
-			result += self.collect_targets(i)
-		return result;
-
-class TestBuilder(TargetTestCase):
-	def test_single_target(self):
-		build = self.mock_build(Build)
-		foo, runtime_config = self.mock_target(Target, 'foo')
-		build.targets |= {foo}
-		build()
-		self.assertTrue(runtime_config.value is not None)
-
-	def test_main_config(self):
-		build = self.mock_build(Build, config=ConfigDict(travel='ship'))
-		ben, ben_config = self.mock_target (Target, 'Ben')
-		mary, mary_config = self.mock_target(Target, 'Mary',
-			dependencies={ben},
-			config=ConfigDict(
-				travel='plane'
-			)
-		)
-		susan, susan_config = self.mock_target(Target, 'Susan',
-			config=ConfigDict(
-				travel='car'
-			)
-		)
-		joe, joe_config = self.mock_target(Target, 'Joe',
-			dependencies={mary, susan}
-		)
-
-		build.targets |= {joe}
-		build()
-		self.assertEqual('ship', joe_config.value['travel', Scope.Global])
-		self.assertEqual('car', susan_config.value['travel', Scope.Global])
-		self.assertEqual('plane', mary_config.value['travel', Scope.Global])
-		self.assertEqual('plane', ben_config.value['travel', Scope.Global])
-
-	def test_profiles(self):
-		build = self.mock_build(Build, config=ConfigDict(travel='car'))
-		by_plane = self.mock_profile(Profile, 'by_plane', config=ConfigDict(
-			travel='plane'
-		))
-		build.profiles |= {by_plane}
-		gary, gary_config = self.mock_target(Target, 'Gary', config=ConfigDict(
-			travel='ship'
-		))
-		johnny, johnny_config = self.mock_target(Target, 'Johnny')
-		build.targets |= {gary, johnny}
-		build(args=('-p', 'by_plane'))
-		self.assertEqual('plane', johnny_config.value['travel', Scope.Global])
-		self.assertEqual('ship', gary_config.value['travel', Scope.Global])
-
-	def test_defaults(self):
-		target, target_config = self.mock_target(Target, 'some_target', config=ConfigDict(
-			language=ConfigDict({
-				'c': ConfigDict(
-					flags=None
-				),
-				'c++': ConfigDict(
-					flags=None
-				)
-			})
-		))
-		self.run_target(target)
-
-		self.assertTrue(target_config.value is not None)
-		root_dir = pathlib.Path(target_config.value['directory.root'])
-
-		expected_output = Config._flatten_dict(Build._default_config.copy())
-		expected_output['language.c.flags'] = None
-		expected_output['language.c++.flags'] = None
-		expected_output.update({
-			'directory.binaries': str(root_dir/'bin'),
-			'directory.include': str(root_dir/'include'),
-			'directory.packages': str(root_dir/'packages'),
-			'directory.root': str(root_dir),
-			'directory.source': str(root_dir/'src'),
-			'directory.stamps': str(root_dir/'stamps'),
-			'target.some_target.build': True,
-			'target.some_target.file.stamp': self.comparatorAny()
-		})
-		self.assertEqual(expected_output, target_config.value.items())
-
-	def test_outdated(self):
-		bar, bar_config = self.mock_target(Target, 'bar')
-		foo, foo_config = self.mock_target(Target, 'foo',
-			dependencies={bar}
-		)
-		build = self.mock_build(Build)
-		build.targets |= {foo}
-		build()
-
-		self.assertTrue(bar_config.value is not None)
-		bar_config.value = None
+		telemetry = Telemetry()
+		remote = self._coordinator(args)
+		jobs = args.jobs if args.jobs is not None else max(1, args.workers)
+		cache = None
+		if args.cache is not None:
+			from .cache import ArtifactCache
+			cache = ArtifactCache(args.cache, args.cache_size*1024**2)
+		resources = Resources(jobs, admission=args.admission)
+		builds = []
+		try:
+			for profile in profiles:
+				create = lambda: self._profile(profile, config)
+				profile_config, state, configs = create() if session is None else \
+					session.profile((profile.name, args.scratch, args.scratch_size), create)
+				builds.append((profile, profile_config, Scheduler(
+					telemetry, state, jobs=jobs, remote=remote, cache=cache, resources=resources,
+					profile=profile.name if len(profiles) > 1 else None, inputs=inputs, keep_going=args.keep_going,
+					configs=configs)))
+				for code in invalidate:
+					state.invalidate(code)
 
-		build()
-		self.assertTrue(bar_config.value is None)
+			for profile, profile_config, scheduler in builds:
+				if len(builds) > 1 and (args.critical_path or args.uninstall or args.dry_run):
+					print('Profile {}:'.format(profile.name))
+				if args.critical_path:
+					print(scheduler.plan(targets, profile_config).report())
+				if args.uninstall:
+					for target in targets if args.target else available_targets:
+						staging.uninstall(target.code, profile_config['directory.root'],
+							pathlib.Path(profile_config['directory.staging'])/target.code, scheduler.state)
+						scheduler.state.invalidate(target.code)
+				elif args.dry_run:
+					print(scheduler.dry_run(targets, profile_config).report())
+			if args.uninstall or args.dry_run:
+				return
 
-	def test_always_outdated(self):
-		foo, foo_config = self.mock_target(Target, 'foo', config=ConfigDict(
-			always_outdated=True,
-		))
-		build = self.mock_build(Build)
-		build.targets |= {foo}
-		build()
+			if len(builds) == 1:
+				_, profile_config, scheduler = builds[0]
+				scheduler.run(targets, profile_config)
+			else:
+				with concurrent.futures.ThreadPoolExecutor(max_workers=len(builds)) as executor:
+					futures = [ executor.submit(scheduler.run, targets, profile_config) for _, profile_config, scheduler in builds ]
+				for future in futures:
+					future.result()
+		finally:
+			if remote is not None:
+				remote.close()
+			for _, _, scheduler in builds:
+				if session is None:
+					scheduler.state.close()
+				else:
+					scheduler.state.flush()
+			telemetry.finish()
+			if args.trace:
+				telemetry.write_trace(args.trace)
+			if args.summary:
+				telemetry.write_summary(args.summary)
 
-		self.assertTrue(foo_config.value is not None)
-		foo_config.value = None
+	@staticmethod
+	def _profile(profile, config):
+		profile_config = Config('profile.{}'.format(profile.code), profile.config, config)
+		profile_config['directory.root'] = str(pathlib.Path(profile_config['directory.root'])/profile.code)
+		state = State(pathlib.Path(profile_config['directory.stamps'])/'state.db')
+		state.migrate(profile_config['directory.stamps'])
+		return Config(Target.GlobalTargetLevel, {}, profile_config), state, dict()
 
-		build()
-		self.assertTrue(foo_config.value is not None)
+	def _coordinator(self, args):
+		if args.listen is None and not args.workers:
+			return None
+		from . import worker
+		if args.listen is not None:
+			authkey = os.environ.get(AuthkeyVariable)
+			if authkey is None:
+				raise Exception('Environment variable {} must be set to accept workers'.format(AuthkeyVariable))
+			coordinator = worker.Coordinator(worker._parse_address(args.listen), bytes.fromhex(authkey))
+		else:
+			coordinator = worker.Coordinator()
+		coordinator.spawn(args.workers)
+		return coordinator
 
-	def test_collect_target(self):
-		foo, foo_config = self.mock_target(Target, 'foo')
-		bar, bar_config = self.mock_target(Target, 'bar', dependencies={foo})
-		build = self.mock_build(Build)
-		build.targets |= {bar}
-		build(args=['foo'])
+	def collect_targets(self, start=None):
+		result = []
+		visited = set()
+		stack = list(reversed(list(self.targets))) if start is None else [start]
+		while stack:
+			target = stack.pop()
+			if target in visited:
+				continue
+			visited.add(target)
+			result.append(target)
+			stack.extend(reversed(list(target.dependencies)))
+		return result
 
-		self.assertTrue(foo_config.value['build'])
-		self.assertTrue(bar_config.value is None)
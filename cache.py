@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import pathlib
+import tarfile
+import tempfile
+import threading
+
+from .base import Scope, TargetConfig
+from .scheduler import CriticalPath
+
+class Snapshot:
+	def __init__(self, root, directories):
+		self.root = pathlib.Path(root)
+		self.directories = directories
+		self.files = self._scan()
+
+	def _scan(self):
+		files = dict()
+		for directory in self.directories:
+			for path, dirnames, filenames in os.walk(str(self.root/directory)):
+				for name in filenames + [ i for i in dirnames if os.path.islink(os.path.join(path, i)) ]:
+					full = os.path.join(path, name)
+					stat = os.lstat(full)
+					files[os.path.relpath(full, str(self.root))] = (stat.st_size, stat.st_mtime_ns)
+		return files
+
+	def changes(self):
+		current = self._scan()
+		return sorted(k for k, v in current.items() if self.files.get(k) != v)
+
+class ArtifactCache:
+	directories = ('bin', 'include', 'lib', 'lib64', 'libexec', 'share')
+	toolchain_keys = (
+		'language.c.compiler', 'language.c.compiler_version', 'language.c.flags',
+		'language.c++.compiler', 'language.c++.compiler_version', 'language.c++.flags',
+		'linker.flags'
+	)
+
+	def __init__(self, directory, size_limit):
+		self.directory = pathlib.Path(directory)
+		self.size_limit = size_limit
+		self._keys = dict()
+		self._lock = threading.Lock()
+		try:
+			self.directory.mkdir(parents=True)
+		except FileExistsError:
+			pass
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def _artifact(self, key):
+		return self.directory/'{}.tar.gz'.format(key)
+
+	def _key(self, target, config, inputs, dependency_keys):
+		config = TargetConfig(target, config)
+		root = str(config['directory.root'])
+		def resolve(key, scope):
+			try:
+				return repr(config[key, scope]).replace(root, '<root>')
+			except Exception:
+				return None
+		resolved = [ (key, resolve(key, Scope.Global)) for key in sorted(target._config) ]
+		toolchain = [ (key, resolve(key, Scope.Auto)) for key in self.toolchain_keys ]
+		data = repr((target.fingerprint(), inputs, resolved, toolchain, sorted(dependency_keys)))
+		return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+	def key(self, target, configs, inputs=lambda target: None):
+		with self._lock:
+			keys = self._keys.setdefault(id(configs), dict())
+			for i in CriticalPath._topological([target]):
+				if i not in keys:
+					keys[i] = self._key(i, configs[i], inputs(i), [ keys[j] for j in i.dependencies ])
+			return keys[target]
+
+	def snapshot(self, root, directories=None):
+		return Snapshot(root, directories if directories is not None else self.directories)
+
+	def restore(self, key, root):
+		artifact = self._artifact(key)
+		try:
+			with tarfile.open(str(artifact)) as archive:
+				archive.extractall(str(root))
+		except FileNotFoundError:
+			return False
+		os.utime(str(artifact))
+		return True
+
+	def store(self, key, snapshot):
+		files = snapshot.changes()
+		descriptor, temporary = tempfile.mkstemp(dir=str(self.directory), suffix='.tmp')
+		os.close(descriptor)
+		try:
+			with tarfile.open(temporary, 'w:gz') as archive:
+				for name in files:
+					archive.add(str(snapshot.root/name), arcname=name, recursive=False)
+			os.replace(temporary, str(self._artifact(key)))
+		except:
+			os.unlink(temporary)
+			raise
+		logging.debug('Stored artifact {} with {} files'.format(key, len(files)))
+		self.evict()
+
+	def evict(self):
+		artifacts = []
+		for artifact in self.directory.glob('*.tar.gz'):
+			try:
+				stat = artifact.stat()
+			except FileNotFoundError:
+				continue
+			artifacts.append((stat.st_mtime, stat.st_size, artifact))
+		artifacts.sort()
+		total = sum(size for _, size, _ in artifacts)
+		while artifacts and total > self.size_limit:
+			_, size, artifact = artifacts.pop(0)
+			logging.debug('Evicting artifact {}'.format(artifact.name))
+			try:
+				artifact.unlink()
+			except FileNotFoundError:
+				pass
+			total -= size
+
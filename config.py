@@ -1,16 +1,114 @@
+import collections.abc
 import logging
-import unittest
+import sys
 
-from .tests import _fn_log, TestCase
+from .log import _fn_log
 
 class ConfigDict(dict):
 	def __repr__(self):
 		return'<ConfigDict {}>'.format(super().__repr__())
 
+class FrozenDict(dict):
+	def _immutable(self, *args, **kwargs):
+		raise TypeError('{} is immutable'.format(self.__class__.__qualname__))
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+	def __reduce__(self):
+		return (FrozenDict, (dict(self),))
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+class DefaultedDict(dict):
+	__slots__ = ('prefix', 'defaults')
+
+	def __init__(self, items=(), prefix='', defaults=None):
+		super().__init__(items)
+		self.prefix = prefix
+		self.defaults = defaults if defaults is not None else dict()
+
+	def _default(self, key):
+		if key.startswith(self.prefix) and key[len(self.prefix):] in self.defaults:
+			return key[len(self.prefix):]
+		return None
+
+	def __missing__(self, key):
+		if self.defaults and key.startswith(self.prefix):
+			try:
+				return self.defaults[key[len(self.prefix):]]
+			except KeyError:
+				pass
+		raise KeyError(key)
+
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or self._default(key) is not None
+
+	def __iter__(self):
+		yield from dict.__iter__(self)
+		for key in self.defaults:
+			key = self.prefix+key
+			if not dict.__contains__(self, key):
+				yield key
+
+	def __len__(self):
+		return sum(1 for _ in self)
+
+	def keys(self):
+		return list(self)
+
+	def items(self):
+		return [ (k, self[k]) for k in self ]
+
+	def copy(self):
+		return DefaultedDict(dict.items(self), self.prefix, self.defaults)
+
+class ConfigView(collections.abc.Mapping):
+	__slots__ = ('_config', '_prefix', '_keys', '_values')
+
+	def __init__(self, config, prefix, keys):
+		self._config = config
+		self._prefix = prefix
+		self._keys = dict.fromkeys(i[len(prefix):] for i in keys)
+		self._values = dict()
+
+	def __repr__(self):
+		return '<{} {}*>'.format(self.__class__.__qualname__, self._prefix)
+
+	def __getitem__(self, key):
+		try:
+			return self._values[key]
+		except KeyError:
+			if key not in self._keys:
+				raise
+		value = self._config[self._prefix+key]
+		self._values[key] = value
+		return value
+
+	def __iter__(self):
+		return iter(self._keys)
+
+	def __len__(self):
+		return len(self._keys)
+
+	def __contains__(self, key):
+		return key in self._keys
+
+	def keys(self):
+		return self._keys.keys()
+
+	def copy(self):
+		return dict(self.items())
+
 class Config:
+	__slots__ = ('name', 'config', 'parent', '_shared')
+
 	@staticmethod
 	def _flatten_dict(dictionary, prefix=''):
-		prefixed = lambda key: '{}.{}'.format(prefix, key) if prefix else key
+		prefixed = lambda key: sys.intern('{}.{}'.format(prefix, key)) if prefix else key
 		output = {}
 		for key, value in dictionary.items():
 			if isinstance(value, ConfigDict):
@@ -22,7 +120,7 @@ class Config:
 	@staticmethod
 	def _flatten_value(key, value):
 		output = {}
-		if isinstance(value, dict):
+		if isinstance(value, collections.abc.Mapping):
 			output.update(Config._flatten_dict(value, key))
 		else:
 			output[key] = value
@@ -30,7 +128,11 @@ class Config:
 
 	def __init__(self, name, config=None, parent=None):
 		self.name = name
-		self.config = self._flatten_dict(config) if config is not None else dict()
+		self._shared = isinstance(config, DefaultedDict)
+		if self._shared:
+			self.config = config
+		else:
+			self.config = self._flatten_dict(config) if config is not None else dict()
 		self.parent = parent
 
 	def __repr__(self):
@@ -41,8 +143,11 @@ class Config:
 		if self.parent is not None:
 			self.parent._dump()
 
+	def keys(self):
+		return self._subtree_keys('').keys()
+
 	def items(self):
-		return { k: self[k] for k in self }
+		return ConfigView(self, '', self._subtree_keys(''))
 
 	@staticmethod
 	def _arg_key(key):
@@ -51,23 +156,24 @@ class Config:
 		return dict(key=key, level=None)
 
 	def _get_subelements(self, key):
-		return { k for k in self.config if k.startswith(key+'.') }
+		return { k for k in list(self.config) if k.startswith(key+'.') }
 
 	@_fn_log(logging.DEBUG-2)
 	def get_single(self, key, top_config=None, level=None, resolve=False):
 		assert top_config is not None
-		try:
-			if level is not None and self.name != level:
-				raise KeyError(key)
-			value = self.config[key]
-			if callable(value) and resolve:
-				logging.log(logging.DEBUG-2, 'Resolving callable value for {}={}'.format(key, value))
-				value = value(top_config)
-			return value
-		except KeyError:
-			if self.parent is None:
-				raise
-			return self.parent.get(key, top_config=top_config, level=level, resolve=resolve)
+		config = self
+		while config is not None:
+			if level is None or config.name == level:
+				try:
+					value = config.config[key]
+					if callable(value) and resolve:
+						logging.log(logging.DEBUG-2, 'Resolving callable value for {}={}'.format(key, value))
+						value = value(top_config)
+					return value
+				except KeyError:
+					pass
+			config = config.parent
+		raise KeyError(key)
 
 	@_fn_log(logging.DEBUG-2)
 	def get(self, key, *args, **kwargs):
@@ -77,24 +183,35 @@ class Config:
 			return self.get_single(key, *args, **kwargs)
 		except KeyError:
 			prefix = key+'.'
-			output = {}
-			for i in kwargs['top_config']:
-				if i.startswith(prefix):
-					output[i[len(prefix):]] = kwargs['top_config'][i]
-			if len(output) == 0:
+			keys = self._subtree_keys(prefix)
+			if len(keys) == 0:
 				raise KeyError(key)
-			return output
+			return ConfigView(kwargs['top_config'], prefix, keys)
+
+	def _level_keys(self, prefix):
+		return [ k for k in list(self.config) if k.startswith(prefix) ]
+
+	def _subtree_keys(self, prefix):
+		keys = dict()
+		config = self
+		while config is not None:
+			keys.update(dict.fromkeys(config._level_keys(prefix)))
+			config = config.parent
+		return keys
 
 	@_fn_log(logging.DEBUG-2)
 	def set(self, key, value, level=None):
-		if level is not None and self.name != level:
-			self.parent.set(key, value, level)
-		else:
-			remove = self._get_subelements(key)
-			for i in remove:
-				del self.config[i]
-			add = self._flatten_value(key, value)
-			self.config.update(add)
+		config = self
+		while level is not None and config.name != level:
+			config = config.parent
+		if config._shared:
+			config.config = config.config.copy()
+			config._shared = False
+		remove = config._get_subelements(key)
+		for i in remove:
+			config.config.pop(i, None)
+		add = self._flatten_value(key, value)
+		config.config.update(add)
 
 	def __getitem__(self, key):
 		return self.get(resolve=True, top_config=self, **self._arg_key(key))
@@ -110,127 +227,29 @@ class Config:
 			return False
 
 	def __len__(self):
-		parent_keys = set(self.parent.config.keys()) if self.parent is not None else set()
-		return len(set(self.config.keys()) | parent_keys)
+		return len(self._subtree_keys(''))
 
 	@_fn_log(logging.DEBUG-2)
 	def __iter__(self):
 		class Iterator:
 			def __init__(self, config):
 				self.config = config
-				self.iterator = iter(self.config.config)
+				self.iterator = iter(list(self.config.config))
 				self.visited = set()
 
 			def __iter__(self):
 				return self
 
 			def __next__(self):
-				try:
-					while True:
-						key = next(self.iterator)
+				while True:
+					for key in self.iterator:
 						if key not in self.visited:
 							self.visited.add(key)
 							return key
-				except StopIteration:
 					if self.config.parent is None:
-						raise
+						raise StopIteration
 					self.config = self.config.parent
-					self.iterator = iter(self.config.config)
-					return next(self)
+					self.iterator = iter(list(self.config.config))
 
 		return Iterator(self)
 
-class TestConfig(TestCase):
-	def test_single_config(self):
-		config = Config('single')
-		self.assertEqual(0, len(config))
-		self.assertEqual(0, len(list(config)))
-
-		config['some.key'] = 'some value'
-		self.assertEqual(1, len(config))
-		self.assertEqual(1, len(list(config)))
-		self.assertEqual('some value', config['some.key'])
-
-	def test_inheit_config(self):
-		parent = Config('parent')
-		parent.config['travel'] = 'Car'
-		self.assertEqual(1, len(parent))
-		self.assertEqual(1, len(list(parent)))
-		self.assertEqual('Car', parent['travel'])
-
-		child = Config('child', parent=parent)
-		self.assertEqual(1, len(child))
-		self.assertEqual(1, len(list(child)))
-		self.assertEqual('Car', child['travel'])
-
-		child['travel'] = 'Plane'
-		self.assertEqual(1, len(child))
-		self.assertEqual(1, len(list(child)))
-		self.assertEqual('Plane', child['travel'])
-		self.assertEqual('Car', child['travel', 'parent'])
-
-		child['ticket'] = 100
-		self.assertEqual(2, len(child))
-		self.assertEqual(2, len(list(child)))
-		self.assertEqual('Plane', child['travel'])
-		self.assertEqual(100, child['ticket'])
-
-		self.assertEqual(1, len(parent))
-		self.assertEqual(1, len(list(parent)))
-		self.assertEqual('Car', parent['travel'])
-
-		child['travel', 'parent'] = 'Ship'
-		self.assertEqual(1, len(parent))
-		self.assertEqual(1, len(list(parent)))
-		self.assertEqual('Ship', parent['travel'])
-
-	def test_callable(self):
-		config = Config('cfg')
-		config['foo'] = 'bar'
-		config['baz'] = lambda config: config['foo']+' yea'
-		self.assertEqual('bar', config['foo'])
-		self.assertEqual('bar yea', config['baz'])
-
-	def test_dict_hierarchy(self):
-		config = Config('cfg', config=ConfigDict(
-			keyboard=ConfigDict(
-				count=104,
-				layout=ConfigDict(
-					usa='qwerty'
-				)
-			)
-		))
-		self.assertEqual(104, config['keyboard.count'])
-		self.assertEqual('qwerty', config['keyboard.layout.usa'])
-		self.assertRaises(KeyError, lambda: config['keyboard.layout.france'])
-		self.assertRaises(KeyError, lambda: config['keyboard.layout.germany'])
-		self.assertEqual({'usa': 'qwerty'}, config['keyboard.layout'])
-
-		config['keyboard.layout.france'] = 'azerty'
-		self.assertEqual(104, config['keyboard.count'])
-		self.assertEqual('qwerty', config['keyboard.layout.usa'])
-		self.assertEqual('azerty', config['keyboard.layout.france'])
-		self.assertRaises(KeyError, lambda: config['keyboard.layout.germany'])
-		self.assertEqual({'usa': 'qwerty', 'france': 'azerty'}, config['keyboard.layout'])
-
-		config['keyboard.layout'] = {
-			'germany': 'qwertz'
-		}
-		self.assertEqual(104, config['keyboard.count'])
-		self.assertRaises(KeyError, lambda: config['keyboard.layout.usa'])
-		self.assertRaises(KeyError, lambda: config['keyboard.layout.france'])
-		self.assertEqual('qwertz', config['keyboard.layout.germany'])
-		self.assertEqual({'germany': 'qwertz'}, config['keyboard.layout'])
-
-	def test_items(self):
-		cfg = ConfigDict(
-			keyboard=ConfigDict(
-				count=104,
-				layout=ConfigDict(
-					usa='qwerty',
-					france='azerty'
-				)
-			)
-		)
-		config = Config('cfg', config=cfg)
-		self.assertEqual(Config._flatten_dict(cfg), config.items())
@@ -0,0 +1,336 @@
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import logging
+import multiprocessing.connection
+import os
+import pathlib
+import select
+import struct
+import sys
+import threading
+import time
+import traceback
+
+def strip_arguments(argv, options):
+	result = []
+	skip = 0
+	for i in argv:
+		if skip:
+			skip -= 1
+			continue
+		name = i.split('=', 1)[0]
+		if name in options:
+			if '=' not in i:
+				skip = options[name]
+			continue
+		result.append(i)
+	return result
+
+def _contains(path, changed):
+	return changed == path or changed.startswith(path.rstrip(os.sep)+os.sep)
+
+class PollingWatcher:
+	def __init__(self, interval=1.0):
+		self.interval = interval
+		self._paths = set()
+		self._files = dict()
+
+	def _stat(self, path, files):
+		try:
+			stat = os.stat(path)
+		except FileNotFoundError:
+			return
+		files[path] = (stat.st_size, stat.st_mtime_ns)
+
+	def _scan(self):
+		files = dict()
+		for root in self._paths:
+			if not os.path.isdir(root):
+				self._stat(root, files)
+				continue
+			for path, _, filenames in os.walk(root):
+				for name in filenames:
+					self._stat(os.path.join(path, name), files)
+		return files
+
+	def watch(self, paths):
+		self._paths = set(map(str, paths))
+		self._files = self._scan()
+
+	def wait(self, timeout):
+		deadline = time.monotonic()+timeout
+		while True:
+			files = self._scan()
+			changed = { k for k in set(files) | set(self._files) if files.get(k) != self._files.get(k) }
+			self._files = files
+			remaining = deadline - time.monotonic()
+			if changed or remaining <= 0:
+				return changed
+			time.sleep(min(self.interval, remaining))
+
+	def close(self):
+		pass
+
+class InotifyWatcher:
+	_modify, _attrib, _close_write, _moved_from, _moved_to, _create, _delete = 0x2, 0x4, 0x8, 0x40, 0x80, 0x100, 0x200
+	_overflow = 0x4000
+	_is_directory = 0x40000000
+	_event = struct.Struct('iIII')
+
+	def __init__(self):
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+		self._mask = self._modify | self._attrib | self._close_write | self._moved_from | self._moved_to | self._create | self._delete
+		self._watches = dict()
+		self._paths = set()
+
+	def _add(self, directory):
+		for path, _, _ in os.walk(directory):
+			descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self._mask)
+			if descriptor >= 0:
+				self._watches[descriptor] = path
+
+	def watch(self, paths):
+		for descriptor in self._watches:
+			self._libc.inotify_rm_watch(self._fd, descriptor)
+		self._watches.clear()
+		self._paths = set(map(str, paths))
+		for path in self._paths:
+			if os.path.isdir(path):
+				self._add(path)
+			else:
+				descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(os.path.dirname(path) or '.'), self._mask)
+				if descriptor >= 0:
+					self._watches[descriptor] = os.path.dirname(path) or '.'
+		while self._read(0):
+			pass
+
+	def _read(self, timeout):
+		readable, _, _ = select.select([self._fd], [], [], timeout)
+		if not readable:
+			return None
+		data = os.read(self._fd, 65536)
+		changed = set()
+		offset = 0
+		while offset < len(data):
+			descriptor, mask, _, length = self._event.unpack_from(data, offset)
+			offset += self._event.size
+			name = data[offset:offset+length].rstrip(b'\0')
+			offset += length
+			if mask & self._overflow:
+				changed |= self._paths
+				continue
+			directory = self._watches.get(descriptor)
+			if directory is None:
+				continue
+			path = os.path.join(directory, os.fsdecode(name)) if name else directory
+			if mask & self._is_directory and mask & (self._create | self._moved_to):
+				self._add(path)
+			if any(_contains(i, path) for i in self._paths):
+				changed.add(path)
+		return changed
+
+	def wait(self, timeout):
+		changed = self._read(timeout)
+		return changed if changed is not None else set()
+
+	def close(self):
+		os.close(self._fd)
+
+def watcher():
+	try:
+		return InotifyWatcher()
+	except (OSError, AttributeError) as e:
+		logging.info('inotify is not available ({}), polling for changes'.format(e))
+		return PollingWatcher()
+
+class _Output(io.TextIOBase):
+	def __init__(self, connection):
+		self._connection = connection
+		self._lock = threading.Lock()
+
+	def write(self, data):
+		if data:
+			with self._lock:
+				try:
+					self._connection.send(('output', data))
+				except OSError:
+					pass
+		return len(data)
+
+class Daemon:
+	debounce = 0.2
+
+	def __init__(self, build, address, args, verbosity=0, watch=False):
+		self.build = build
+		self.address = str(address)
+		self.args = args
+		self.verbosity = verbosity
+		self.inputs = dict()
+		self.session = None
+		self.watcher = watcher() if watch else None
+		self._lock = threading.Lock()
+		self._watch_lock = threading.Lock()
+		self._stopped = False
+
+		self._authkey = os.urandom(16)
+		if os.path.exists(self.address):
+			os.unlink(self.address)
+		descriptor = os.open(self._key_file(self.address), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		with os.fdopen(descriptor, 'w') as f:
+			f.write(self._authkey.hex())
+		self._listener = multiprocessing.connection.Listener(self.address, family='AF_UNIX', authkey=self._authkey)
+
+	@staticmethod
+	def _key_file(address):
+		return str(address)+'.key'
+
+	def run_build(self, args, invalidate=(), output=None):
+		from .build import Session, _init_logger
+		with self._lock:
+			if self.session is None:
+				self.session = Session()
+			inputs = dict()
+			try:
+				with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+					self.build(args, invalidate=invalidate, inputs=inputs, session=self.session)
+			finally:
+				_init_logger(self.verbosity)
+				self.inputs.update(inputs)
+				if self.watcher is not None:
+					with self._watch_lock:
+						self.watcher.watch({ i for paths in self.inputs.values() for i in paths })
+
+	def affected(self, changed):
+		targets = self.build.collect_targets()
+		dependents = { t: set() for t in targets }
+		for target in targets:
+			for dependency in target.dependencies:
+				dependents[dependency].add(target)
+		stack = [ t for t, paths in self.inputs.items() if any(_contains(p, c) for p in paths for c in changed) ]
+		affected = set()
+		while stack:
+			target = stack.pop()
+			if target not in affected:
+				affected.add(target)
+				stack.extend(dependents.get(target, ()))
+		return affected
+
+	def _watch(self):
+		while not self._stopped:
+			with self._watch_lock:
+				if self._stopped:
+					break
+				changed = self.watcher.wait(0.5)
+			if not changed:
+				continue
+			while True:
+				with self._watch_lock:
+					more = self.watcher.wait(self.debounce)
+				if not more:
+					break
+				changed |= more
+			affected = self.affected(changed)
+			if not affected:
+				continue
+			logging.info('Changed {}, rebuilding {}'.format(', '.join(sorted(changed)), ', '.join(sorted(t.name for t in affected))))
+			try:
+				self.run_build(self.args, invalidate={ t.code for t in affected })
+			except Exception:
+				logging.error('Rebuild failed:\n{}'.format(traceback.format_exc()))
+
+	def _handle(self, connection):
+		try:
+			command, args = connection.recv()
+			if command == 'stop':
+				self.stop()
+				connection.send(('done', None))
+				return
+			try:
+				self.run_build(args, output=_Output(connection))
+				result = ('done', None)
+			except Exception:
+				result = ('failed', traceback.format_exc())
+			connection.send(result)
+		except (EOFError, OSError):
+			pass
+		finally:
+			connection.close()
+
+	def serve(self):
+		logging.info('Daemon listening on {}'.format(self.address))
+		if self.watcher is not None:
+			try:
+				self.run_build(self.args)
+			except Exception:
+				logging.error('Build failed:\n{}'.format(traceback.format_exc()))
+			threading.Thread(target=self._watch, daemon=True).start()
+		try:
+			while not self._stopped:
+				try:
+					connection = self._listener.accept()
+				except (OSError, multiprocessing.AuthenticationError) as e:
+					if not self._stopped:
+						logging.warning('Rejected client connection: {}'.format(e))
+					continue
+				if self._stopped:
+					connection.close()
+					break
+				threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+		finally:
+			self._listener.close()
+			with self._watch_lock:
+				if self.watcher is not None:
+					self.watcher.close()
+			with self._lock:
+				if self.session is not None:
+					self.session.close()
+			for path in (self.address, self._key_file(self.address)):
+				try:
+					os.unlink(path)
+				except FileNotFoundError:
+					pass
+
+	def stop(self):
+		self._stopped = True
+		try:
+			multiprocessing.connection.Client(self.address, family='AF_UNIX', authkey=self._authkey).close()
+		except OSError:
+			pass
+
+def serve(build, address, args, verbosity=0, watch=False):
+	Daemon(build, address, args, verbosity=verbosity, watch=watch).serve()
+
+def request(address, args, command='build', output=None):
+	output = output if output is not None else sys.stdout
+	authkey = bytes.fromhex(pathlib.Path(Daemon._key_file(address)).read_text())
+	connection = multiprocessing.connection.Client(str(address), family='AF_UNIX', authkey=authkey)
+	try:
+		connection.send((command, list(args)))
+		while True:
+			kind, data = connection.recv()
+			if kind == 'output':
+				output.write(data)
+				output.flush()
+			elif kind == 'done':
+				return
+			else:
+				raise Exception('Build in daemon failed:\n{}'.format(data))
+	finally:
+		connection.close()
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Builder client - requests builds from a running daemon')
+	parser.add_argument('socket', help='Unix socket the daemon listens on')
+	parser.add_argument('--stop', action='store_true', help='Stop the daemon')
+	parser.add_argument('arguments', nargs=argparse.REMAINDER, help='Arguments of the build')
+	args = parser.parse_args(args)
+	request(args.socket, args.arguments, command='stop' if args.stop else 'build')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+import errno
+import fcntl
+import os
+import pathlib
+import socket
+import threading
+import time
+
+_threads_lock = threading.Lock()
+_thread_locks = dict()
+_thread_owners = dict()
+
+def _thread_lock(path):
+	with _threads_lock:
+		return _thread_locks.setdefault(path, threading.Lock())
+
+class TargetLock:
+	def __init__(self, directory, code):
+		self.path = pathlib.Path(directory)/'{}.lock'.format(code)
+		self._file = None
+		self._key = os.path.abspath(str(self.path))
+		self._thread_lock = _thread_lock(self._key)
+
+	def _open(self):
+		try:
+			descriptor = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+		except FileNotFoundError:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			descriptor = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+		return os.fdopen(descriptor, 'r+')
+
+	@staticmethod
+	def _owner(f):
+		f.seek(0)
+		return f.read().strip() or None
+
+	def acquire(self, waiting=None):
+		if not self._thread_lock.acquire(blocking=False):
+			if waiting is not None:
+				waiting(_thread_owners.get(self._key))
+			self._thread_lock.acquire()
+		try:
+			f = self._open()
+		except:
+			self._thread_lock.release()
+			raise
+		try:
+			try:
+				fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except OSError as e:
+				if e.errno not in (errno.EACCES, errno.EAGAIN):
+					raise
+				if waiting is not None:
+					waiting(self._owner(f))
+				fcntl.lockf(f, fcntl.LOCK_EX)
+			stale = self._owner(f)
+			owner = '{} {} {:.0f}'.format(socket.gethostname(), os.getpid(), time.time())
+			f.seek(0)
+			f.truncate()
+			f.write(owner+'\n')
+			f.flush()
+			_thread_owners[self._key] = owner
+		except:
+			f.close()
+			self._thread_lock.release()
+			raise
+		self._file = f
+		return stale
+
+	def release(self):
+		f, self._file = self._file, None
+		f.seek(0)
+		f.truncate()
+		f.flush()
+		fcntl.lockf(f, fcntl.LOCK_UN)
+		f.close()
+		_thread_owners.pop(self._key, None)
+		self._thread_lock.release()
+
@@ -0,0 +1,25 @@
+import functools
+import logging
+import sys
+
+def _log(level, msg):
+	logging.log(level, msg)
+
+def _fn_log(level):
+	def wrapper1(fn):
+		@functools.wraps(fn)
+		def wrapper2(*args, **kwargs):
+			if not logging.getLogger().isEnabledFor(level):
+				return fn(*args, **kwargs)
+			_log(level, '{}({}, {})'.format(fn.__qualname__, ', '.join(map(repr, args)),
+				', '.join(['{}={}'.format(repr(k), repr(v)) for k, v in kwargs.items()]) ))
+			try:
+				r = fn(*args, **kwargs)
+				_log(level, '{}(...) = {}'.format(fn.__qualname__, repr(r)))
+			except:
+				exc_type, exc, trace = sys.exc_info()
+				_log(level, '{}(...) ----raise----> {} {}'.format(fn.__qualname__, exc_type, exc))
+				raise
+			return r
+		return wrapper2
+	return wrapper1
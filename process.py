@@ -1,3 +1,4 @@
+import contextlib
 import fcntl
 import logging
 import pty
@@ -6,7 +7,6 @@ import subprocess
 import sys
 import time
 import threading
-import unittest
 
 class Process:
 	@staticmethod
@@ -15,9 +15,25 @@ class Process:
 		flags = flags | os.O_NONBLOCK
 		fcntl.fcntl(fd, fcntl.F_SETFL, flags)
 
+	@staticmethod
+	@contextlib.contextmanager
+	def _affinity(affinity):
+		previous = None
+		if affinity and hasattr(os, 'sched_setaffinity'):
+			try:
+				previous = os.sched_getaffinity(0)
+				os.sched_setaffinity(0, affinity)
+			except OSError:
+				previous = None
+		try:
+			yield
+		finally:
+			if previous is not None:
+				os.sched_setaffinity(0, previous)
+
 	def __init__(self, args, cwd=None, env=None, stdin=False,
 			echo_stdout=True, echo_stderr=True,
-			capture_stdout=False, capture_stderr=False):
+			capture_stdout=False, capture_stderr=False, affinity=None):
 		if cwd is not None:
 			cwd = str(cwd)
 
@@ -26,8 +42,10 @@ class Process:
 		logging.debug('Working directory: {}'.format(cwd))
 		logging.debug('Environment: {}'.format(env))
 		logging.debug('Echo: stdout: {}, stderr: {}'.format(echo_stdout, echo_stderr))
+		logging.debug('CPU affinity: {}'.format(affinity))
 
 		self.args = args
+		self.rusage = None
 
 		self.buffer_stdout = bytearray()
 		self.buffer_stderr = bytearray()
@@ -37,9 +55,11 @@ class Process:
 
 		Process.set_nonblocking(master_stdout)
 		Process.set_nonblocking(master_stderr)
+		self._descriptors = (master_stdout, slave_stdout, master_stderr, slave_stderr)
 
-		self.process = subprocess.Popen(args, bufsize=0, cwd=cwd, env=env,
-			stdin=stdin, stdout=slave_stdout, stderr=slave_stderr)
+		with Process._affinity(affinity):
+			self.process = subprocess.Popen(args, bufsize=0, cwd=cwd, env=env,
+				stdin=stdin, stdout=slave_stdout, stderr=slave_stderr)
 
 		pass_to_stdout = sys.stdout.buffer if echo_stdout else None
 		pass_to_stderr = sys.stderr.buffer if echo_stderr else None
@@ -60,13 +80,20 @@ class Process:
 		stop.set()
 		done.wait()
 
+	def _wait(self):
+		_, status, self.rusage = os.wait4(self.process.pid, 0)
+		self.process.returncode = os.waitstatus_to_exitcode(status)
+		return self.process.returncode
+
 	def communicate(self):
-		result = self.process.wait()
+		result = self._wait()
 
 		time.sleep(0.1)
 
 		self.reader_join(*self._reader_stdout)
 		self.reader_join(*self._reader_stderr)
+		for fd in self._descriptors:
+			os.close(fd)
 
 		logging.debug('Running {} done.'.format(self.args[0]))
 
@@ -93,23 +120,3 @@ class Process:
 
 		done.set()
 
-class TestProcess(unittest.TestCase):
-	message_out = 'Well done!'
-	message_err = 'Really nice!'
-
-	def test_process(self):
-		executable = sys.executable
-		process = Process(
-			args=[executable, '-c', 'import sys;print("{stdout}");sys.stderr.write("{stderr}")'.format(
-				stdout=self.message_out, stderr=self.message_err
-			)],
-			capture_stdout=True,
-			capture_stderr=True,
-			echo_stdout=False,
-			echo_stderr=False
-		)
-		stdout, stderr = process.communicate()
-		stdout = stdout.decode('utf-8').strip()
-		stderr = stderr.decode('utf-8').strip()
-		self.assertEqual(self.message_out, stdout)
-		self.assertEqual(self.message_err, stderr)
@@ -0,0 +1,337 @@
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from .admission import Admission
+
+class CriticalPath:
+	def __init__(self, targets, duration):
+		self.targets = self._topological(targets)
+		self.duration = { t: duration(t) for t in self.targets }
+		self.dependents = { t: set() for t in self.targets }
+		for target in self.targets:
+			for dependency in target.dependencies:
+				self.dependents[dependency].add(target)
+
+		self.start = dict()
+		for target in self.targets:
+			self.start[target] = max((self.finish(i) for i in target.dependencies), default=0.0)
+		self.length = max((self.finish(t) for t in self.targets), default=0.0)
+
+		self.remaining = dict()
+		for target in reversed(self.targets):
+			self.remaining[target] = self.duration[target] + \
+				max((self.remaining[i] for i in self.dependents[target]), default=0.0)
+
+	@staticmethod
+	def _topological(targets):
+		order = []
+		visited = set()
+		for root in targets:
+			if root in visited:
+				continue
+			visited.add(root)
+			stack = [(root, iter(root.dependencies))]
+			while stack:
+				target, dependencies = stack[-1]
+				for dependency in dependencies:
+					if dependency not in visited:
+						visited.add(dependency)
+						stack.append((dependency, iter(dependency.dependencies)))
+						break
+				else:
+					stack.pop()
+					order.append(target)
+		return order
+
+	def finish(self, target):
+		return self.start[target] + self.duration[target]
+
+	def slack(self, target):
+		return self.length - self.start[target] - self.remaining[target]
+
+	def path(self):
+		path = []
+		candidates = [ t for t in self.targets if not t.dependencies ]
+		while candidates:
+			target = max(candidates, key=lambda t: self.remaining[t])
+			path.append(target)
+			candidates = self.dependents[target]
+		return path
+
+	def report(self):
+		lines = ['Critical path ({:.2f}s):'.format(self.length)]
+		for target in self.path():
+			lines.append('  {:>10.2f}s  {}'.format(self.duration[target], target.name))
+		lines.append('Slack:')
+		for target in sorted(self.targets, key=lambda t: (self.slack(t), t.name)):
+			lines.append('  {:>10.2f}s  {}'.format(self.slack(target), target.name))
+		return '\n'.join(lines)
+
+class Plan:
+	def __init__(self, critical_path, reasons, duration, jobs):
+		self.reasons = reasons
+		self.order = []
+
+		duration = lambda t, estimate=duration: estimate(t) if reasons[t] is not None else 0.0
+		counter = itertools.count()
+		waiting = { t: len(t.dependencies) for t in critical_path.targets }
+		ready = [ (-critical_path.remaining[t], next(counter), t) for t, count in waiting.items() if count == 0 ]
+		heapq.heapify(ready)
+		running = []
+		now = 0.0
+		while ready or running:
+			while ready and len(running) < jobs:
+				_, _, target = heapq.heappop(ready)
+				self.order.append((now, target))
+				heapq.heappush(running, (now+duration(target), next(counter), target))
+			now, _, target = heapq.heappop(running)
+			for dependent in critical_path.dependents[target]:
+				waiting[dependent] -= 1
+				if waiting[dependent] == 0:
+					heapq.heappush(ready, (-critical_path.remaining[dependent], next(counter), dependent))
+		self.length = now
+		self.jobs = jobs
+
+	def outdated(self):
+		return [ target for _, target in self.order if self.reasons[target] is not None ]
+
+	def report(self):
+		outdated = self.outdated()
+		lines = ['Plan: {} of {} targets to build, estimated {:.2f}s with {} job(s)'.format(
+			len(outdated), len(self.order), self.length, self.jobs)]
+		for start, target in self.order:
+			if self.reasons[target] is not None:
+				lines.append('  {:>10.2f}s  {}: {}'.format(start, target.name, self.reasons[target]))
+		return '\n'.join(lines)
+
+def available_cpus():
+	if hasattr(os, 'sched_getaffinity'):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count() or 1))
+
+class Cores:
+	def __init__(self, cpus, slots):
+		self.cpus = sorted(cpus)
+		self.slots = slots
+		self._load = dict.fromkeys(self.cpus, 0)
+		self._weights = dict()
+		self._queued = dict()
+		self._lock = threading.Lock()
+
+	def queue(self, owner, count):
+		with self._lock:
+			if count:
+				self._queued[owner] = count
+			else:
+				self._queued.pop(owner, None)
+
+	def _share(self, weight):
+		others = sum(self._weights.values())
+		waiting = sum(self._queued.values()) - len(self._weights) - 1
+		idle = max(0, min(waiting, self.slots - len(self._weights) - 1))
+		share = round(len(self.cpus)*weight/(weight+others+idle))
+		return max(1, min(len(self.cpus), share))
+
+	@contextlib.contextmanager
+	def allocate(self, weight=1.0):
+		weight = max(weight, 1.0)
+		token = object()
+		with self._lock:
+			cpus = sorted(sorted(self.cpus, key=lambda i: self._load[i])[:self._share(weight)])
+			for cpu in cpus:
+				self._load[cpu] += 1
+			self._weights[token] = weight
+		try:
+			yield cpus
+		finally:
+			with self._lock:
+				for cpu in cpus:
+					self._load[cpu] -= 1
+				del self._weights[token]
+
+class Resources:
+	def __init__(self, jobs, cpus=None, admission=True):
+		self.cores = Cores(cpus if cpus is not None else available_cpus(), jobs)
+		self.admission = Admission(jobs, len(self.cores.cpus)) if admission else None
+		self._slots = threading.BoundedSemaphore(jobs)
+		self._targets = collections.defaultdict(threading.Lock)
+		self._lock = threading.Lock()
+		self._started = 0
+		self._running = 0
+
+	def isolation(self):
+		with self._lock:
+			return (self._started, self._running)
+
+	def queue(self, owner, count):
+		self.cores.queue(owner, count)
+
+	def admit(self, memory=None):
+		return self.admission.admit(memory) if self.admission is not None else object()
+
+	def release(self, admission):
+		if self.admission is not None:
+			self.admission.finish(admission)
+
+	@contextlib.contextmanager
+	def acquire(self, target, weight=1.0):
+		with self._lock:
+			lock = self._targets[target]
+		with lock, self._slots, self.cores.allocate(weight) as cpus:
+			with self._lock:
+				self._started += 1
+				self._running += 1
+			try:
+				yield cpus
+			finally:
+				with self._lock:
+					self._running -= 1
+
+class Scheduler:
+	default_duration = 1.0
+	admission_interval = 0.5
+
+	def __init__(self, telemetry, state, jobs=1, remote=None, cache=None, resources=None, profile=None, inputs=None,
+			keep_going=False, configs=None):
+		self.telemetry = telemetry
+		self.state = state
+		self.jobs = jobs
+		self.remote = remote
+		self.cache = cache
+		self.resources = resources if resources is not None else Resources(jobs)
+		self.profile = profile
+		self.inputs = inputs
+		self.keep_going = keep_going
+		self.failed = dict()
+		self.skipped = []
+		self.configs = configs if configs is not None else dict()
+		self._durations = None
+
+	def _configure(self, target, config):
+		stack = [(target, config)]
+		while stack:
+			target, config = stack.pop()
+			if target in self.configs:
+				continue
+			self.configs[target] = target._configure(config)
+			stack.extend((i, self.configs[target]) for i in reversed(list(target.dependencies)))
+
+	def estimate(self, target):
+		if self._durations is None:
+			self._durations = self.state.durations()
+		if target.code in self._durations:
+			return self._durations[target.code]
+		if self._durations:
+			return sum(self._durations.values())/len(self._durations)
+		return self.default_duration
+
+	def plan(self, targets, config):
+		for target in targets:
+			self._configure(target, config)
+		return CriticalPath(self.configs, self.estimate)
+
+	def dry_run(self, targets, config):
+		critical_path = self.plan(targets, config)
+		reasons = { t: t._plan(self.configs[t], self.state) for t in critical_path.targets }
+		return Plan(critical_path, reasons, self.estimate, self.jobs)
+
+	def isolation(self):
+		return self.resources.isolation()
+
+	def _run_target(self, target, ready, admission):
+		try:
+			record = self.telemetry.target(target, self.profile)
+			weight = target._parallelism(self.configs[target], self.state)
+			with self.resources.acquire(target, weight) as cpus:
+				record.add_phase('dependencies', self.telemetry.start, ready)
+				target._cpus = cpus
+				try:
+					target._build(self.configs[target], record, self)
+				finally:
+					target._cpus = None
+		finally:
+			self.resources.release(admission)
+
+	def run(self, targets, config):
+		critical_path = self.plan(targets, config)
+		counter = itertools.count()
+		waiting = { t: len(t.dependencies) for t in critical_path.targets }
+		ready = []
+		ready_at = dict()
+		def push(target):
+			ready_at[target] = time.perf_counter()
+			heapq.heappush(ready, (-critical_path.remaining[target], next(counter), target))
+		for target, count in waiting.items():
+			if count == 0:
+				push(target)
+
+		running = dict()
+		failure = None
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+			while ready or running:
+				deferred = False
+				while ready and len(running) < self.jobs and (failure is None or self.keep_going):
+					target = ready[0][2]
+					admission = self.resources.admit(target._memory(self.configs[target]))
+					if admission is None:
+						deferred = True
+						break
+					heapq.heappop(ready)
+					logging.log(logging.DEBUG-1, 'Scheduling {} (remaining {:.2f}s, slack {:.2f}s)'.format(
+						target.name, critical_path.remaining[target], critical_path.slack(target)))
+					self.resources.queue(self, len(ready)+len(running)+1)
+					running[executor.submit(self._run_target, target, ready_at[target], admission)] = target
+				if deferred and not running:
+					time.sleep(self.admission_interval)
+					continue
+				if not running:
+					break
+				done, _ = concurrent.futures.wait(running, timeout=self.admission_interval if deferred else None,
+					return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					target = running.pop(future)
+					if future.exception() is not None:
+						failure = failure or future.exception()
+						self.failed[target] = future.exception()
+						continue
+					for dependent in critical_path.dependents[target]:
+						waiting[dependent] -= 1
+						if waiting[dependent] == 0:
+							push(dependent)
+				self.resources.queue(self, len(ready)+len(running))
+
+		self.resources.queue(self, 0)
+		self.state.flush()
+		if failure is not None and self.keep_going:
+			self.skipped = [ t for t in critical_path.targets if waiting[t] > 0 ]
+			self._report()
+			raise Exception('{} target(s) failed, {} skipped'.format(len(self.failed), len(self.skipped))) from failure
+		if failure is not None:
+			raise failure
+
+	def _report(self):
+		prefix = '{}: '.format(self.profile) if self.profile is not None else ''
+		for target, error in self.failed.items():
+			logging.error('{}Failed: {}: {}'.format(prefix, target.name, error.__cause__ or error))
+		for target in self.skipped:
+			failed = sorted(i.name for i in self.failed if i in self._dependencies(target))
+			logging.error('{}Skipped: {} (depends on {})'.format(prefix, target.name, ', '.join(failed)))
+
+	@staticmethod
+	def _dependencies(target):
+		dependencies = set()
+		stack = list(target.dependencies)
+		while stack:
+			dependency = stack.pop()
+			if dependency not in dependencies:
+				dependencies.add(dependency)
+				stack.extend(dependency.dependencies)
+		return dependencies
+
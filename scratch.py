@@ -0,0 +1,55 @@
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import threading
+
+_lock = threading.Lock()
+
+def usage(directory):
+	total = 0
+	for root, dirnames, filenames in os.walk(str(directory)):
+		for name in dirnames+filenames:
+			try:
+				total += os.lstat(os.path.join(root, name)).st_blocks*512
+			except FileNotFoundError:
+				pass
+	return total
+
+def _scratch_path(path, scratch):
+	return pathlib.Path(scratch)/'{}-{}'.format(path.name, hashlib.sha256(str(path).encode('utf-8')).hexdigest()[:16])
+
+def _disk(path):
+	path.mkdir(parents=True, exist_ok=True)
+	return False
+
+def place(path, scratch, budget, estimate=lambda: 0):
+	path = pathlib.Path(path).absolute()
+	scratch = pathlib.Path(scratch)
+	with _lock:
+		if path.is_symlink():
+			target = pathlib.Path(os.readlink(str(path)))
+			if not target.is_dir():
+				path.unlink()
+			elif usage(scratch) <= budget:
+				return True
+			else:
+				logging.info('Scratch size budget exceeded, recreating build directory {} on disk'.format(path))
+				shutil.rmtree(str(target))
+				path.unlink()
+				return _disk(path)
+		elif path.exists():
+			return False
+
+		scratch.mkdir(parents=True, exist_ok=True)
+		needed = estimate()
+		if usage(scratch)+needed > budget or needed > shutil.disk_usage(str(scratch)).free:
+			logging.debug('Build directory {} does not fit in {}, using disk'.format(path, scratch))
+			return _disk(path)
+		target = _scratch_path(path, scratch)
+		target.mkdir(exist_ok=True)
+		path.parent.mkdir(parents=True, exist_ok=True)
+		path.symlink_to(target, target_is_directory=True)
+		return True
+
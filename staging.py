@@ -0,0 +1,60 @@
+import logging
+import os
+import pathlib
+import shutil
+
+
+def destdir(staging):
+	return pathlib.Path(staging)/'.destdir'
+
+def _link(source, destination):
+	if os.path.lexists(str(destination)):
+		destination.unlink()
+	if source.is_symlink():
+		os.symlink(os.readlink(str(source)), str(destination))
+		return
+	try:
+		os.link(str(source), str(destination))
+	except OSError:
+		os.symlink(str(source), str(destination))
+
+def uninstall(code, root, staging, state):
+	root = pathlib.Path(root)
+	for path in state.installed(code):
+		try:
+			(root/path).unlink()
+		except FileNotFoundError:
+			pass
+	state.own(code, [])
+	shutil.rmtree(str(staging), ignore_errors=True)
+
+def relocate(root, staging):
+	staging = pathlib.Path(staging)
+	installed = destdir(staging)/os.path.abspath(str(root)).lstrip(os.sep)
+	if installed.is_dir():
+		for i in installed.iterdir():
+			i.rename(staging/i.name)
+	for path, _, filenames in os.walk(str(destdir(staging))):
+		for name in filenames:
+			logging.warning('Ignoring {} installed outside of {}'.format(os.path.join(path, name), root))
+	shutil.rmtree(str(destdir(staging)), ignore_errors=True)
+
+def compose(code, root, staging, state):
+	root = pathlib.Path(root)
+	staging = pathlib.Path(staging)
+	files = []
+	for path, dirnames, filenames in os.walk(str(staging)):
+		path = pathlib.Path(path)
+		directory = root/path.relative_to(staging)
+		directory.mkdir(parents=True, exist_ok=True)
+		links = [ i for i in dirnames if (path/i).is_symlink() ]
+		for name in filenames + links:
+			relative = str((path/name).relative_to(staging))
+			owner = state.owner(relative)
+			if owner is not None and owner != code:
+				logging.warning('{}: overwriting {} installed by {}'.format(code, relative, owner))
+			_link(path/name, directory/name)
+			files.append(relative)
+	state.own(code, files)
+	return files
+
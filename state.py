@@ -0,0 +1,256 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+TargetState = collections.namedtuple('TargetState', ['code', 'fingerprint', 'built', 'duration', 'outputs', 'inputs', 'parallelism'])
+
+class State:
+	batch_size = 64
+	racy_seconds = 2.0
+
+	_schema = '''
+		CREATE TABLE IF NOT EXISTS targets (
+			code TEXT PRIMARY KEY,
+			fingerprint TEXT,
+			built REAL,
+			duration REAL,
+			outputs TEXT NOT NULL DEFAULT '[]',
+			inputs TEXT,
+			parallelism REAL
+		);
+		CREATE TABLE IF NOT EXISTS stats (
+			path TEXT PRIMARY KEY,
+			size INTEGER,
+			mtime_ns INTEGER,
+			inode INTEGER,
+			hash TEXT
+		);
+		CREATE TABLE IF NOT EXISTS files (
+			path TEXT PRIMARY KEY,
+			code TEXT NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS files_code ON files (code);
+		CREATE TABLE IF NOT EXISTS steps (
+			code TEXT NOT NULL,
+			position INTEGER NOT NULL,
+			name TEXT NOT NULL,
+			fingerprint TEXT,
+			PRIMARY KEY (code, position)
+		);
+	'''
+
+	def __init__(self, path):
+		self.path = pathlib.Path(path)
+		try:
+			self.path.parent.mkdir(parents=True)
+		except FileExistsError:
+			pass
+		self._lock = threading.RLock()
+		self._connection = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+		self._connection.execute('PRAGMA journal_mode=WAL')
+		self._connection.execute('PRAGMA synchronous=NORMAL')
+		self._connection.executescript(self._schema)
+		columns = [ row[1] for row in self._connection.execute('PRAGMA table_info(targets)') ]
+		if 'inputs' not in columns:
+			self._connection.execute('ALTER TABLE targets ADD COLUMN inputs TEXT')
+		if 'parallelism' not in columns:
+			self._connection.execute('ALTER TABLE targets ADD COLUMN parallelism REAL')
+		self._pending = dict()
+		self._targets = None
+		self._stats = None
+		self._pending_stats = dict()
+
+	def __deepcopy__(self, memo):
+		return self
+
+	_columns = 'code, fingerprint, built, duration, outputs, inputs, parallelism'
+
+	@staticmethod
+	def _target(row):
+		return TargetState(*row[:4], outputs=json.loads(row[4]), inputs=row[5], parallelism=row[6])
+
+	def _load(self):
+		if self._targets is None:
+			self._targets = dict()
+			for row in self._connection.execute('SELECT {} FROM targets'.format(self._columns)):
+				state = self._target(row)
+				self._targets[state.code] = state
+		return self._targets
+
+	def get(self, code):
+		with self._lock:
+			return self._load().get(code)
+
+	def refresh(self, code):
+		with self._lock:
+			targets = self._load()
+			if code not in self._pending:
+				row = self._connection.execute('SELECT {} FROM targets WHERE code = ?'.format(self._columns), (code,)).fetchone()
+				if row is not None:
+					targets[code] = self._target(row)
+				else:
+					targets.pop(code, None)
+			return targets.get(code)
+
+	def durations(self):
+		with self._lock:
+			return { code: state.duration for code, state in self._load().items() if state.duration is not None }
+
+	def record(self, code, fingerprint=None, duration=None, outputs=(), built=None, inputs=None, parallelism=None):
+		state = TargetState(code, fingerprint, built if built is not None else time.time(), duration, list(outputs), inputs, parallelism)
+		with self._lock:
+			self._load()[code] = state
+			self._pending[code] = state
+			if len(self._pending) >= self.batch_size:
+				self.flush()
+
+	def invalidate(self, code):
+		with self._lock:
+			self._load().pop(code, None)
+			self._pending[code] = None
+
+	def installed(self, code):
+		with self._lock:
+			return [ row[0] for row in self._connection.execute('SELECT path FROM files WHERE code = ?', (code,)) ]
+
+	def owner(self, path):
+		with self._lock:
+			row = self._connection.execute('SELECT code FROM files WHERE path = ?', (path,)).fetchone()
+			return row[0] if row is not None else None
+
+	def own(self, code, paths):
+		with self._lock:
+			self._connection.execute('BEGIN')
+			try:
+				self._connection.execute('DELETE FROM files WHERE code = ?', (code,))
+				self._connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?)', ( (path, code) for path in paths ))
+				self._connection.execute('COMMIT')
+			except:
+				self._connection.execute('ROLLBACK')
+				raise
+
+	def steps(self, code):
+		with self._lock:
+			return [ tuple(row) for row in self._connection.execute(
+				'SELECT name, fingerprint FROM steps WHERE code = ? ORDER BY position', (code,)) ]
+
+	def record_step(self, code, position, name, fingerprint):
+		with self._lock:
+			self._connection.execute('BEGIN')
+			try:
+				self._connection.execute('DELETE FROM steps WHERE code = ? AND position >= ?', (code, position))
+				self._connection.execute('INSERT INTO steps VALUES (?, ?, ?, ?)', (code, position, name, fingerprint))
+				self._connection.execute('COMMIT')
+			except:
+				self._connection.execute('ROLLBACK')
+				raise
+
+	def hash_file(self, path):
+		path = os.path.abspath(str(path))
+		stat = os.stat(path)
+		key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+		with self._lock:
+			if self._stats is None:
+				self._stats = { row[0]: (tuple(row[1:4]), row[4]) for row in self._connection.execute('SELECT * FROM stats') }
+			cached = self._stats.get(path)
+		if cached is not None and cached[0] == key:
+			return cached[1]
+
+		digest = hashlib.sha256()
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024**2), b''):
+				digest.update(chunk)
+		digest = digest.hexdigest()
+		if time.time_ns() - stat.st_mtime_ns > self.racy_seconds*1e9:
+			with self._lock:
+				self._stats[path] = (key, digest)
+				self._pending_stats[path] = key+(digest,)
+		return digest
+
+	def hash_paths(self, paths, root=None):
+		root = os.path.abspath(str(root)) if root is not None else None
+		def name(path):
+			if root is not None and (path == root or path.startswith(root+os.sep)):
+				return os.path.relpath(path, root)
+			return path
+		entries = []
+		for path in sorted(map(str, paths)):
+			if os.path.islink(path):
+				entries.append((name(path), 'link', os.readlink(path)))
+			elif os.path.isdir(path):
+				for directory, dirnames, filenames in os.walk(path):
+					dirnames.sort()
+					for filename in sorted(filenames):
+						full = os.path.join(directory, filename)
+						if os.path.islink(full):
+							entries.append((name(full), 'link', os.readlink(full)))
+						else:
+							entries.append((name(full), 'file', self.hash_file(full)))
+			elif os.path.exists(path):
+				entries.append((name(path), 'file', self.hash_file(path)))
+			else:
+				entries.append((name(path), 'missing', None))
+		return hashlib.sha256(repr(entries).encode('utf-8')).hexdigest()
+
+	def _commit(self, pending, stats):
+		self._connection.execute('BEGIN')
+		try:
+			removed = [ (code,) for code, state in pending.items() if state is None ]
+			updated = [ state[:4]+(json.dumps(state.outputs), state.inputs, state.parallelism) for state in pending.values() if state is not None ]
+			self._connection.executemany('DELETE FROM targets WHERE code = ?', removed)
+			self._connection.executemany('INSERT OR REPLACE INTO targets ({}) VALUES (?, ?, ?, ?, ?, ?, ?)'.format(self._columns), updated)
+			self._connection.executemany('INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?)',
+				( (path,)+entry for path, entry in stats.items() ))
+			self._connection.execute('COMMIT')
+		except:
+			self._connection.execute('ROLLBACK')
+			raise
+
+	def flush(self, code=None):
+		with self._lock:
+			if code is not None:
+				if code in self._pending:
+					self._commit({code: self._pending[code]}, {})
+					del self._pending[code]
+				return
+			if not self._pending and not self._pending_stats:
+				return
+			self._commit(self._pending, self._pending_stats)
+			self._pending.clear()
+			self._pending_stats.clear()
+
+	def close(self):
+		self.flush()
+		self._connection.close()
+
+	def migrate(self, directory):
+		directory = pathlib.Path(directory)
+		stamps = list(directory.glob('.stamp-*'))
+		history = directory/'history.json'
+		durations = dict()
+		if history.exists():
+			try:
+				durations = json.load(history.open())
+			except ValueError:
+				logging.warning('Ignoring corrupted build history {}'.format(history))
+		if not stamps and not durations:
+			return
+
+		logging.info('Migrating {} stamp files in {} to {}'.format(len(stamps), directory, self.path))
+		with self._lock:
+			for stamp in stamps:
+				code = stamp.name[len('.stamp-'):]
+				if self.get(code) is None:
+					self.record(code, duration=durations.get(code), built=stamp.stat().st_mtime)
+			self.flush()
+		for stamp in stamps:
+			stamp.unlink()
+		if history.exists():
+			history.unlink()
+
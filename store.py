@@ -0,0 +1,62 @@
+import hashlib
+import os
+import pathlib
+import shutil
+import stat
+import tempfile
+
+_checksums = dict()
+
+def checksum(path):
+	path = os.path.abspath(str(path))
+	info = os.stat(path)
+	memo = (path, info.st_size, info.st_mtime_ns)
+	if memo not in _checksums:
+		digest = hashlib.sha256()
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024**2), b''):
+				digest.update(chunk)
+		_checksums[memo] = digest.hexdigest()
+	return _checksums[memo]
+
+def key(*parts):
+	return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def key_of(store, directory):
+	directory = pathlib.Path(directory)
+	if directory.parent == pathlib.Path(store):
+		return directory.name
+	return None
+
+def contains(store, directory):
+	return key_of(store, directory) is not None
+
+def _read_only(directory):
+	for path, _, filenames in os.walk(str(directory)):
+		for name in filenames:
+			full = os.path.join(path, name)
+			if not os.path.islink(full):
+				mode = os.stat(full).st_mode
+				os.chmod(full, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def populate(store, key, fill):
+	store = pathlib.Path(store)
+	directory = store/key
+	if directory.exists():
+		return directory, False
+	store.mkdir(parents=True, exist_ok=True)
+	temporary = pathlib.Path(tempfile.mkdtemp(dir=str(store), prefix='.'))
+	try:
+		fill(temporary)
+		_read_only(temporary)
+		os.rename(str(temporary), str(directory))
+	except OSError:
+		shutil.rmtree(str(temporary), ignore_errors=True)
+		if not directory.exists():
+			raise
+		return directory, False
+	except:
+		shutil.rmtree(str(temporary), ignore_errors=True)
+		raise
+	return directory, True
+
@@ -1,17 +1,25 @@
+import collections
+import concurrent.futures
 import copy
-import filecmp
+import gzip
+import hashlib
+import json
 import logging
+import lzma
 import os
 import pathlib
+import re
 import shutil
-import sys
-import urllib
-import urllib.request
-import unittest
+import subprocess
+import tarfile
+import tempfile
+import urllib.parse
 
-from .base import Scope, Target, TargetTestCase
-from .config import Config, ConfigDict
-from .tests import _fn_log
+from .base import Scope, Target
+from .config import Config
+from .locks import TargetLock
+from .log import _fn_log
+from . import scratch, store, unidiff
 
 class Download(Target):
 	local_config_keys = {'url', 'directory.target'}
@@ -27,8 +35,10 @@ class Download(Target):
 		return pathlib.Path(self.config['directory.target'])/self._file_name()
 
 	@property
-	def outdated(self):
-		return not self._target_file().exists()
+	def outdated_reason(self):
+		if not self._target_file().exists():
+			return 'file {} does not exist'.format(self._target_file())
+		return None
 
 	def build(self):
 		try:
@@ -37,24 +47,81 @@ class Download(Target):
 			pass
 
 		self.log(logging.INFO, 'downloading {} to {}...'.format(self.config['url'], str(self.config['directory.target'])))
+		import urllib.request
 		urllib.request.urlretrieve(self.config['url'], str(self._target_file()))
 
 	def post_build(self):
 		self.config['file.output', Scope.Local, Target.GlobalTargetLevel] = self._target_file()
 
+_unpack_formats_registered = False
+
+def _register_unpack_formats():
+	global _unpack_formats_registered
+	if _unpack_formats_registered:
+		return
+	_unpack_formats_registered = True
+	if any([ '.xz' in i[1] for i in shutil.get_unpack_formats() ]):
+		return
+
+	import tarfile
+	def _extract_xz(filename, extract_dir):
+		try:
+			tarobj = tarfile.open(filename)
+		except tarfile.TarError as e:
+			raise shutil.ReadError('{} is not a tar file'.format(filename)) from e
+
+		try:
+			tarobj.extractall(extract_dir)
+		finally:
+			tarobj.close()
+
+	shutil.register_unpack_format('XZ file', ['.xz'], _extract_xz, [], 'Tar file compressed with XZ (LZMA) algorithm')
+
+def _out_of_tree(config, suffix):
+	source = pathlib.Path(config['directory.source'])
+	if store.contains(config['directory.store'], source):
+		return str(pathlib.Path(config['directory.root'])/'build'/source.name)
+	return str(source)+suffix
+
+def _out_of_tree_build(target, config):
+	build, source = target._hint(config, 'directory.build'), target._hint(config, 'directory.source')
+	return [build] if build is not None and pathlib.Path(build) != pathlib.Path(source) else []
+
+def _build_directory(target, directory, source):
+	directory = pathlib.Path(directory)
+	if target.config['scratch.directory'] is None or directory == pathlib.Path(source):
+		directory.mkdir(parents=True, exist_ok=True)
+		return
+	if scratch.place(directory, target.config['scratch.directory'], target.config['scratch.size']*1024**2,
+			estimate=lambda: scratch.usage(source)):
+		target.log(logging.DEBUG, 'building in {}'.format(directory.resolve()))
+
 class Extract(Target):
-	local_config_keys = {'file.name', 'directory.output'}
+	local_config_keys = {'file.name', 'directory.output', 'store'}
+	input_config_keys = {'file.name'}
 	local_config_defaults = {
-		'directory.output': lambda config: str(pathlib.Path(config['directory.source']))
+		'directory.output': lambda config: str(pathlib.Path(config['directory.source'])),
+		'store': False
 	}
 
 	def _target_dir(self):
+		if self.config['store']:
+			return pathlib.Path(self.config['directory.store'])/store.key(store.checksum(self.config['file.name']))
 		return pathlib.Path(self.config['directory.output'])
 
 	def build(self):
+		_register_unpack_formats()
 		file_input = self.config['file.name']
 		target_dir = self._target_dir()
 
+		if self.config['store']:
+			self.log(logging.INFO, 'extracting {} to source store...'.format(file_input))
+			_, created = store.populate(target_dir.parent, target_dir.name,
+				lambda directory: shutil.unpack_archive(str(file_input), str(directory)))
+			if not created:
+				self.log(logging.INFO, 'already in source store')
+			return
+
 		try:
 			target_dir.mkdir(parents=True)
 		except FileExistsError:
@@ -67,18 +134,350 @@ class Extract(Target):
 	def post_build(self):
 		self.config['directory.output', Scope.Local, Target.GlobalTargetLevel] = str(self._target_dir())
 
+def _gzip_chunk(data, level):
+	return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _xz_chunk(data, level):
+	return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=level)
+
+class _ChunkedWriter:
+	def __init__(self, output, compress, level, chunk, executor, pending):
+		self.output = output
+		self.compress = compress
+		self.level = level
+		self.chunk = chunk
+		self.executor = executor
+		self.pending = pending
+		self.buffer = bytearray()
+		self.futures = collections.deque()
+
+	def _submit(self, data):
+		if self.executor is None:
+			self.output.write(self.compress(data, self.level))
+			return
+		self.futures.append(self.executor.submit(self.compress, data, self.level))
+		while len(self.futures) > self.pending:
+			self.output.write(self.futures.popleft().result())
+
+	def write(self, data):
+		self.buffer += data
+		while len(self.buffer) >= self.chunk:
+			self._submit(bytes(self.buffer[:self.chunk]))
+			del self.buffer[:self.chunk]
+		return len(data)
+
+	def close(self):
+		if self.buffer:
+			self._submit(bytes(self.buffer))
+			self.buffer.clear()
+		while self.futures:
+			self.output.write(self.futures.popleft().result())
+
+class Pack(Target):
+	local_config_keys = {'directory', 'file.output', 'compression', 'level', 'chunk', 'mtime'}
+	input_config_keys = {'directory'}
+	local_config_defaults = {
+		'compression': None,
+		'level': None,
+		'chunk': 4,
+		'mtime': 0
+	}
+
+	compressions = {
+		'gz': (_gzip_chunk, 6),
+		'xz': (_xz_chunk, 6)
+	}
+	suffixes = {'.tar.gz': 'gz', '.tgz': 'gz', '.tar.xz': 'xz', '.txz': 'xz'}
+
+	def _compression(self, output):
+		compression = self.config['compression']
+		if compression is None:
+			compression = next((v for k, v in self.suffixes.items() if output.name.endswith(k)), None)
+		if compression not in self.compressions:
+			raise Exception('Unsupported compression of {}, use one of: {}'.format(output, ', '.join(sorted(self.compressions))))
+		return compression
+
+	def _members(self, directory):
+		members = []
+		for root, dirnames, filenames in os.walk(str(directory)):
+			for name in dirnames+filenames:
+				path = pathlib.Path(root)/name
+				members.append((path.relative_to(directory).parts, path))
+		return [ (path, '/'.join(parts)) for parts, path in sorted(members) ]
+
+	def _write_tar(self, directory, fileobj):
+		mtime = self.config['mtime']
+		with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+			for path, name in self._members(directory):
+				info = tar.gettarinfo(str(path), arcname=name)
+				info.mtime = mtime
+				info.uid = info.gid = 0
+				info.uname = info.gname = ''
+				if info.isreg():
+					with path.open('rb') as f:
+						tar.addfile(info, f)
+				else:
+					tar.addfile(info)
+
+	def build(self):
+		directory = pathlib.Path(self.config['directory'])
+		output = pathlib.Path(self.config['file.output'])
+		compress, level = self.compressions[self._compression(output)]
+		level = self.config['level'] if self.config['level'] is not None else level
+		workers = len(self.cpus())
+		self.log(logging.INFO, 'packing {} to {}...'.format(directory, output))
+		output.parent.mkdir(parents=True, exist_ok=True)
+		descriptor, temporary = tempfile.mkstemp(dir=str(output.parent), prefix='.'+output.name)
+		try:
+			with os.fdopen(descriptor, 'wb') as f:
+				executor = concurrent.futures.ThreadPoolExecutor(workers) if workers > 1 else None
+				try:
+					writer = _ChunkedWriter(f, compress, level, int(self.config['chunk']*1024**2), executor, 2*workers)
+					self._write_tar(directory, writer)
+					writer.close()
+				finally:
+					if executor is not None:
+						executor.shutdown()
+			os.chmod(temporary, 0o644)
+			os.replace(temporary, str(output))
+		except:
+			os.unlink(temporary)
+			raise
+
+_commit_id = re.compile('^[0-9a-f]{40}$')
+
+class GitCheckout(Target):
+	local_config_keys = {'url', 'revision', 'directory.output', 'directory.mirrors', 'depth', 'filter', 'checkout', 'scripts.git'}
+	local_config_defaults = {
+		'revision': 'HEAD',
+		'directory.output': lambda config: str(pathlib.Path(config['directory.source'])/config.target.code),
+		'directory.mirrors': lambda config: str(pathlib.Path(config['directory.shared'])/'git'),
+		'depth': None,
+		'filter': None,
+		'checkout': 'worktree',
+		'scripts.git': lambda config: [shutil.which('git')]
+	}
+
+	def _git(self, *args, cwd=None, **kwargs):
+		stdout, _ = self.call(self.config['scripts.git']+list(args), cwd=cwd, capture_stdout=True, echo_stdout=False, **kwargs)
+		return stdout.decode('utf-8').strip()
+
+	def _mirror(self):
+		url = self.config['url']
+		name = url.rstrip('/').rsplit('/', 1)[-1]
+		name = name[:-len('.git')] if name.endswith('.git') else name
+		return pathlib.Path(self.config['directory.mirrors'])/'{}-{}.git'.format(name, hashlib.sha256(url.encode('utf-8')).hexdigest()[:16])
+
+	def _resolve(self, mirror, revision):
+		if not mirror.exists():
+			return None
+		try:
+			return self._git('rev-parse', '--verify', '--quiet', revision+'^{commit}', cwd=mirror, echo_stderr=False)
+		except subprocess.CalledProcessError:
+			return None
+
+	@property
+	def outdated_reason(self):
+		directory = pathlib.Path(self.config['directory.output'])
+		revision = self.config['revision']
+		if not (directory/'.git').exists():
+			return 'not checked out'
+		if not _commit_id.match(revision):
+			return 'revision {} is not a commit id'.format(revision)
+		head = self._git('rev-parse', 'HEAD', cwd=directory)
+		if head != revision:
+			return 'checked out {} instead of {}'.format(head, revision)
+		return super().outdated_reason
+
+	def _fetch_options(self):
+		options = []
+		if self.config['depth'] is not None:
+			options += ['--depth', str(self.config['depth'])]
+		if self.config['filter'] is not None:
+			options += ['--filter', self.config['filter']]
+		return options
+
+	def _update_mirror(self, mirror, revision):
+		git = self.config['scripts.git']
+		if not mirror.exists():
+			self.log(logging.INFO, 'cloning mirror of {}...'.format(self.config['url']))
+			self.call(git+['clone', '--mirror']+self._fetch_options()+[self.config['url'], str(mirror)])
+		elif _commit_id.match(revision) and self._resolve(mirror, revision) is not None:
+			self.log(logging.DEBUG, 'commit {} already in mirror'.format(revision))
+			return revision
+		else:
+			self.log(logging.INFO, 'fetching {}...'.format(self.config['url']))
+			fetch = git+['fetch']+self._fetch_options()+['origin']
+			try:
+				self.call(fetch+([revision] if _commit_id.match(revision) else []), cwd=mirror)
+			except subprocess.CalledProcessError:
+				if not _commit_id.match(revision):
+					raise
+				self.call(fetch, cwd=mirror)
+		commit = self._resolve(mirror, revision)
+		if commit is None:
+			raise Exception('Revision {} not found in {}'.format(revision, self.config['url']))
+		if _commit_id.match(revision):
+			self.call(git+['update-ref', 'refs/pinned/'+commit, commit], cwd=mirror)
+		return commit
+
+	def _check_out(self, mirror, commit):
+		git = self.config['scripts.git']
+		directory = pathlib.Path(self.config['directory.output'])
+		if not (directory/'.git').exists():
+			self.log(logging.INFO, 'checking out {}...'.format(commit))
+			if self.config['checkout'] == 'worktree':
+				self.call(git+['worktree', 'prune'], cwd=mirror)
+				self.call(git+['worktree', 'add', '--detach', str(directory), commit], cwd=mirror)
+				return
+			self.call(git+['clone', '--shared', '--no-checkout', str(mirror), str(directory)])
+		else:
+			self.log(logging.INFO, 'switching to {}...'.format(commit))
+		self.call(git+['checkout', '--detach', commit], cwd=directory)
+
+	def build(self):
+		if self.config['checkout'] not in ('worktree', 'shared'):
+			raise Exception('Unsupported checkout {}, use "worktree" or "shared"'.format(self.config['checkout']))
+		if self.config['checkout'] == 'shared' and self.config['filter'] is not None:
+			raise Exception('Shared checkout cannot read objects missing from a partial mirror, use "worktree" checkout with filter')
+		mirror = self._mirror()
+		lock = TargetLock(mirror.parent, mirror.name)
+		lock.acquire(lambda owner: self.log(logging.INFO, 'waiting for another build ({}) using mirror {}...'.format(owner, mirror)))
+		try:
+			self._check_out(mirror, self._update_mirror(mirror, self.config['revision']))
+		finally:
+			lock.release()
+
+	def post_build(self):
+		directory = self.config['directory.output']
+		self.config['directory.output', Scope.Local, Target.GlobalTargetLevel] = str(directory)
+		self.config['commit', Scope.Local, Target.GlobalTargetLevel] = self._git('rev-parse', 'HEAD', cwd=directory)
+
 class Patch(Target):
-	local_config_keys = {'file', 'directory', 'strip'}
+	local_config_keys = {'file', 'directory', 'strip', 'store'}
+	input_config_keys = {'file'}
+	local_config_defaults = {'strip': 1, 'store': False}
+
+	def _target_dir(self):
+		directory = pathlib.Path(self.config['directory'])
+		if not self.config['store']:
+			return directory
+		base = store.key_of(self.config['directory.store'], directory)
+		if base is None:
+			raise Exception('Directory {} is not in the source store'.format(directory))
+		return directory.parent/store.key(base, store.checksum(self.config['file']), str(self.config['strip']))
+
+	@staticmethod
+	def _copy_writable(source, destination):
+		shutil.copy2(source, destination)
+		os.chmod(destination, os.stat(destination).st_mode | 0o200)
+
+	def _patch(self, directory):
+		self.log(logging.DEBUG, 'applying {}'.format(self.config['file']))
+		unidiff.apply(pathlib.Path(self.config['file']).read_bytes(), directory, self.config['strip'])
+
+	def build(self):
+		if not self.config['store']:
+			self._patch(self.config['directory'])
+			return
+
+		def fill(directory):
+			shutil.copytree(str(self.config['directory']), str(directory), symlinks=True,
+				copy_function=self._copy_writable, dirs_exist_ok=True)
+			self._patch(directory)
+		target_dir = self._target_dir()
+		_, created = store.populate(target_dir.parent, target_dir.name, fill)
+		if not created:
+			self.log(logging.INFO, 'already in source store')
+
+	def post_build(self):
+		self.config['directory.output', Scope.Local, Target.GlobalTargetLevel] = str(self._target_dir())
+
+class PatchSeries(Target):
+	local_config_keys = {'files', 'directory', 'strip'}
+	input_config_keys = {'files'}
 	local_config_defaults = {'strip': 1}
 
+	def _series_dir(self):
+		return pathlib.Path(self.config['directory.stamps'])/'patches'/self.code
+
+	def _recorded(self, directory):
+		try:
+			recorded = json.loads((self._series_dir()/'series.json').read_text())
+		except (OSError, ValueError):
+			return []
+		for relative, checksum in recorded['result'].items():
+			path = directory/relative
+			if (store.checksum(path) if path.exists() else None) != checksum:
+				self.log(logging.INFO, '{} changed since the series was applied, applying all patches'.format(relative))
+				return []
+		return recorded['patches']
+
+	def _revert(self, index, patch, directory):
+		self.log(logging.DEBUG, 'reverting {}'.format(patch['file']))
+		for relative, existed in patch['files'].items():
+			if existed:
+				unidiff._write(directory/relative, (self._series_dir()/str(index)/relative).read_bytes())
+			elif (directory/relative).exists():
+				(directory/relative).unlink()
+
+	def _apply(self, text, directory, backup):
+		return unidiff.apply(text, directory, self.config['strip'], backup)
+
 	def build(self):
-		self.call(
-			['patch', '-p{}'.format(self.config['strip']), '-i', str(self.config['file'])],
-			cwd=str(self.config['directory'])
-		)
+		directory = pathlib.Path(self.config['directory'])
+		strip = self.config['strip']
+		files = [ pathlib.Path(i) for i in self.config['files'] ]
+		texts = [ i.read_bytes() for i in files ]
+		checksums = [ store.checksum(i) for i in files ]
+		recorded = self._recorded(directory)
+		start = 0
+		while start < min(len(recorded), len(files)) and recorded[start]['checksum'] == checksums[start]:
+			start += 1
+		self.log(logging.INFO, 'applying {} of {} patches'.format(len(files)-start, len(files)))
+
+		touched = { i for patch in recorded[start:] for i in patch['files'] }
+		touched.update(i.path(strip) for text in texts[start:] for i in unidiff.parse(text))
+		journal = { i: (directory/i).read_bytes() if (directory/i).exists() else None for i in touched }
+
+		series_dir = self._series_dir()
+		series_dir.mkdir(parents=True, exist_ok=True)
+		backups = pathlib.Path(tempfile.mkdtemp(dir=str(series_dir), prefix='.'))
+		try:
+			for index in reversed(range(start, len(recorded))):
+				self._revert(index, recorded[index], directory)
+			patches = recorded[:start]
+			for index in range(start, len(files)):
+				self.log(logging.DEBUG, 'applying {}'.format(files[index]))
+				try:
+					applied = self._apply(texts[index], directory, backups/str(index))
+				except unidiff.PatchError as e:
+					raise Exception('Patch {} does not apply: {}'.format(files[index], e)) from e
+				patches.append({ 'file': str(files[index]), 'checksum': checksums[index], 'files': applied })
+		except:
+			for relative, content in journal.items():
+				if content is not None:
+					unidiff._write(directory/relative, content)
+				elif (directory/relative).exists():
+					(directory/relative).unlink()
+			shutil.rmtree(str(backups))
+			raise
+
+		for index in range(start, max(len(files), len(recorded))):
+			shutil.rmtree(str(series_dir/str(index)), ignore_errors=True)
+			if (backups/str(index)).exists():
+				(backups/str(index)).rename(series_dir/str(index))
+		shutil.rmtree(str(backups))
+		result = { i: store.checksum(directory/i) if (directory/i).exists() else None
+			for patch in patches for i in patch['files'] }
+		unidiff._write(series_dir/'series.json', json.dumps({ 'patches': patches, 'result': result }).encode('utf-8'))
+
+	def post_build(self):
+		self.config['directory.output', Scope.Local, Target.GlobalTargetLevel] = str(self.config['directory'])
 
 class Create(Target):
 	local_config_keys = {'file.name', 'file.kind', 'file.content', 'file.mode'}
+	output_config_keys = {'file.name'}
 	local_config_defaults = {'file.kind': 'file', 'file.content': None, 'file.mode': None}
 
 	def build(self):
@@ -97,6 +496,8 @@ class Create(Target):
 
 class Copy(Target):
 	local_config_keys = {'source', 'destination'}
+	input_config_keys = {'source'}
+	output_config_keys = {'destination'}
 
 	@_fn_log(logging.DEBUG-2)
 	def _copy(self, source, destination):
@@ -119,49 +520,70 @@ class Copy(Target):
 			self._copy(i, destination/i.name)
 
 class Autotools(Target):
-	local_config_keys = {'directory.source', 'scripts.autoreconf', 'scripts.configure'}
+	local_config_keys = {'directory.source', 'directory.build', 'scripts.autoreconf', 'scripts.configure'}
+	input_config_keys = {'directory.source'}
 	local_config_defaults = {
+		'directory.build': lambda config: _out_of_tree(config, ''),
 		'scripts.autoreconf': lambda config: [shutil.which('autoreconf')],
 		'scripts.configure': lambda config: [str(pathlib.Path(config['directory.source'])/'configure')]
 	}
 
-	def build(self):
-		directory = self.config['directory.source']
-		self.call(
-			self.config['scripts.autoreconf']+['-f'],
-			cwd=directory
-		)
+	def inputs(self):
+		if pathlib.Path(self.config['directory.build']) == pathlib.Path(self.config['directory.source']):
+			return []
+		return super().inputs()
 
-		self.call(
-			self.config['scripts.configure']+
-				['--prefix={}'.format(self.config['directory.root'])],
-			cwd=directory,
-			env={
-				'CC':       self.config['language.c.compiler'],
-				'CXX':      self.config['language.c++.compiler'],
-				'CFLAGS':   ' '.join(self.config['language.c.flags']),
-				'CXXFLAGS': ' '.join(self.config['language.c++.flags']),
-				'LDFLAGS':  ' '.join(self.config['linker.flags'])
-			}
-		)
+	def _generated(self, config):
+		return _out_of_tree_build(self, config)
+
+	autoreconf_inputs = ('configure.ac', 'configure.in', 'acinclude.m4', '**/Makefile.am', 'm4/*.m4')
+	configure_inputs = ('configure', '**/Makefile.in', '**/*.h.in')
+
+	def build(self):
+		source = self.config['directory.source']
+		directory = self.config['directory.build']
+		steps = self.steps()
+		exclude = directory if pathlib.Path(directory) != pathlib.Path(source) else None
+		if store.contains(self.config['directory.store'], source):
+			if not (pathlib.Path(source)/'configure').exists():
+				raise Exception('Source store directory {} has no configure script, and cannot be modified by autoreconf'.format(source))
+		else:
+			autoreconf = self.config['scripts.autoreconf']+['-f']
+			steps.run('autoreconf', (autoreconf, steps.files(source, self.autoreconf_inputs, exclude)),
+				lambda: self.call(autoreconf, cwd=source), outputs=[pathlib.Path(source)/'configure'])
+
+		_build_directory(self, directory, source)
+
+		configure = self.config['scripts.configure']+['--prefix={}'.format(self.config['directory.root'])]
+		env = {
+			'CC':       self.config['language.c.compiler'],
+			'CXX':      self.config['language.c++.compiler'],
+			'CFLAGS':   ' '.join(self.config['language.c.flags']),
+			'CXXFLAGS': ' '.join(self.config['language.c++.flags']),
+			'LDFLAGS':  ' '.join(self.config['linker.flags'])
+		}
+		steps.run('configure', (configure, env, str(directory), steps.files(source, self.configure_inputs, exclude)),
+			lambda: self.call(configure, cwd=directory, env=env), outputs=[pathlib.Path(directory)/'config.status'])
 
 class CMake(Target):
 	local_config_keys = {'directory.source', 'directory.build', 'directory.target', 'scripts.cmake', 'variables'}
+	input_config_keys = {'directory.source'}
 	local_config_defaults = {
-		'directory.build': lambda config: str(config['directory.source'])+'-build',
+		'directory.build': lambda config: _out_of_tree(config, '-build'),
 		'directory.target': lambda config: str(config['directory.root']),
 		'scripts.cmake': lambda config: [shutil.which('cmake')],
 	}
+	configure_inputs = ('**/CMakeLists.txt', '**/*.cmake', '**/*.cmake.in')
+
+	def _generated(self, config):
+		return _out_of_tree_build(self, config)
 
 	def build(self):
 		source_dir = pathlib.Path(self.config['directory.source'])
 		build_dir  = pathlib.Path(self.config['directory.build'])
 		target_dir = pathlib.Path(self.config['directory.target'])
 
-		try:
-			build_dir.mkdir(parents=True)
-		except FileExistsError:
-			pass
+		_build_directory(self, build_dir, source_dir)
 
 		self.config['variables.CMAKE_INSTALL_PREFIX'] = target_dir
 		self.config['variables.CMAKE_C_COMPILER'] = self.config['language.c.compiler']
@@ -173,25 +595,30 @@ class CMake(Target):
 		self.config['variables.CMAKE_SHARED_LINKER_FLAGS'] = ' '.join(self.config['linker.flags'])
 		self.config['variables.CMAKE_STATIC_LINKER_FLAGS'] = ' '.join(self.config['linker.flags'])
 
-
-		self.call(
-			self.config['scripts.cmake']+
-				[str(source_dir)]+
-				[ '-D{}="{}"'.format(k, v if v else '""') for k, v in self.config['variables'].items()  ],
-			cwd=str(build_dir)
-		)
+		cmake = self.config['scripts.cmake']+[str(source_dir)]+ \
+			[ '-D{}="{}"'.format(k, v if v else '""') for k, v in self.config['variables'].items()  ]
+		steps = self.steps()
+		steps.run('configure', (cmake, str(build_dir), steps.files(source_dir, self.configure_inputs, build_dir)),
+			lambda: self.call(cmake, cwd=str(build_dir)), outputs=[build_dir/'CMakeCache.txt'])
 
 class Make(Target):
+	cacheable = True
+	staged = True
 	local_config_keys = {'directory.source', 'make.targets', 'scripts.make'}
+	input_config_keys = {'directory.source'}
 	local_config_defaults = {
 		'make.targets': None,
-		'scripts.make': lambda config: [shutil.which('make'), '-j{}'.format(os.cpu_count())]
+		'scripts.make': lambda config: [shutil.which('make')]
 	}
 
 	def build(self):
+		make = list(self.config['scripts.make'])
+		if not any(str(i).startswith('-j') for i in make[1:]):
+			make.append('-j{}'.format(len(self.cpus())))
 		self.call(
-			self.config['scripts.make']+([] if self.config['make.targets'] is None else list(self.config['make.targets'])),
-			cwd=self.config['directory.source']
+			make+([] if self.config['make.targets'] is None else list(self.config['make.targets'])),
+			cwd=self.config['directory.source'],
+			env={'DESTDIR': str(self._destdir)} if self._destdir is not None else {}
 		)
 
 class Execute(Target):
@@ -201,299 +628,3 @@ class Execute(Target):
 			cwd=self.config['process.cwd']
 		)
 
-class TestDownload(TargetTestCase):
-	def test_download(self):
-		example_file = pathlib.Path(__file__)
-
-		download, _ = self.mock_target(Download, 'download_plane', config=ConfigDict(
-			url=lambda config: example_file.as_uri()
-		))
-		after_download, after_download_config = self.mock_target(Target, 'after download',
-			dependencies={download},
-			config=ConfigDict({
-				'target.after_download.always_outdated': True
-			})
-		)
-
-		self.run_target(after_download)
-		self.assertTrue(after_download_config.value['target.download_plane.build'])
-		downloaded_file = after_download_config.value['target.download_plane.file.output']
-		self.assertTrue(str(downloaded_file).endswith(example_file.name))
-		self.assertEqual(example_file.open().read(), downloaded_file.open().read())
-
-		self.run_target(after_download)
-		self.assertFalse(after_download_config.value['target.download_plane.build'])
-		downloaded_file = after_download_config.value['target.download_plane.file.output']
-		self.assertTrue(str(downloaded_file).endswith(example_file.name))
-		self.assertEqual(example_file.open().read(), downloaded_file.open().read())
-
-class TestExtract(TargetTestCase):
-	def assertEqualDirectories(self, left, right):
-		diff = filecmp.dircmp(str(left), str(right))
-		if len(diff.left_only) != 0:
-			raise AssertionError('Only in {}: {}'.format(left, diff.left_only))
-		if len(diff.right_only) != 0:
-			raise AssertionError('Only in {}: {}'.format(right, diff.right_only))
-		if len(diff.diff_files) != 0:
-			raise AssertionError('Files {} differ between {} and {}'.format(diff.diff_files, left, right))
-		if len(diff.funny_files) != 0:
-			raise Exception('Could not compare {} between {} and {}'.format(diff.funny_files, left, right))
-
-	def test_extract(self):
-		this_directory = pathlib.Path(__file__).parent
-		root_dir = pathlib.Path(self.root_dir.name)
-
-		archive_file = root_dir/'archive'
-		archive_file = pathlib.Path(shutil.make_archive(str(archive_file), format='gztar',
-				root_dir=str(this_directory)))
-
-		output_dir = root_dir/'extract'
-
-		extract, extract_config = self.mock_target(Extract, 'extract_files', config=ConfigDict({
-				'file.name': archive_file,
-				'directory.output': output_dir,
-		}))
-		after_extract, after_extract_config = self.mock_target(Target, 'after extract',
-			dependencies={extract}, config=ConfigDict({
-				'target.after_extract.always_outdated': True
-			})
-		)
-
-		self.run_target(after_extract)
-		self.assertTrue(after_extract_config.value['target.extract_files.build'])
-		self.assertEqual(str(output_dir), after_extract_config.value['target.extract_files.directory.output'])
-		self.assertEqualDirectories(output_dir, this_directory)
-
-		self.run_target(after_extract)
-		self.assertFalse(after_extract_config.value['target.extract_files.build'])
-		self.assertEqual(str(output_dir), after_extract_config.value['target.extract_files.directory.output'])
-		self.assertEqualDirectories(output_dir, this_directory)
-
-class TestPatch(TargetTestCase):
-	input_file = '''YODA: Code!  Yes.  A programmer's strength flows from code
-      maintainability.  But beware of Perl.  Terse syntax... more
-      than one way to do it...  default variables.  The dark side
-      of code maintainability are they.  Easily they flow, quick
-      to join you when code you write.  If once you start down the
-      dark path, forever will it dominate your destiny, consume
-      you it will.
-LUKE: Is Perl better than Python?
-YODA: Yes... yes... yes.  Quicker, easier, more maintainable.
-LUKE: But how will I know why Python is better than Perl?
-YODA: You will know.  When your code you try to read six months
-      from now.'''
-
-	patch = '''--- a/{file_name}\t
-+++ b/{file_name}\t
-@@ -7,5 +7,5 @@
-       you it will.
- LUKE: Is Perl better than Python?
--YODA: Yes... yes... yes.  Quicker, easier, more maintainable.
-+YODA: No... no... no.  Quicker, easier, more seductive.
- LUKE: But how will I know why Python is better than Perl?
- YODA: You will know.  When your code you try to read six months
-'''
-
-	output_file = '''YODA: Code!  Yes.  A programmer's strength flows from code
-      maintainability.  But beware of Perl.  Terse syntax... more
-      than one way to do it...  default variables.  The dark side
-      of code maintainability are they.  Easily they flow, quick
-      to join you when code you write.  If once you start down the
-      dark path, forever will it dominate your destiny, consume
-      you it will.
-LUKE: Is Perl better than Python?
-YODA: No... no... no.  Quicker, easier, more seductive.
-LUKE: But how will I know why Python is better than Perl?
-YODA: You will know.  When your code you try to read six months
-      from now.'''
-
-	def test_patch(self):
-		temp = pathlib.Path(self.root_dir.name)
-		input_file = temp/'The Empire Strikes Back.txt'
-		input_file.open('w').write(self.input_file)
-		patch_file = temp/'The Empire Strikes Back.patch'
-		patch_file.open('w').write(self.patch.format(file_name=input_file.name))
-
-		patch, _ = self.mock_target(Patch, 'patch_files', config=ConfigDict(
-			directory=temp,
-			file=patch_file
-		))
-		self.run_target(patch)
-
-		output = input_file.open().read()
-		self.assertEqual(self.output_file, output)
-
-class TestCreate(TargetTestCase):
-	content = '''<refrigerator> [to dishwasher] "...so I'm inclined to believe that
-capping the capital gains tax at 13% would enable sustainable
-growth in the GNP of over 4%."'''
-	file_name = 'waiting for God.txt'
-	directory_name = 'example'
-
-	def test_create_file(self):
-		root = pathlib.Path(self.root_dir.name)
-		file_name = root/self.file_name
-
-		create, _ = self.mock_target(Create, 'create_file', config=ConfigDict(
-			file=ConfigDict(
-				name=file_name,
-				content=self.content
-			)
-		))
-		self.run_target(create)
-
-		output = file_name.open().read()
-		self.assertEqual(self.content, output)
-
-	def test_create_directory(self):
-		root = pathlib.Path(self.root_dir.name)
-		directory_name = root/self.directory_name
-
-		create, _ = self.mock_target(Create, 'create_file', config=ConfigDict(
-			file=ConfigDict(
-				name=directory_name,
-				kind='directory'
-			)
-		))
-		self.run_target(create)
-
-		self.assertTrue(directory_name.is_dir())
-
-	def test_create_file_in_directory(self):
-		root = pathlib.Path(self.root_dir.name)
-		directory_name = root/self.directory_name
-		file_name = directory_name/self.file_name
-
-		create, _ = self.mock_target(Create, 'create_dir_and_file', config=ConfigDict(
-			file=ConfigDict(
-				name=str(file_name),
-				content=self.content
-			)
-		))
-		self.run_target(create)
-
-		self.assertTrue(directory_name.is_dir())
-		self.assertEqual(self.content, file_name.open().read())
-
-class TestCopy(TargetTestCase):
-	def test_copy(self):
-		this_directory = pathlib.Path(__file__).parent
-		temp = pathlib.Path(self.root_dir.name)
-
-		copy, _ = self.mock_target(Copy, 'copy_files', config=ConfigDict(
-			source=lambda config: this_directory.glob('*.py'),
-			destination=temp
-		))
-		self.run_target(copy)
-
-		for i in temp.iterdir():
-			if i.is_file():
-				j = this_directory/i.name
-				self.assertEqual(j.open().read(), i.open().read())
-
-class TestAutotools(TargetTestCase):
-	def test_autotools(self):
-		root_dir = pathlib.Path(self.root_dir.name)
-		(root_dir/'default'/'src').mkdir(parents=True)
-		output_file = root_dir/'output.log'
-
-		autotools, _ = self.mock_target(Autotools, 'autotools_project', config=ConfigDict(
-			scripts=ConfigDict(
-				autoreconf=[shutil.which('python3'), '-c', 'open("{}", "a").write("Autoreconf\\n")'.format(output_file)],
-				configure=[shutil.which('python3'), '-c', 'open("{}", "a").write("Configure\\n")'.format(output_file)]
-			)
-		))
-		self.run_target(autotools, build_config=ConfigDict(
-			language=ConfigDict({
-				'c': ConfigDict(
-					compiler='',
-					flags=[]
-				),
-				'c++': ConfigDict(
-					compiler='',
-					flags=[]
-				)
-			})
-		))
-
-		output = output_file.open().read()
-		self.assertEqual('Autoreconf\nConfigure\n', output)
-
-class TestCMake(TargetTestCase):
-	def test_cmake(self):
-		root_dir = pathlib.Path(self.root_dir.name)
-		output_file = root_dir/'output.log'
-
-		cmake_mock = '''import sys
-open("{}", "a").write("CMake\\n"+repr(sys.argv[2:]))
-'''.format(output_file)
-
-		cmake, _ = self.mock_target(CMake, 'cmake_project', config=ConfigDict(
-			scripts=ConfigDict(
-				cmake=[shutil.which('python3'), '-c', cmake_mock]
-			)
-		))
-		self.run_target(cmake, build_config=ConfigDict(
-			language=ConfigDict({
-				'c': ConfigDict(
-					compiler='',
-					flags=[]
-				),
-				'c++': ConfigDict(
-					compiler='',
-					flags=[]
-				)
-			})
-		))
-
-		output = output_file.open().read()
-		self.assertTrue(output.startswith('CMake'))
-		output = output[6:].strip()
-		output = eval(output)
-
-		defines = { i for i in output if i.startswith('-D') }
-
-		self.assertEqual({
-			'-DCMAKE_INSTALL_PREFIX={}'.format(root_dir/'default'),
-			'-DCMAKE_C_FLAGS=""',
-			'-DCMAKE_CXX_FLAGS=""',
-			'-DCMAKE_C_COMPILER=""',
-			'-DCMAKE_CXX_COMPILER=""'
-		}, defines)
-
-class TestMake(TargetTestCase):
-	def test_make(self):
-		temp = pathlib.Path(self.root_dir.name)
-		output_file = temp/'output.log'
-
-		targets = ['a', 'b', 'c']
-		make, _ = self.mock_target(Make, 'make_target', config=ConfigDict({
-			'directory.source': temp,
-			'make.targets': targets,
-			'scripts.make': lambda config: [
-				shutil.which('python3'), '-c',
-				'open("{}", "w") .write("Make\\n{}\\n")'.format(
-					output_file, config['make.targets']
-				)
-			]
-		}))
-		self.run_target(make)
-
-		self.assertEqual('Make\n{}\n'.format(repr(targets)), output_file.open().read())
-
-class TestExecute(TargetTestCase):
-	def test_execute(self):
-		temp = pathlib.Path(self.root_dir.name)
-		output_file = temp/'output.log'
-
-		execute, _ = self.mock_target(Execute, 'exec_target', config=ConfigDict({
-			'process.name': sys.executable,
-			'process.args': [
-				'-c',
-				'open("{}", "w").write("Execute in {}\\n")'.format(output_file, temp)
-			],
-			'process.cwd': temp
-		}))
-		self.run_target(execute)
-
-		self.assertEqual('Execute in {}\n'.format(temp), output_file.open().read())
@@ -0,0 +1,140 @@
+import contextlib
+import json
+import logging
+import pathlib
+import threading
+import time
+
+class TargetTelemetry:
+	__slots__ = ('name', 'phases', 'built', 'cpu_user', 'cpu_system', 'max_rss', 'processes')
+
+	def __init__(self, name):
+		self.name = name
+		self.phases = []
+		self.built = False
+		self.cpu_user = 0.0
+		self.cpu_system = 0.0
+		self.max_rss = 0
+		self.processes = 0
+
+	def add_phase(self, name, start, end, thread=None):
+		self.phases.append((name, start, end, thread))
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		thread = threading.get_ident()
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_phase(name, start, time.perf_counter(), thread)
+
+	def add_process(self, rusage):
+		self.processes += 1
+		if rusage is not None:
+			self.cpu_user += rusage.ru_utime
+			self.cpu_system += rusage.ru_stime
+			self.max_rss = max(self.max_rss, rusage.ru_maxrss)
+
+	def merge(self, other):
+		self.processes += other.processes
+		self.cpu_user += other.cpu_user
+		self.cpu_system += other.cpu_system
+		self.max_rss = max(self.max_rss, other.max_rss)
+
+	def duration(self, phase):
+		return sum(end - start for name, start, end, _ in self.phases if name == phase)
+
+	def summary(self):
+		return {
+			'built': self.built,
+			'time': { phase: self.duration(phase) for phase in Telemetry.phases },
+			'children': {
+				'processes': self.processes,
+				'cpu_user': self.cpu_user,
+				'cpu_system': self.cpu_system,
+				'max_rss_kb': self.max_rss
+			}
+		}
+
+class Telemetry:
+	phases = ('dependencies', 'build', 'post_build')
+
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.end = None
+		self.targets = {}
+		self._lock = threading.Lock()
+
+	def target(self, target, profile=None):
+		name = '{}/{}'.format(profile, target.name) if profile is not None else target.name
+		with self._lock:
+			if name not in self.targets:
+				self.targets[name] = TargetTelemetry(name)
+			return self.targets[name]
+
+	def finish(self):
+		self.end = time.perf_counter()
+
+	def _wall_time(self):
+		return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+	def trace(self):
+		to_us = lambda t: int((t - self.start)*1e6)
+		lanes = {}
+		events = []
+		for index, record in enumerate(self.targets.values()):
+			for name, start, end, thread in record.phases:
+				if thread is None:
+					for phase, ts in (('b', start), ('e', end)):
+						events.append({
+							'name': '{} [{}]'.format(record.name, name),
+							'cat': name,
+							'ph': phase,
+							'id': index,
+							'ts': to_us(ts),
+							'pid': 1
+						})
+					continue
+				events.append({
+					'name': '{} [{}]'.format(record.name, name),
+					'cat': name,
+					'ph': 'X',
+					'ts': to_us(start),
+					'dur': to_us(end) - to_us(start),
+					'pid': 1,
+					'tid': lanes.setdefault(thread, len(lanes)+1),
+					'args': { 'target': record.name }
+				})
+			if record.processes:
+				events.append({
+					'name': record.name,
+					'ph': 'C',
+					'ts': to_us(record.phases[-1][2]),
+					'pid': 1,
+					'args': {
+						'cpu_seconds': record.cpu_user+record.cpu_system,
+						'max_rss_kb': record.max_rss
+					}
+				})
+		events.sort(key=lambda event: event['ts'])
+		return { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+
+	def summary(self):
+		return {
+			'wall_time': self._wall_time(),
+			'targets': { name: record.summary() for name, record in sorted(self.targets.items()) }
+		}
+
+	def _write(self, path, data):
+		path = pathlib.Path(path)
+		logging.info('Writing build telemetry to {}'.format(path))
+		with path.open('w') as f:
+			json.dump(data, f, indent=1)
+
+	def write_trace(self, path):
+		self._write(path, self.trace())
+
+	def write_summary(self, path):
+		self._write(path, self.summary())
+
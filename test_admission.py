@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from .admission import Admission, Sample, probe
+
+class TestAdmission(unittest.TestCase):
+	def setUp(self):
+		self.sample = Sample(0.0, 0.0, 0.0, 8*1024**3, 1.0)
+		self.admission = Admission(4, 4, probe=lambda: self.sample)
+		self.admission.interval = 0
+
+	def test_pressure(self):
+		self.admission.admit()
+		second = self.admission.admit()
+		self.assertIsNotNone(self.admission.admit())
+
+		self.sample = self.sample._replace(memory_some=50.0)
+		self.assertIsNone(self.admission.admit())
+		self.assertEqual(1, self.admission.limit)
+
+		self.sample = self.sample._replace(memory_some=0.0)
+		self.assertIsNone(self.admission.admit())
+		self.assertEqual(2, self.admission.limit)
+		self.admission.finish(second)
+		self.assertIsNotNone(self.admission.admit())
+		self.assertEqual(3, self.admission.limit)
+
+	def test_load(self):
+		first = self.admission.admit()
+		self.sample = self.sample._replace(load=100.0)
+		self.assertIsNone(self.admission.admit())
+		self.admission.finish(first)
+		self.assertIsNotNone(self.admission.admit())
+
+	def test_memory(self):
+		self.assertIsNotNone(self.admission.admit(6*1024**3))
+		self.assertIsNone(self.admission.admit(4*1024**3))
+		self.assertIsNotNone(self.admission.admit(1024**3))
+		self.assertIsNotNone(self.admission.admit())
+
+	def test_probe(self):
+		sample = probe()
+		if os.path.exists('/proc/meminfo'):
+			self.assertGreater(sample.memory_available, 0)
+
@@ -0,0 +1,432 @@
+import contextlib
+import io
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+import unittest
+import unittest.mock
+
+from .base import Profile, Scope, Target
+from .config import Config, ConfigDict
+from .scheduler import available_cpus
+from .state import State
+from . import scheduler
+from .tests import TargetTestCase
+from .build import Build
+
+class TestBuilder(TargetTestCase):
+	def test_single_target(self):
+		build = self.mock_build(Build)
+		foo, runtime_config = self.mock_target(Target, 'foo')
+		build.targets |= {foo}
+		build()
+		self.assertTrue(runtime_config.value is not None)
+
+	def test_dependencies(self):
+		foo, bar = Target('foo'), Target('bar')
+		foo.dependencies.add(bar)
+		self.assertEqual({bar}, foo.dependencies)
+		self.assertEqual(set(), bar.dependencies)
+
+	def test_main_config(self):
+		build = self.mock_build(Build, config=ConfigDict(travel='ship'))
+		ben, ben_config = self.mock_target (Target, 'Ben')
+		mary, mary_config = self.mock_target(Target, 'Mary',
+			dependencies={ben},
+			config=ConfigDict(
+				travel='plane'
+			)
+		)
+		susan, susan_config = self.mock_target(Target, 'Susan',
+			config=ConfigDict(
+				travel='car'
+			)
+		)
+		joe, joe_config = self.mock_target(Target, 'Joe',
+			dependencies={mary, susan}
+		)
+
+		build.targets |= {joe}
+		build()
+		self.assertEqual('ship', joe_config.value['travel', Scope.Global])
+		self.assertEqual('car', susan_config.value['travel', Scope.Global])
+		self.assertEqual('plane', mary_config.value['travel', Scope.Global])
+		self.assertEqual('plane', ben_config.value['travel', Scope.Global])
+
+	def test_profiles(self):
+		build = self.mock_build(Build, config=ConfigDict(travel='car'))
+		by_plane = self.mock_profile(Profile, 'by_plane', config=ConfigDict(
+			travel='plane'
+		))
+		build.profiles |= {by_plane}
+		gary, gary_config = self.mock_target(Target, 'Gary', config=ConfigDict(
+			travel='ship'
+		))
+		johnny, johnny_config = self.mock_target(Target, 'Johnny')
+		build.targets |= {gary, johnny}
+		build(args=('-p', 'by_plane'))
+		self.assertEqual('plane', johnny_config.value['travel', Scope.Global])
+		self.assertEqual('ship', gary_config.value['travel', Scope.Global])
+
+	def test_all_profiles(self):
+		roots = []
+		class Record(Target):
+			def build(self):
+				roots.append(pathlib.Path(self.config['directory.root']).name)
+		build = self.mock_build(Build)
+		build.profiles |= {self.mock_profile(Profile, 'release')}
+		build.targets |= {Record('foo', dependencies={Record('bar')})}
+		root = pathlib.Path(self.root_dir.name)
+		build(args=['--all-profiles', '-j', '2', '--summary', str(root/'summary.json')])
+
+		self.assertEqual(['default', 'default', 'release', 'release'], sorted(roots))
+		self.assertIn('release/foo', json.load((root/'summary.json').open())['targets'])
+		self.assertTrue((root/'release'/'stamps'/'state.db').exists())
+
+	def test_defaults(self):
+		target, target_config = self.mock_target(Target, 'some_target', config=ConfigDict(
+			language=ConfigDict({
+				'c': ConfigDict(
+					flags=None
+				),
+				'c++': ConfigDict(
+					flags=None
+				)
+			})
+		))
+		self.run_target(target)
+
+		self.assertTrue(target_config.value is not None)
+		root_dir = pathlib.Path(target_config.value['directory.root'])
+
+		expected_output = Config._flatten_dict(Build._default_config.copy())
+		expected_output['language.c.flags'] = None
+		expected_output['language.c++.flags'] = None
+		expected_output.update({
+			'directory.binaries': str(root_dir/'bin'),
+			'directory.include': str(root_dir/'include'),
+			'directory.packages': str(root_dir.parent/'packages'),
+			'directory.shared': str(root_dir.parent),
+			'directory.root': str(root_dir),
+			'directory.source': str(root_dir/'src'),
+			'directory.staging': str(root_dir/'staging'),
+			'directory.stamps': str(root_dir/'stamps'),
+			'directory.store': str(root_dir.parent/'store'),
+			'target.some_target.build': True
+		})
+		self.assertEqual(expected_output, target_config.value.items())
+
+	def test_outdated(self):
+		bar, bar_config = self.mock_target(Target, 'bar')
+		foo, foo_config = self.mock_target(Target, 'foo',
+			dependencies={bar}
+		)
+		build = self.mock_build(Build)
+		build.targets |= {foo}
+		build()
+
+		self.assertTrue(bar_config.value is not None)
+		bar_config.value = None
+
+		build()
+		self.assertTrue(bar_config.value is None)
+
+	def test_always_outdated(self):
+		foo, foo_config = self.mock_target(Target, 'foo', config=ConfigDict(
+			always_outdated=True,
+		))
+		build = self.mock_build(Build)
+		build.targets |= {foo}
+		build()
+
+		self.assertTrue(foo_config.value is not None)
+		foo_config.value = None
+
+		build()
+		self.assertTrue(foo_config.value is not None)
+
+	def test_telemetry(self):
+		bar, _ = self.mock_target(Target, 'bar')
+		foo, _ = self.mock_target(Target, 'foo', dependencies={bar})
+		build = self.mock_build(Build)
+		build.targets |= {foo}
+		root = pathlib.Path(self.root_dir.name)
+		build(args=['--trace', str(root/'trace.json'), '--summary', str(root/'summary.json')])
+
+		summary = json.load((root/'summary.json').open())
+		self.assertEqual({'foo', 'bar'}, set(summary['targets']))
+		self.assertTrue(summary['targets']['bar']['built'])
+		self.assertLessEqual(summary['targets']['bar']['time']['build'],
+			summary['targets']['foo']['time']['dependencies'])
+
+		trace = json.load((root/'trace.json').open())
+		self.assertIn('foo [build]', [ i['name'] for i in trace['traceEvents'] ])
+
+	def test_jobs(self):
+		order = []
+		def mock_target(name, dependencies=None):
+			target, _ = self.mock_target(Target, name, dependencies=dependencies)
+			build = target.build
+			def append():
+				build()
+				order.append(name)
+			target.build = append
+			return target
+		leaf = mock_target('leaf')
+		short = mock_target('short')
+		long_end = mock_target('long end', dependencies={mock_target('long middle', dependencies={leaf})})
+		top = mock_target('top', dependencies={short, long_end})
+		build = self.mock_build(Build)
+		build.targets |= {top}
+		build(args=['-j', '2'])
+
+		self.assertEqual(5, len(order))
+		self.assertEqual('top', order[-1])
+		self.assertLess(order.index('leaf'), order.index('long middle'))
+		self.assertLess(order.index('long middle'), order.index('long end'))
+
+		state = State(pathlib.Path(self.root_dir.name)/'default'/'stamps'/'state.db')
+		self.assertEqual({'leaf', 'short', 'long_middle', 'long_end', 'top'}, set(state.durations()))
+		state.close()
+
+	@unittest.skipUnless(hasattr(os, 'sched_getaffinity'), 'CPU affinity not supported')
+	def test_cpus(self):
+		output = pathlib.Path(self.root_dir.name)/'affinity'
+		class Affinity(Target):
+			def build(self):
+				self.call([sys.executable, '-c', 'import os,sys;open(sys.argv[1], "w").write(repr(sorted(os.sched_getaffinity(0))))', str(output)])
+		build = self.mock_build(Build)
+		build.targets |= {Affinity('affinity', config={'parallelism': 2})}
+		build()
+		self.assertEqual(repr(available_cpus()), output.read_text())
+
+		state = State(pathlib.Path(self.root_dir.name)/'default'/'stamps'/'state.db')
+		self.assertGreater(state.get('affinity').parallelism, 0)
+		state.close()
+
+	def test_alone(self):
+		cpus = []
+		class Chain(Target):
+			def build(self):
+				cpus.append(len(self.cpus()))
+		build = self.mock_build(Build)
+		build.targets |= {Chain('top', dependencies={Chain('bottom')})}
+		with unittest.mock.patch.object(scheduler, 'available_cpus', lambda: list(range(32))):
+			build(['-j', '4', '--no-admission'])
+		self.assertEqual([32, 32], cpus)
+
+	def test_keep_going(self):
+		built = []
+		broken = {'broken'}
+		class Leaf(Target):
+			def build(self):
+				if self.name in broken:
+					raise Exception('broken leaf')
+				built.append(self.name)
+		bad = Leaf('broken')
+		good = Leaf('good')
+		top = Leaf('top', dependencies={bad, good})
+		independent = Leaf('independent', dependencies={good})
+		build = self.mock_build(Build)
+		build.targets |= {top, independent}
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			self.assertRaises(Exception, build, ['-k', '-j', '2'])
+		self.assertEqual({'good', 'independent'}, set(built))
+		self.assertIn('! Failed: broken: broken leaf\n', output.getvalue())
+		self.assertIn('! Skipped: top (depends on broken)\n', output.getvalue())
+
+		del built[:]
+		self.assertRaises(Exception, build, [])
+		self.assertEqual([], built)
+
+		broken.clear()
+		build()
+		self.assertEqual(['broken', 'top'], built)
+
+	def test_locked(self):
+		script = '''import sys, time
+from {package}.locks import TargetLock
+from {package}.state import State
+stamps = sys.argv[1]
+lock = TargetLock(stamps+'/locks', 'foo')
+lock.acquire()
+print('locked', flush=True)
+if sys.argv[2] == 'build':
+	time.sleep(0.5)
+	state = State(stamps+'/state.db')
+	state.record('foo')
+	state.close()
+	lock.release()
+'''.format(package=__package__)
+		stamps = pathlib.Path(self.root_dir.name)/'default'/'stamps'
+		env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(pathlib.Path(__file__).parent.parent)]+[ i for i in sys.path if i ]))
+		def hold(mode):
+			process = subprocess.Popen([sys.executable, '-c', script, str(stamps), mode], stdout=subprocess.PIPE, env=env)
+			self.assertEqual(b'locked\n', process.stdout.readline())
+			return process
+
+		built = []
+		class Foo(Target):
+			def build(self):
+				built.append(self.name)
+		build = self.mock_build(Build)
+		build.targets |= {Foo('foo')}
+		stamps.mkdir(parents=True)
+
+		process = hold('build')
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			build(['-v'])
+		process.wait()
+		process.stdout.close()
+		self.assertEqual([], built)
+		self.assertIn('foo: waiting for another build', output.getvalue())
+
+		state = State(stamps/'state.db')
+		state.invalidate('foo')
+		state.close()
+		process = hold('crash')
+		process.wait()
+		process.stdout.close()
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			build()
+		self.assertEqual(['foo'], built)
+		self.assertIn('foo: previous build ({} '.format(socket.gethostname()), output.getvalue())
+
+	@unittest.skipUnless(os.path.exists('/proc/meminfo'), 'available memory not known')
+	def test_admission(self):
+		intervals = []
+		class Heavy(Target):
+			def build(self):
+				start = time.monotonic()
+				time.sleep(0.2)
+				intervals.append((start, time.monotonic()))
+		build = self.mock_build(Build)
+		build.targets |= { Heavy(name, config={'memory': 1024**4}) for name in ('first', 'second') }
+		build(args=['-j', '2'])
+		first, second = sorted(intervals)
+		self.assertLessEqual(first[1], second[0])
+
+	def test_dry_run(self):
+		foo, foo_config = self.mock_target(Target, 'foo')
+		bar, bar_config = self.mock_target(Target, 'bar', dependencies={foo})
+		build = self.mock_build(Build)
+		build.targets |= {bar}
+		build(args=['foo'])
+		foo_config.value = None
+
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			build(args=['--dry-run'])
+		self.assertTrue(foo_config.value is None)
+		self.assertTrue(bar_config.value is None)
+		self.assertIn('1 of 2 targets', output.getvalue())
+		self.assertIn('bar: never built', output.getvalue())
+		self.assertNotIn('foo:', output.getvalue())
+
+	def test_cache(self):
+		built = []
+		class Install(Target):
+			cacheable = True
+			def build(self):
+				built.append(self.name)
+				library = pathlib.Path(self.config['directory.root'])/'lib'
+				library.mkdir(parents=True)
+				(library/'libfoo.a').write_text('foo')
+		root = pathlib.Path(self.root_dir.name)
+		for name in ('first', 'second'):
+			build = self.mock_build(Build, config={'directory.root': str(root/name)})
+			build.targets |= {Install('foo')}
+			build(args=['--cache', str(root/'cache')])
+			self.assertEqual('foo', (root/name/'default'/'lib'/'libfoo.a').read_text())
+		self.assertEqual(['foo'], built)
+
+	def test_cache_roots(self):
+		built = []
+		class Configure(Target):
+			def build(self):
+				directory = pathlib.Path(self.config['directory.root'])/'build'
+				directory.mkdir(parents=True)
+				(directory/'config.log').write_text(str(directory))
+			def _generated(self, config):
+				return [str(pathlib.Path(self._hint(config, 'directory.root'))/'build')]
+		class Install(Target):
+			cacheable = True
+			def build(self):
+				built.append(self.name)
+				library = pathlib.Path(self.config['directory.root'])/'lib'
+				library.mkdir(parents=True)
+				(library/'libfoo.a').write_text('foo')
+		root = pathlib.Path(self.root_dir.name)
+		for name in ('first', 'second'):
+			(root/name/'default'/'src').mkdir(parents=True)
+			(root/name/'default'/'src'/'foo.c').write_text('int foo;\n')
+			configure = Configure('configure', config={'inputs': lambda config: [config['directory.source']]})
+			install = Install('foo', dependencies={configure}, config={'inputs': lambda config: [
+				config['directory.source'], str(pathlib.Path(config['directory.root'])/'build')]})
+			build = self.mock_build(Build, config={'directory.root': str(root/name)})
+			build.targets |= {install}
+			build(args=['--cache', str(root/'cache')])
+			self.assertEqual('foo', (root/name/'default'/'lib'/'libfoo.a').read_text())
+		self.assertEqual(['foo'], built)
+
+	def test_staging(self):
+		class Install(Target):
+			staged = True
+			def build(self):
+				library = pathlib.Path(str(self._destdir)+self.config['directory.root'])/'lib'
+				library.mkdir(parents=True)
+				(library/'libfoo.a').write_text('foo')
+		build = self.mock_build(Build)
+		build.targets |= {Install('foo')}
+		build()
+
+		root = pathlib.Path(self.root_dir.name)/'default'
+		self.assertEqual('foo', (root/'lib'/'libfoo.a').read_text())
+		self.assertEqual(2, os.stat(str(root/'lib'/'libfoo.a')).st_nlink)
+		self.assertTrue((root/'staging'/'foo'/'lib'/'libfoo.a').exists())
+
+		build(args=['--uninstall'])
+		self.assertFalse((root/'lib'/'libfoo.a').exists())
+		self.assertFalse((root/'staging'/'foo').exists())
+
+	def test_declared_files(self):
+		built = []
+		root = pathlib.Path(self.root_dir.name)
+		source = root/'input.txt'
+		output = root/'output.txt'
+		class Convert(Target):
+			def build(self):
+				built.append(self.name)
+				output.write_text(source.read_text().upper())
+		source.write_text('input')
+		build = self.mock_build(Build)
+		build.targets |= {Convert('convert', config={'inputs': [str(root/'in*.txt')], 'outputs': [str(output)]})}
+
+		build()
+		build()
+		self.assertEqual(['convert'], built)
+		source.write_text('changed')
+		build()
+		self.assertEqual('CHANGED', output.read_text())
+		output.unlink()
+		build()
+		self.assertEqual(['convert']*3, built)
+		self.assertTrue(output.exists())
+
+	def test_collect_target(self):
+		foo, foo_config = self.mock_target(Target, 'foo')
+		bar, bar_config = self.mock_target(Target, 'bar', dependencies={foo})
+		build = self.mock_build(Build)
+		build.targets |= {bar}
+		build(args=['foo'])
+
+		self.assertTrue(foo_config.value['build'])
+		self.assertTrue(bar_config.value is None)
+
@@ -0,0 +1,52 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+from .cache import ArtifactCache
+
+class TestArtifactCache(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.root = pathlib.Path(self.directory.name)/'root'
+		(self.root/'lib').mkdir(parents=True)
+		(self.root/'lib'/'old.a').write_text('old')
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_store_restore(self):
+		cache = ArtifactCache(pathlib.Path(self.directory.name)/'cache', 1024**2)
+		snapshot = cache.snapshot(self.root)
+		(self.root/'include').mkdir()
+		(self.root/'include'/'new.h').write_text('new')
+		os.symlink('new.h', str(self.root/'include'/'link.h'))
+		self.assertEqual(['include/link.h', 'include/new.h'], snapshot.changes())
+		cache.store('key', snapshot)
+
+		other = pathlib.Path(self.directory.name)/'other'
+		self.assertFalse(cache.restore('missing', other))
+		self.assertTrue(cache.restore('key', other))
+		self.assertEqual('new', (other/'include'/'new.h').read_text())
+		self.assertTrue((other/'include'/'link.h').is_symlink())
+		self.assertFalse((other/'lib'/'old.a').exists())
+
+	def test_key_allocation(self):
+		from .config import Config
+		from .targets import Make
+		cache = ArtifactCache(pathlib.Path(self.directory.name)/'cache', 1024**2)
+		make = Make('foo', config={'directory.source': str(self.root)})
+		config = make._configure(Config('default', {'directory.root': str(self.root)}))
+		keys = []
+		for cpus in ([0], [0, 1, 2, 3]):
+			make._cpus = cpus
+			keys.append(cache._key(make, config, None, []))
+		self.assertEqual(keys[0], keys[1])
+
+	def test_evict(self):
+		cache = ArtifactCache(pathlib.Path(self.directory.name)/'cache', 0)
+		snapshot = cache.snapshot(self.root)
+		(self.root/'lib'/'new.a').write_text('new')
+		cache.store('key', snapshot)
+		self.assertEqual([], list(cache.directory.glob('*.tar.gz')))
+
@@ -0,0 +1,150 @@
+from .config import Config, ConfigDict
+from .tests import TestCase
+from .compilers import Clang, _get_compiler
+
+class TestClang(TestCase):
+	cases_version = [
+		(b'''clang version 3.4.2 (tags/RELEASE_34/dot2-final)
+Target: x86_64-apple-darwin13.4.0
+Thread model: posix
+''', '3.4.2'),
+		(b'''clang version 3.5.0 (tags/RELEASE_350/final)
+Target: x86_64-apple-darwin13.4.0
+Thread model: posix
+''', '3.5.0'),
+		(b'''clang version 3.4 (tags/RELEASE_34/final)
+Target: x86_64-redhat-linux-gnu
+Thread model: posix
+Found candidate GCC installation: /usr/bin/../lib/gcc/x86_64-redhat-linux/4.8.3
+Found candidate GCC installation: /usr/lib/gcc/x86_64-redhat-linux/4.8.3
+Selected GCC installation: /usr/bin/../lib/gcc/x86_64-redhat-linux/4.8.3
+''', '3.4')
+	]
+
+	def test_detect_clang(self):
+		for i in self.cases_version:
+			compiler = _get_compiler(
+				'c', {'language.c.compiler': 'clang'},
+				self.mock_process(b'', i[0])
+			)
+			self.assertEqual(Clang, type(compiler))
+			self.assertEqual(i[1], compiler.version)
+
+	cases_flags_warnings = [
+		('case 1', {
+		 	'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-w']),
+		('case 2', {
+			'errors':                      True,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-Werror', '-w']),
+		('case 3', {
+			'errors':                      False,
+			'enable.normal':               True,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-Weverything', '-Wno-c99-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 4', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           True,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-pedantic', '-Wno-everything', '-Wno-c99-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 5', {
+			'errors':                      True,
+			'enable.normal':               False,
+			'enable.extensions':           True,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-Werror', '-pedantic-errors', '-Wno-everything', '-Wno-c99-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 6', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        True,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-Wno-everything', '-Wc99-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 7', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        True,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c++', ['-Wno-everything', '-Wc++98-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 8', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           True,
+			'enable.compatibility':        True,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c++', ['-pedantic', '-Wno-everything', '-Wc++98-compat-pendantic', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 9', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   True,
+			'enable.performance.platform': False,
+			'enable.system_code':          False
+		}, 'c', ['-Wno-everything', '-Wno-c99-compat', '-Wno-padded', '-Wno-packed', '-Wno-system-headers']),
+		('case 10', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': True,
+			'enable.system_code':          False
+		}, 'c', ['-Wno-everything', '-Wno-c99-compat', '-Wpadded', '-Wpacked', '-Wno-system-headers']),
+		('case 11', {
+			'errors':                      False,
+			'enable.normal':               False,
+			'enable.extensions':           False,
+			'enable.compatibility':        False,
+			'enable.performance.normal':   False,
+			'enable.performance.platform': False,
+			'enable.system_code':          True
+		}, 'c', ['-Wno-everything', '-Wno-c99-compat', '-Wno-padded', '-Wno-packed', '-Wsystem-headers']),
+		('case 12', {
+			'errors':                      True,
+			'enable.normal':               True,
+			'enable.extensions':           True,
+			'enable.compatibility':        True,
+			'enable.performance.normal':   True,
+			'enable.performance.platform': True,
+			'enable.system_code':          True
+		}, 'c', ['-Werror', '-pedantic-errors', '-Weverything', '-Wc99-compat', '-Wpadded', '-Wpacked', '-Wsystem-headers']),
+	]
+
+	def test_flags_warnings(self):
+		for i in self.cases_flags_warnings:
+			config = ConfigDict({'language.{}.warnings'.format(i[2]): ConfigDict(i[1])})
+			config = Config('test_clang_flags', config)
+			clang = Clang('3.5.0', i[2], config)
+			self.assertEqual(i[3], clang.flags, msg=i[0])
+
@@ -0,0 +1,138 @@
+from .tests import TestCase
+from .config import Config, ConfigDict, DefaultedDict, FrozenDict
+
+class TestConfig(TestCase):
+	def test_single_config(self):
+		config = Config('single')
+		self.assertEqual(0, len(config))
+		self.assertEqual(0, len(list(config)))
+
+		config['some.key'] = 'some value'
+		self.assertEqual(1, len(config))
+		self.assertEqual(1, len(list(config)))
+		self.assertEqual('some value', config['some.key'])
+
+	def test_inheit_config(self):
+		parent = Config('parent')
+		parent.config['travel'] = 'Car'
+		self.assertEqual(1, len(parent))
+		self.assertEqual(1, len(list(parent)))
+		self.assertEqual('Car', parent['travel'])
+
+		child = Config('child', parent=parent)
+		self.assertEqual(1, len(child))
+		self.assertEqual(1, len(list(child)))
+		self.assertEqual('Car', child['travel'])
+
+		child['travel'] = 'Plane'
+		self.assertEqual(1, len(child))
+		self.assertEqual(1, len(list(child)))
+		self.assertEqual('Plane', child['travel'])
+		self.assertEqual('Car', child['travel', 'parent'])
+
+		child['ticket'] = 100
+		self.assertEqual(2, len(child))
+		self.assertEqual(2, len(list(child)))
+		self.assertEqual('Plane', child['travel'])
+		self.assertEqual(100, child['ticket'])
+
+		self.assertEqual(1, len(parent))
+		self.assertEqual(1, len(list(parent)))
+		self.assertEqual('Car', parent['travel'])
+
+		child['travel', 'parent'] = 'Ship'
+		self.assertEqual(1, len(parent))
+		self.assertEqual(1, len(list(parent)))
+		self.assertEqual('Ship', parent['travel'])
+
+	def test_callable(self):
+		config = Config('cfg')
+		config['foo'] = 'bar'
+		config['baz'] = lambda config: config['foo']+' yea'
+		self.assertEqual('bar', config['foo'])
+		self.assertEqual('bar yea', config['baz'])
+
+	def test_dict_hierarchy(self):
+		config = Config('cfg', config=ConfigDict(
+			keyboard=ConfigDict(
+				count=104,
+				layout=ConfigDict(
+					usa='qwerty'
+				)
+			)
+		))
+		self.assertEqual(104, config['keyboard.count'])
+		self.assertEqual('qwerty', config['keyboard.layout.usa'])
+		self.assertRaises(KeyError, lambda: config['keyboard.layout.france'])
+		self.assertRaises(KeyError, lambda: config['keyboard.layout.germany'])
+		self.assertEqual({'usa': 'qwerty'}, config['keyboard.layout'])
+
+		config['keyboard.layout.france'] = 'azerty'
+		self.assertEqual(104, config['keyboard.count'])
+		self.assertEqual('qwerty', config['keyboard.layout.usa'])
+		self.assertEqual('azerty', config['keyboard.layout.france'])
+		self.assertRaises(KeyError, lambda: config['keyboard.layout.germany'])
+		self.assertEqual({'usa': 'qwerty', 'france': 'azerty'}, config['keyboard.layout'])
+
+		config['keyboard.layout'] = {
+			'germany': 'qwertz'
+		}
+		self.assertEqual(104, config['keyboard.count'])
+		self.assertRaises(KeyError, lambda: config['keyboard.layout.usa'])
+		self.assertRaises(KeyError, lambda: config['keyboard.layout.france'])
+		self.assertEqual('qwertz', config['keyboard.layout.germany'])
+		self.assertEqual({'germany': 'qwertz'}, config['keyboard.layout'])
+
+	def test_lazy(self):
+		calls = []
+		def probe(config):
+			calls.append(config)
+			return 'clang'
+		parent = Config('parent', ConfigDict(language=ConfigDict(c=ConfigDict(compiler='cc', toolset=probe))))
+		config = Config('child', ConfigDict(language=ConfigDict(c=ConfigDict(flags=['-O2']))),
+			Config('middle', {'jobs': 4}, parent))
+		self.assertEqual(4, len(config))
+		self.assertEqual({'language.c.compiler', 'language.c.toolset', 'language.c.flags', 'jobs'}, set(config.keys()))
+
+		language = config['language.c']
+		self.assertEqual({'compiler', 'toolset', 'flags'}, set(language))
+		self.assertEqual(['-O2'], language['flags'])
+		self.assertEqual([], calls)
+		self.assertEqual('clang', language['toolset'])
+		self.assertEqual('clang', language['toolset'])
+		self.assertEqual(1, len(calls))
+		self.assertRaises(KeyError, lambda: language['standard'])
+
+		items = config.items()
+		self.assertEqual(4, items['jobs'])
+		self.assertEqual(1, len(calls))
+		self.assertEqual({'compiler': 'cc', 'toolset': 'clang', 'flags': ['-O2']}, language.copy())
+
+	def test_items(self):
+		cfg = ConfigDict(
+			keyboard=ConfigDict(
+				count=104,
+				layout=ConfigDict(
+					usa='qwerty',
+					france='azerty'
+				)
+			)
+		)
+		config = Config('cfg', config=cfg)
+		self.assertEqual(Config._flatten_dict(cfg), config.items())
+
+	def test_defaulted(self):
+		defaults = FrozenDict({'build': 'in-tree', 'jobs': 2})
+		self.assertRaises(TypeError, defaults.update, {'jobs': 4})
+		local = DefaultedDict({'target.foo.jobs': 8}, 'target.foo.', defaults)
+		config = Config('target.foo', local, Config('parent', {'target.foo.build': 'out-of-tree'}))
+		self.assertEqual('in-tree', config['target.foo.build'])
+		self.assertEqual(8, config['target.foo.jobs'])
+		self.assertEqual({'target.foo.build', 'target.foo.jobs'}, set(config))
+
+		config['target.foo.build'] = 'staged'
+		self.assertEqual('staged', config['target.foo.build'])
+		self.assertEqual('in-tree', local['target.foo.build'])
+		self.assertEqual({'target.foo.jobs': 8}, dict(dict.items(local)))
+		self.assertIs(defaults, local.defaults)
+
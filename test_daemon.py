@@ -0,0 +1,105 @@
+import io
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+
+from .daemon import Daemon, InotifyWatcher, PollingWatcher, request, strip_arguments
+
+class TestDaemon(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.root = pathlib.Path(self.directory.name)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_strip_arguments(self):
+		self.assertEqual(['-v', 'foo'], strip_arguments(['--daemon', 'sock', '-v', '--watch', 'foo'], {'--daemon': 1, '--watch': 0}))
+		self.assertEqual(['foo'], strip_arguments(['--daemon=sock', 'foo'], {'--daemon': 1}))
+
+	def _test_watcher(self, watcher):
+		(self.root/'source').mkdir()
+		(self.root/'source'/'main.c').write_text('int main;')
+		(self.root/'input.txt').write_text('input')
+		(self.root/'other.txt').write_text('other')
+		watcher.watch([self.root/'source', self.root/'input.txt'])
+		self.assertEqual(set(), watcher.wait(0))
+
+		time.sleep(0.01)
+		(self.root/'other.txt').write_text('changed')
+		(self.root/'input.txt').write_text('changed')
+		changed = set()
+		deadline = time.monotonic()+5
+		while str(self.root/'input.txt') not in changed and time.monotonic() < deadline:
+			changed |= watcher.wait(1)
+		self.assertIn(str(self.root/'input.txt'), changed)
+		self.assertNotIn(str(self.root/'other.txt'), changed)
+
+		(self.root/'source'/'nested').mkdir()
+		time.sleep(0.05)
+		watcher.wait(0.1)
+		(self.root/'source'/'nested'/'util.c').write_text('int util;')
+		changed = set()
+		deadline = time.monotonic()+5
+		while str(self.root/'source'/'nested'/'util.c') not in changed and time.monotonic() < deadline:
+			changed |= watcher.wait(1)
+		self.assertIn(str(self.root/'source'/'nested'/'util.c'), changed)
+		watcher.close()
+
+	def test_polling_watcher(self):
+		self._test_watcher(PollingWatcher(interval=0.05))
+
+	def test_inotify_watcher(self):
+		try:
+			watcher = InotifyWatcher()
+		except (OSError, AttributeError):
+			self.skipTest('inotify is not available')
+		self._test_watcher(watcher)
+
+	def test_daemon(self):
+		from .base import Target
+		from .build import Build
+		built = []
+		class Compile(Target):
+			local_config_keys = {'file.name'}
+			input_config_keys = {'file.name'}
+			def build(self):
+				built.append(self.name)
+
+		source = self.root/'source.c'
+		source.write_text('int main;')
+		compile = Compile('compile', config={'file.name': str(source)})
+		build = Build(config={'directory.root': str(self.root/'root')})
+		build.targets |= {Compile('link', dependencies={compile})}
+
+		daemon = Daemon(build, self.root/'daemon.sock', [], watch=True)
+		thread = threading.Thread(target=daemon.serve)
+		thread.start()
+		try:
+			deadline = time.monotonic()+10
+			while len(built) < 2 and time.monotonic() < deadline:
+				time.sleep(0.05)
+			self.assertEqual(['compile', 'link'], built)
+			warm = dict(daemon.session.profiles)
+			self.assertEqual(2, len(next(iter(warm.values()))[2]))
+
+			output = io.StringIO()
+			request(daemon.address, ['--dry-run'], output=output)
+			self.assertIn('0 of 2 targets', output.getvalue())
+
+			time.sleep(0.01)
+			source.write_text('int main() {}')
+			deadline = time.monotonic()+10
+			while len(built) < 4 and time.monotonic() < deadline:
+				time.sleep(0.05)
+			self.assertEqual(['compile', 'link', 'compile', 'link'], built)
+			self.assertEqual(warm, daemon.session.profiles)
+		finally:
+			request(daemon.address, [], command='stop')
+			thread.join()
+		self.assertFalse(os.path.exists(daemon.address))
+		self.assertEqual({}, daemon.session.profiles)
+
@@ -0,0 +1,75 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from .locks import TargetLock
+
+_holder = '''import sys, time
+from {package}.locks import TargetLock
+lock = TargetLock(sys.argv[1], 'foo')
+lock.acquire()
+print('locked', flush=True)
+time.sleep(float(sys.argv[2]))
+if sys.argv[3] == 'release':
+	lock.release()
+'''.format(package=__package__.split('.')[0])
+
+class TestTargetLock(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def _hold(self, seconds, release=True):
+		env = dict(os.environ)
+		env['PYTHONPATH'] = os.pathsep.join([str(pathlib.Path(__file__).parent.parent)]+[ i for i in sys.path if i ])
+		process = subprocess.Popen([sys.executable, '-c', _holder, self.directory.name, str(seconds),
+			'release' if release else 'exit'], stdout=subprocess.PIPE, env=env)
+		self.assertEqual(b'locked\n', process.stdout.readline())
+		return process
+
+	def test_wait(self):
+		process = self._hold(0.5)
+		owners = []
+		lock = TargetLock(self.directory.name, 'foo')
+		start = time.monotonic()
+		self.assertIsNone(lock.acquire(owners.append))
+		self.assertGreater(time.monotonic() - start, 0.2)
+		self.assertEqual(1, len(owners))
+		self.assertIn(' {} '.format(process.pid), owners[0])
+		lock.release()
+		process.wait()
+		process.stdout.close()
+
+	def test_threads(self):
+		first = TargetLock(self.directory.name, 'foo')
+		first.acquire()
+		acquired = threading.Event()
+		def other():
+			lock = TargetLock(self.directory.name, 'foo')
+			lock.acquire()
+			acquired.set()
+			lock.release()
+		thread = threading.Thread(target=other)
+		thread.start()
+		self.assertFalse(acquired.wait(0.2))
+		first.release()
+		self.assertTrue(acquired.wait(5))
+		thread.join()
+
+	def test_stale(self):
+		process = self._hold(0, release=False)
+		process.wait()
+		process.stdout.close()
+		lock = TargetLock(self.directory.name, 'foo')
+		self.assertIn(' {} '.format(process.pid), lock.acquire())
+		lock.release()
+		self.assertIsNone(lock.acquire())
+		lock.release()
+
@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+from .process import Process
+
+class TestProcess(unittest.TestCase):
+	message_out = 'Well done!'
+	message_err = 'Really nice!'
+
+	def test_process(self):
+		executable = sys.executable
+		process = Process(
+			args=[executable, '-c', 'import sys;print("{stdout}");sys.stderr.write("{stderr}")'.format(
+				stdout=self.message_out, stderr=self.message_err
+			)],
+			capture_stdout=True,
+			capture_stderr=True,
+			echo_stdout=False,
+			echo_stderr=False
+		)
+		stdout, stderr = process.communicate()
+		stdout = stdout.decode('utf-8').strip()
+		stderr = stderr.decode('utf-8').strip()
+		self.assertEqual(self.message_out, stdout)
+		self.assertEqual(self.message_err, stderr)
+		self.assertIsNotNone(process.rusage)
+
+	@unittest.skipUnless(hasattr(os, 'sched_getaffinity'), 'CPU affinity not supported')
+	def test_affinity(self):
+		before = os.sched_getaffinity(0)
+		cpu = min(before)
+		process = Process([sys.executable, '-c', 'import os;print(sorted(os.sched_getaffinity(0)))'],
+			capture_stdout=True, echo_stdout=False, echo_stderr=False, affinity={cpu})
+		self.assertEqual(before, os.sched_getaffinity(0))
+		stdout, _ = process.communicate()
+		self.assertEqual(str([cpu]), stdout.decode('utf-8').strip())
+
+	def test_descriptors_closed(self):
+		before = len(os.listdir('/dev/fd'))
+		for _ in range(5):
+			Process(['true'], echo_stdout=False, echo_stderr=False).communicate()
+		self.assertEqual(before, len(os.listdir('/dev/fd')))
+
@@ -0,0 +1,72 @@
+import unittest
+
+from .scheduler import Cores, CriticalPath, Plan
+
+class TestCores(unittest.TestCase):
+	def test_allocate(self):
+		cores = Cores(range(8), 4)
+		cores.queue(self, 4)
+		with cores.allocate() as first:
+			self.assertEqual([0, 1], first)
+			with cores.allocate(3.0) as second:
+				self.assertEqual([2, 3, 4, 5], second)
+			with cores.allocate(5.0) as third:
+				self.assertEqual([2, 3, 4, 5, 6], third)
+		with Cores(range(8), 1).allocate() as alone:
+			self.assertEqual(list(range(8)), alone)
+
+	def test_oversubscribed(self):
+		cores = Cores(range(2), 4)
+		cores.queue(self, 3)
+		with cores.allocate() as first, cores.allocate() as second, cores.allocate() as third:
+			self.assertEqual([[0], [1], [0]], [first, second, third])
+
+	def test_alone(self):
+		cores = Cores(range(32), 8)
+		with cores.allocate() as alone:
+			self.assertEqual(list(range(32)), alone)
+		cores.queue(self, 2)
+		with cores.allocate() as first:
+			self.assertEqual(16, len(first))
+			with cores.allocate() as second:
+				self.assertEqual(16, len(second))
+				self.assertFalse(set(first) & set(second))
+
+class TestCriticalPath(unittest.TestCase):
+	class Target:
+		def __init__(self, name, dependencies=()):
+			self.name = name
+			self.code = name
+			self.dependencies = set(dependencies)
+
+		def __repr__(self):
+			return self.name
+
+	def test_critical_path(self):
+		a = self.Target('a')
+		b = self.Target('b')
+		c = self.Target('c', {a})
+		d = self.Target('d', {b, c})
+		durations = { 'a': 5.0, 'b': 1.0, 'c': 2.0, 'd': 1.0 }
+		path = CriticalPath([d], lambda t: durations[t.name])
+
+		self.assertEqual(8.0, path.length)
+		self.assertEqual([a, c, d], path.path())
+		self.assertEqual(0.0, path.slack(a))
+		self.assertEqual(6.0, path.slack(b))
+		self.assertEqual(8.0, path.remaining[a])
+		self.assertIn('Critical path (8.00s)', path.report())
+
+	def test_plan(self):
+		a = self.Target('a')
+		b = self.Target('b')
+		c = self.Target('c', {a, b})
+		durations = { 'a': 5.0, 'b': 1.0, 'c': 2.0 }
+		path = CriticalPath([c], lambda t: durations[t.name])
+
+		plan = Plan(path, { a: 'never built', b: None, c: 'always outdated' }, lambda t: durations[t.name], 1)
+		self.assertEqual([a, c], plan.outdated())
+		self.assertEqual([(0.0, a), (5.0, b), (5.0, c)], plan.order)
+		self.assertEqual(7.0, plan.length)
+		self.assertIn('c: always outdated', plan.report())
+
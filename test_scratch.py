@@ -0,0 +1,47 @@
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+from .scratch import place
+
+class TestScratch(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.root = pathlib.Path(self.directory.name)
+		self.scratch = self.root/'shm'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_place(self):
+		build = self.root/'project-build'
+		self.assertTrue(place(build, self.scratch, 1024**2))
+		self.assertTrue(build.is_symlink())
+		(build/'object.o').write_bytes(b'\0'*4096)
+		self.assertEqual([build.resolve()], list(self.scratch.iterdir()))
+		self.assertTrue(place(build, self.scratch, 1024**2))
+		self.assertTrue((build/'object.o').exists())
+
+	def test_budget(self):
+		self.assertFalse(place(self.root/'big-build', self.scratch, 1024**2, estimate=lambda: 2*1024**2))
+		self.assertTrue((self.root/'big-build').is_dir())
+		self.assertFalse((self.root/'big-build').is_symlink())
+		self.assertFalse(place(self.root/'big-build', self.scratch, 1024**2))
+
+	def test_spill(self):
+		build = self.root/'project-build'
+		self.assertTrue(place(build, self.scratch, 1024**2))
+		(build/'object.o').write_bytes(b'\1'*2*1024**2)
+		self.assertFalse(place(build, self.scratch, 1024**2))
+		self.assertFalse(build.is_symlink())
+		self.assertEqual([], list(build.iterdir()))
+		self.assertEqual([], list(self.scratch.iterdir()))
+
+	def test_removed(self):
+		build = self.root/'project-build'
+		self.assertTrue(place(build, self.scratch, 1024**2))
+		shutil.rmtree(str(self.scratch))
+		self.assertTrue(place(build, self.scratch, 1024**2))
+		self.assertTrue(build.is_dir())
+
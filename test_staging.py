@@ -0,0 +1,38 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+from .state import State
+from .staging import compose, destdir, relocate, uninstall
+
+class TestStaging(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.root = pathlib.Path(self.directory.name)/'root'
+		self.state = State(pathlib.Path(self.directory.name)/'state.db')
+
+	def tearDown(self):
+		self.state.close()
+		self.directory.cleanup()
+
+	def test_compose(self):
+		staging = self.root/'staging'/'foo'
+		installed = destdir(staging)/str(self.root).lstrip(os.sep)/'lib'
+		installed.mkdir(parents=True)
+		(installed/'libfoo.so.1').write_text('foo')
+		os.symlink('libfoo.so.1', str(installed/'libfoo.so'))
+		relocate(self.root, staging)
+		self.assertFalse(destdir(staging).exists())
+
+		self.assertEqual(['lib/libfoo.so', 'lib/libfoo.so.1'], sorted(compose('foo', self.root, staging, self.state)))
+		self.assertEqual('foo', (self.root/'lib'/'libfoo.so').read_text())
+		self.assertTrue((self.root/'lib'/'libfoo.so').is_symlink())
+		self.assertEqual(2, os.stat(str(self.root/'lib'/'libfoo.so.1')).st_nlink)
+		self.assertEqual('foo', self.state.owner('lib/libfoo.so.1'))
+
+		uninstall('foo', self.root, staging, self.state)
+		self.assertEqual([], list((self.root/'lib').iterdir()))
+		self.assertFalse(staging.exists())
+		self.assertIsNone(self.state.owner('lib/libfoo.so.1'))
+
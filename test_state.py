@@ -0,0 +1,136 @@
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+
+from .state import State
+
+class TestState(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = pathlib.Path(self.directory.name)/'state.db'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_record(self):
+		state = State(self.path)
+		self.assertIsNone(state.get('foo'))
+		state.record('foo', fingerprint='abc', duration=2.5, outputs=['/some/file'], parallelism=3.5)
+		self.assertEqual('abc', state.get('foo').fingerprint)
+		state.close()
+
+		state = State(self.path)
+		self.assertEqual(['/some/file'], state.get('foo').outputs)
+		self.assertEqual(3.5, state.get('foo').parallelism)
+		self.assertEqual({'foo': 2.5}, state.durations())
+		state.invalidate('foo')
+		state.close()
+
+		self.assertIsNone(State(self.path).get('foo'))
+
+	def test_refresh(self):
+		state, other = State(self.path), State(self.path)
+		self.assertIsNone(state.get('foo'))
+		other.record('foo', fingerprint='abc')
+		other.flush()
+		self.assertIsNone(state.get('foo'))
+		self.assertEqual('abc', state.refresh('foo').fingerprint)
+		state.record('foo', fingerprint='def')
+		self.assertEqual('def', state.refresh('foo').fingerprint)
+		other.invalidate('foo')
+		other.flush()
+		state.flush()
+		other.close()
+		self.assertEqual('def', state.refresh('foo').fingerprint)
+		state.close()
+
+	def test_files(self):
+		state = State(self.path)
+		state.own('foo', ['lib/libfoo.a', 'include/foo.h'])
+		state.own('bar', ['include/foo.h'])
+		self.assertEqual(['lib/libfoo.a'], state.installed('foo'))
+		self.assertEqual('bar', state.owner('include/foo.h'))
+		state.own('bar', [])
+		self.assertIsNone(state.owner('include/foo.h'))
+		state.close()
+
+	def test_steps(self):
+		state = State(self.path)
+		state.record_step('foo', 0, 'configure', 'abc')
+		state.record_step('foo', 1, 'build', 'def')
+		state.record_step('foo', 2, 'install', 'ghi')
+		state.record_step('bar', 0, 'configure', 'jkl')
+		self.assertEqual([('configure', 'abc'), ('build', 'def'), ('install', 'ghi')], state.steps('foo'))
+		state.record_step('foo', 1, 'build', None)
+		state.close()
+		self.assertEqual([('configure', 'abc'), ('build', None)], State(self.path).steps('foo'))
+
+	def test_hash_paths(self):
+		state = State(self.path)
+		state.racy_seconds = 0
+		directory = self.path.parent/'tree'
+		(directory/'nested').mkdir(parents=True)
+		(directory/'nested'/'file').write_text('content')
+		digest = state.hash_paths([directory])
+		self.assertEqual(digest, state.hash_paths([directory]))
+		state.close()
+
+		state = State(self.path)
+		stat = (directory/'nested'/'file').stat()
+		(directory/'nested'/'file').write_text('CONTENT')
+		os.utime(str(directory/'nested'/'file'), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+		self.assertEqual(digest, state.hash_paths([directory]))
+		(directory/'nested'/'file').write_text('changed')
+		self.assertNotEqual(digest, state.hash_paths([directory]))
+		self.assertNotEqual(state.hash_paths([directory/'missing']), state.hash_paths([directory/'other']))
+		state.close()
+
+	def test_hash_relative(self):
+		state = State(self.path)
+		roots = [ self.path.parent/name for name in ('first', 'second') ]
+		for root in roots:
+			(root/'src').mkdir(parents=True)
+			(root/'src'/'file').write_text('content')
+		self.assertNotEqual(state.hash_paths([roots[0]/'src']), state.hash_paths([roots[1]/'src']))
+		self.assertEqual(*[ state.hash_paths([root/'src'], root) for root in roots ])
+		state.close()
+
+	def test_batch(self):
+		state = State(self.path)
+		state.batch_size = 2
+		state.record('foo')
+		self.assertIsNone(State(self.path).get('foo'))
+		state.record('bar')
+		self.assertIsNotNone(State(self.path).get('foo'))
+		state.close()
+
+	def test_flush_target(self):
+		state = State(self.path)
+		state.racy_seconds = 0
+		state.record('foo')
+		state.record('bar')
+		state.hash_file(__file__)
+		state.flush('foo')
+		other = State(self.path)
+		self.assertIsNotNone(other.get('foo'))
+		self.assertIsNone(other.get('bar'))
+		self.assertEqual([], other._connection.execute('SELECT * FROM stats').fetchall())
+		other.close()
+		state.close()
+
+	def test_migrate(self):
+		directory = self.path.parent
+		(directory/'.stamp-foo').touch()
+		(directory/'.stamp-bar').touch()
+		json.dump({'foo': 4.0}, (directory/'history.json').open('w'))
+
+		state = State(self.path)
+		state.migrate(directory)
+		self.assertEqual({'foo': 4.0}, state.durations())
+		self.assertIsNotNone(state.get('bar'))
+		self.assertEqual([], list(directory.glob('.stamp-*')))
+		self.assertFalse((directory/'history.json').exists())
+		state.close()
+
@@ -0,0 +1,38 @@
+import os
+import pathlib
+import stat
+import tempfile
+import unittest
+
+from .store import contains, key, key_of, populate
+
+class TestStore(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.store = pathlib.Path(self.directory.name)/'store'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_populate(self):
+		calls = []
+		def fill(directory):
+			calls.append(directory)
+			(directory/'README').write_text('readme')
+		directory, created = populate(self.store, key('abc'), fill)
+		self.assertTrue(created)
+		self.assertEqual('readme', (directory/'README').read_text())
+		self.assertEqual(0, os.stat(str(directory/'README')).st_mode & stat.S_IWUSR)
+		self.assertEqual(key('abc'), key_of(self.store, directory))
+		self.assertFalse(contains(self.store, self.directory.name))
+
+		self.assertEqual((directory, False), populate(self.store, key('abc'), fill))
+		self.assertEqual(1, len(calls))
+		self.assertEqual([directory], list(self.store.iterdir()))
+
+	def test_failed(self):
+		def fill(directory):
+			raise Exception('failed')
+		self.assertRaises(Exception, populate, self.store, key('abc'), fill)
+		self.assertEqual([], list(self.store.iterdir()))
+
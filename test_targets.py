@@ -0,0 +1,576 @@
+import filecmp
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tarfile
+import unittest
+
+from .base import Target
+from .config import ConfigDict
+from .tests import TargetTestCase
+from .targets import Autotools, CMake, Copy, Create, Download, Execute, Extract, GitCheckout, Make, Pack, Patch, PatchSeries
+
+class TestDownload(TargetTestCase):
+	def test_download(self):
+		example_file = pathlib.Path(__file__)
+
+		download, _ = self.mock_target(Download, 'download_plane', config=ConfigDict(
+			url=lambda config: example_file.as_uri()
+		))
+		after_download, after_download_config = self.mock_target(Target, 'after download',
+			dependencies={download},
+			config=ConfigDict({
+				'target.after_download.always_outdated': True
+			})
+		)
+
+		self.run_target(after_download)
+		self.assertTrue(after_download_config.value['target.download_plane.build'])
+		downloaded_file = after_download_config.value['target.download_plane.file.output']
+		self.assertTrue(str(downloaded_file).endswith(example_file.name))
+		self.assertEqual(example_file.open().read(), downloaded_file.open().read())
+
+		self.run_target(after_download)
+		self.assertFalse(after_download_config.value['target.download_plane.build'])
+		downloaded_file = after_download_config.value['target.download_plane.file.output']
+		self.assertTrue(str(downloaded_file).endswith(example_file.name))
+		self.assertEqual(example_file.open().read(), downloaded_file.open().read())
+
+class TestExtract(TargetTestCase):
+	def assertEqualDirectories(self, left, right):
+		diff = filecmp.dircmp(str(left), str(right))
+		if len(diff.left_only) != 0:
+			raise AssertionError('Only in {}: {}'.format(left, diff.left_only))
+		if len(diff.right_only) != 0:
+			raise AssertionError('Only in {}: {}'.format(right, diff.right_only))
+		if len(diff.diff_files) != 0:
+			raise AssertionError('Files {} differ between {} and {}'.format(diff.diff_files, left, right))
+		if len(diff.funny_files) != 0:
+			raise Exception('Could not compare {} between {} and {}'.format(diff.funny_files, left, right))
+
+	def test_extract(self):
+		this_directory = pathlib.Path(__file__).parent
+		root_dir = pathlib.Path(self.root_dir.name)
+
+		archive_file = root_dir/'archive'
+		archive_file = pathlib.Path(shutil.make_archive(str(archive_file), format='gztar',
+				root_dir=str(this_directory)))
+
+		output_dir = root_dir/'extract'
+
+		extract, extract_config = self.mock_target(Extract, 'extract_files', config=ConfigDict({
+				'file.name': archive_file,
+				'directory.output': output_dir,
+		}))
+		after_extract, after_extract_config = self.mock_target(Target, 'after extract',
+			dependencies={extract}, config=ConfigDict({
+				'target.after_extract.always_outdated': True
+			})
+		)
+
+		self.run_target(after_extract)
+		self.assertTrue(after_extract_config.value['target.extract_files.build'])
+		self.assertEqual(str(output_dir), after_extract_config.value['target.extract_files.directory.output'])
+		self.assertEqualDirectories(output_dir, this_directory)
+
+		self.run_target(after_extract)
+		self.assertFalse(after_extract_config.value['target.extract_files.build'])
+		self.assertEqual(str(output_dir), after_extract_config.value['target.extract_files.directory.output'])
+		self.assertEqualDirectories(output_dir, this_directory)
+
+class TestPack(TargetTestCase):
+	def setUp(self):
+		super().setUp()
+		self.root = pathlib.Path(self.root_dir.name)
+		self.tree = self.root/'tree'
+		(self.tree/'bin').mkdir(parents=True)
+		(self.tree/'bin'/'tool').write_bytes(os.urandom(64*1024))
+		(self.tree/'bin'/'tool').chmod(0o755)
+		(self.tree/'share').mkdir()
+		(self.tree/'share'/'readme').write_text('readme\n'*10000)
+		(self.tree/'share'/'link').symlink_to('readme')
+
+	def pack(self, name, **config):
+		output = self.root/name
+		pack = Pack('pack', config=ConfigDict(directory=self.tree, chunk=1/16, **{'file.output': output}, **config))
+		self.run_target(pack)
+		return output
+
+	def assertUnpacked(self, output):
+		with tarfile.open(str(output)) as tar:
+			self.assertEqual(['bin', 'bin/tool', 'share', 'share/link', 'share/readme'], tar.getnames())
+			self.assertEqual({0}, { i.mtime for i in tar.getmembers() })
+			self.assertEqual(0o755, tar.getmember('bin/tool').mode)
+			self.assertEqual('readme', tar.getmember('share/link').linkname)
+			self.assertEqual((self.tree/'bin'/'tool').read_bytes(), tar.extractfile('bin/tool').read())
+
+	def test_gzip(self):
+		output = self.pack('tree.tar.gz')
+		self.assertUnpacked(output)
+		self.assertGreater(output.read_bytes().count(b'\x1f\x8b\x08\x00\x00\x00\x00\x00'), 1)
+
+		first = output.read_bytes()
+		output.unlink()
+		os.utime(str(self.tree/'share'/'readme'), (1, 1))
+		self.assertEqual(first, self.pack('tree.tar.gz').read_bytes())
+
+	def test_xz(self):
+		output = self.pack('tree.txz', level=1)
+		self.assertUnpacked(output)
+		self.assertGreater(output.read_bytes().count(b'\xfd7zXZ\x00'), 1)
+
+	def test_unsupported(self):
+		self.assertRaises(Exception, self.pack, 'tree.zip')
+
+@unittest.skipIf(shutil.which('git') is None, 'git not available')
+class TestGitCheckout(TargetTestCase):
+	def setUp(self):
+		super().setUp()
+		self.root = pathlib.Path(self.root_dir.name)
+		self.upstream = self.root/'upstream'
+		self.upstream.mkdir()
+		self.commits = [ self.commit('version {}\n'.format(i)) for i in range(3) ]
+		self.git('config', 'uploadpack.allowFilter', 'true')
+		self.git('config', 'uploadpack.allowAnySHA1InWant', 'true')
+
+	def git(self, *args):
+		env = dict(os.environ, GIT_AUTHOR_NAME='Builder', GIT_AUTHOR_EMAIL='builder@example.com',
+			GIT_COMMITTER_NAME='Builder', GIT_COMMITTER_EMAIL='builder@example.com')
+		return subprocess.run(['git']+list(args), cwd=str(self.upstream), env=env, check=True,
+			stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8').strip()
+
+	def commit(self, content):
+		if not (self.upstream/'.git').exists():
+			self.git('init', '-q', '-b', 'main')
+		(self.upstream/'file.txt').write_text(content)
+		self.git('add', 'file.txt')
+		self.git('commit', '-q', '-m', content)
+		return self.git('rev-parse', 'HEAD')
+
+	def checkout(self, name, **config):
+		config.setdefault('url', self.upstream.as_uri())
+		target = GitCheckout(name, config=ConfigDict(**config))
+		self.run_target(target)
+		return self.root/'default'/'src'/target.code
+
+	def test_checkout(self):
+		directory = self.checkout('first', revision=self.commits[1], depth=1, filter='blob:none')
+		self.assertEqual('version 1\n', (directory/'file.txt').read_text())
+		mirror, = (self.root/'git').glob('*.git')
+		self.assertTrue((mirror/'shallow').exists())
+
+		self.upstream.rename(self.root/'offline')
+		other = self.checkout('second', revision=self.commits[1], **{'directory.mirrors': self.root/'git'})
+		self.assertEqual('version 1\n', (other/'file.txt').read_text())
+		self.checkout('first', revision=self.commits[1], depth=1, filter='blob:none')
+		self.assertRaises(Exception, self.checkout, 'first', revision=self.commits[0], depth=1)
+		(self.root/'offline').rename(self.upstream)
+
+		self.checkout('first', revision='main', depth=1)
+		self.assertEqual('version 2\n', (directory/'file.txt').read_text())
+
+	def test_parallel(self):
+		from .build import Build
+		targets = { GitCheckout('checkout {}'.format(i), config=ConfigDict(url=self.upstream.as_uri(),
+			revision=self.commits[i])) for i in range(2) }
+		build = self.mock_build(Build)
+		build.targets |= targets
+		build(['-j', '2', '--no-admission'])
+		for i in range(2):
+			self.assertEqual('version {}\n'.format(i), (self.root/'default'/'src'/'checkout_{}'.format(i)/'file.txt').read_text())
+
+	def test_shared(self):
+		directory = self.checkout('shared', revision=self.commits[0], checkout='shared')
+		self.assertEqual('version 0\n', (directory/'file.txt').read_text())
+		self.assertTrue((directory/'.git'/'objects'/'info'/'alternates').exists())
+		self.commits.append(self.commit('version 3\n'))
+		self.checkout('shared', revision=self.commits[3], checkout='shared')
+		self.assertEqual('version 3\n', (directory/'file.txt').read_text())
+		self.assertRaises(Exception, self.checkout, 'shared', checkout='shared', filter='blob:none')
+
+	def test_broken(self):
+		git = self.root/'git.sh'
+		git.write_text('#!/bin/sh\n[ "$1 $2" = "rev-parse HEAD" ] && exit 1\nexec git "$@"\n')
+		git.chmod(0o755)
+		self.assertRaises(Exception, self.checkout, 'broken', revision='main', **{'scripts.git': [str(git)]})
+		self.checkout('broken', revision=self.commits[0])
+		self.assertRaises(Exception, self.checkout, 'broken', revision=self.commits[0], **{'scripts.git': [str(git)]})
+
+class TestPatch(TargetTestCase):
+	input_file = '''YODA: Code!  Yes.  A programmer's strength flows from code
+      maintainability.  But beware of Perl.  Terse syntax... more
+      than one way to do it...  default variables.  The dark side
+      of code maintainability are they.  Easily they flow, quick
+      to join you when code you write.  If once you start down the
+      dark path, forever will it dominate your destiny, consume
+      you it will.
+LUKE: Is Perl better than Python?
+YODA: Yes... yes... yes.  Quicker, easier, more maintainable.
+LUKE: But how will I know why Python is better than Perl?
+YODA: You will know.  When your code you try to read six months
+      from now.'''
+
+	patch = '''--- a/{file_name}\t
++++ b/{file_name}\t
+@@ -7,5 +7,5 @@
+       you it will.
+ LUKE: Is Perl better than Python?
+-YODA: Yes... yes... yes.  Quicker, easier, more maintainable.
++YODA: No... no... no.  Quicker, easier, more seductive.
+ LUKE: But how will I know why Python is better than Perl?
+ YODA: You will know.  When your code you try to read six months
+'''
+
+	output_file = '''YODA: Code!  Yes.  A programmer's strength flows from code
+      maintainability.  But beware of Perl.  Terse syntax... more
+      than one way to do it...  default variables.  The dark side
+      of code maintainability are they.  Easily they flow, quick
+      to join you when code you write.  If once you start down the
+      dark path, forever will it dominate your destiny, consume
+      you it will.
+LUKE: Is Perl better than Python?
+YODA: No... no... no.  Quicker, easier, more seductive.
+LUKE: But how will I know why Python is better than Perl?
+YODA: You will know.  When your code you try to read six months
+      from now.'''
+
+	def test_patch(self):
+		temp = pathlib.Path(self.root_dir.name)
+		input_file = temp/'The Empire Strikes Back.txt'
+		input_file.open('w').write(self.input_file)
+		patch_file = temp/'The Empire Strikes Back.patch'
+		patch_file.open('w').write(self.patch.format(file_name=input_file.name))
+
+		patch, _ = self.mock_target(Patch, 'patch_files', config=ConfigDict(
+			directory=temp,
+			file=patch_file
+		))
+		self.run_target(patch)
+
+		output = input_file.open().read()
+		self.assertEqual(self.output_file, output)
+
+	def test_store(self):
+		temp = pathlib.Path(self.root_dir.name)
+		(temp/'sources').mkdir()
+		input_file = temp/'sources'/'The Empire Strikes Back.txt'
+		input_file.open('w').write(self.input_file)
+		archive = shutil.make_archive(str(temp/'sources'), format='gztar', root_dir=str(temp/'sources'))
+		patch_file = temp/'The Empire Strikes Back.patch'
+		patch_file.open('w').write(self.patch.format(file_name=input_file.name))
+
+		extract, extract_config = self.mock_target(Extract, 'extract', config={'file.name': archive, 'store': True})
+		patch, patch_config = self.mock_target(Patch, 'patch', dependencies={extract}, config={
+			'directory': lambda config: config['target.extract.directory.output'],
+			'file': patch_file,
+			'store': True
+		})
+		self.run_target(patch)
+
+		extracted = pathlib.Path(patch_config.value['target.extract.directory.output'])
+		self.assertEqual(temp/'store', extracted.parent)
+		patched, = [ i for i in (temp/'store').iterdir() if i != extracted ]
+		self.assertEqual(self.input_file, (extracted/input_file.name).open().read())
+		self.assertEqual(self.output_file, (patched/input_file.name).open().read())
+		self.assertEqual(0, os.stat(str(patched/input_file.name)).st_mode & 0o200)
+
+		extract_config.value = patch_config.value = None
+		self.run_target(patch)
+		self.assertIsNone(extract_config.value)
+		self.assertIsNone(patch_config.value)
+
+class TestPatchSeries(TargetTestCase):
+	original = ''.join('line {}\n'.format(i) for i in range(1, 31))
+
+	@staticmethod
+	def _patch(line, replacement):
+		return '--- a/file.txt\n+++ b/file.txt\n@@ -{0},3 +{0},3 @@\n line {0}\n-line {1}\n+{2}\n line {3}\n'.format(
+			line-1, line, replacement, line+1)
+
+	def setUp(self):
+		super().setUp()
+		self.temp = pathlib.Path(self.root_dir.name)
+		(self.temp/'source').mkdir()
+		self.source = self.temp/'source'/'file.txt'
+		self.source.write_text(self.original)
+		self.patches = [ self.temp/'{}.patch'.format(i) for i in range(3) ]
+		for i, line in enumerate((5, 15, 25)):
+			self.patches[i].write_text(self._patch(line, 'patched {}'.format(line)))
+
+		self.applied = []
+		applied = self.applied
+		class Series(PatchSeries):
+			def _apply(self, text, directory, backup):
+				applied.append(text)
+				return super()._apply(text, directory, backup)
+		self.series = Series('series', config={'directory': self.temp/'source', 'files': self.patches})
+
+	def test_series(self):
+		self.run_target(self.series)
+		lines = self.source.read_text().splitlines()
+		self.assertEqual(['patched 5', 'patched 15', 'patched 25'], [lines[4], lines[14], lines[24]])
+		self.assertEqual(3, len(self.applied))
+
+		self.patches[1].write_text(self._patch(15, 'changed fifteen'))
+		self.run_target(self.series)
+		lines = self.source.read_text().splitlines()
+		self.assertEqual(['patched 5', 'changed fifteen', 'patched 25'], [lines[4], lines[14], lines[24]])
+		self.assertEqual(5, len(self.applied))
+
+		self.patches[2].write_text(self._patch(26, 'does not apply').replace('line 25', 'missing'))
+		self.assertRaises(Exception, self.run_target, self.series)
+		lines = self.source.read_text().splitlines()
+		self.assertEqual(['patched 5', 'changed fifteen', 'patched 25'], [lines[4], lines[14], lines[24]])
+
+		self.patches[2].write_text(self._patch(25, 'twenty five, again'))
+		self.run_target(self.series)
+		lines = self.source.read_text().splitlines()
+		self.assertEqual(['patched 5', 'changed fifteen', 'twenty five, again'], [lines[4], lines[14], lines[24]])
+		self.assertEqual(7, len(self.applied))
+
+	def test_replaced_tree(self):
+		self.run_target(self.series)
+		self.source.write_text(self.original)
+		self.patches[2].write_text(self._patch(25, 'twenty five, again'))
+		self.run_target(self.series)
+		lines = self.source.read_text().splitlines()
+		self.assertEqual(['patched 5', 'patched 15', 'twenty five, again'], [lines[4], lines[14], lines[24]])
+		self.assertEqual(6, len(self.applied))
+
+class TestCreate(TargetTestCase):
+	content = '''<refrigerator> [to dishwasher] "...so I'm inclined to believe that
+capping the capital gains tax at 13% would enable sustainable
+growth in the GNP of over 4%."'''
+	file_name = 'waiting for God.txt'
+	directory_name = 'example'
+
+	def test_create_file(self):
+		root = pathlib.Path(self.root_dir.name)
+		file_name = root/self.file_name
+
+		create, _ = self.mock_target(Create, 'create_file', config=ConfigDict(
+			file=ConfigDict(
+				name=file_name,
+				content=self.content
+			)
+		))
+		self.run_target(create)
+
+		output = file_name.open().read()
+		self.assertEqual(self.content, output)
+
+	def test_create_directory(self):
+		root = pathlib.Path(self.root_dir.name)
+		directory_name = root/self.directory_name
+
+		create, _ = self.mock_target(Create, 'create_file', config=ConfigDict(
+			file=ConfigDict(
+				name=directory_name,
+				kind='directory'
+			)
+		))
+		self.run_target(create)
+
+		self.assertTrue(directory_name.is_dir())
+
+	def test_create_file_in_directory(self):
+		root = pathlib.Path(self.root_dir.name)
+		directory_name = root/self.directory_name
+		file_name = directory_name/self.file_name
+
+		create, _ = self.mock_target(Create, 'create_dir_and_file', config=ConfigDict(
+			file=ConfigDict(
+				name=str(file_name),
+				content=self.content
+			)
+		))
+		self.run_target(create)
+
+		self.assertTrue(directory_name.is_dir())
+		self.assertEqual(self.content, file_name.open().read())
+
+class TestCopy(TargetTestCase):
+	def test_copy(self):
+		this_directory = pathlib.Path(__file__).parent
+		temp = pathlib.Path(self.root_dir.name)
+
+		copy, _ = self.mock_target(Copy, 'copy_files', config=ConfigDict(
+			source=lambda config: this_directory.glob('*.py'),
+			destination=temp
+		))
+		self.run_target(copy)
+
+		for i in temp.iterdir():
+			if i.is_file():
+				j = this_directory/i.name
+				self.assertEqual(j.open().read(), i.open().read())
+
+class TestAutotools(TargetTestCase):
+	def test_autotools(self):
+		root_dir = pathlib.Path(self.root_dir.name)
+		(root_dir/'default'/'src').mkdir(parents=True)
+		output_file = root_dir/'output.log'
+
+		autotools, _ = self.mock_target(Autotools, 'autotools_project', config=ConfigDict(
+			scripts=ConfigDict(
+				autoreconf=[shutil.which('python3'), '-c', 'open("{}", "a").write("Autoreconf\\n")'.format(output_file)],
+				configure=[shutil.which('python3'), '-c', 'open("{}", "a").write("Configure\\n")'.format(output_file)]
+			)
+		))
+		self.run_target(autotools, build_config=ConfigDict(
+			language=ConfigDict({
+				'c': ConfigDict(
+					compiler='',
+					flags=[]
+				),
+				'c++': ConfigDict(
+					compiler='',
+					flags=[]
+				)
+			})
+		))
+
+		output = output_file.open().read()
+		self.assertEqual('Autoreconf\nConfigure\n', output)
+
+	def test_steps(self):
+		root_dir = pathlib.Path(self.root_dir.name)
+		source = root_dir/'default'/'src'
+		source.mkdir(parents=True)
+		(source/'configure.ac').write_text('AC_INIT')
+		output_file = root_dir/'output.log'
+		failure = root_dir/'fail'
+
+		autotools = Autotools('autotools_project', config=ConfigDict(
+			directory=ConfigDict(source=source, build=root_dir/'build'),
+			scripts=ConfigDict(
+				autoreconf=[sys.executable, '-c', 'open("{}", "a").write("Autoreconf\\n");open("configure", "w")'.format(output_file)],
+				configure=[sys.executable, '-c', 'import os,sys;open("{}", "a").write("Configure\\n");'
+					'os.path.exists("{}") and sys.exit(1);open("config.status", "w")'.format(output_file, failure)]
+			)
+		))
+		build_config = ConfigDict(
+			language=ConfigDict({ i: ConfigDict(compiler='cc', flags=[]) for i in ('c', 'c++') }),
+			linker=ConfigDict(flags=[])
+		)
+		runs = []
+		def run():
+			try:
+				self.run_target(autotools, build_config=build_config)
+			finally:
+				runs.append(output_file.read_text().splitlines() if output_file.exists() else [])
+				if output_file.exists():
+					output_file.unlink()
+
+		failure.touch()
+		self.assertRaises(Exception, run)
+		failure.unlink()
+		run()
+		run()
+		(source/'configure.ac').write_text('AC_INIT([changed])')
+		run()
+		self.assertEqual([['Autoreconf', 'Configure'], ['Configure'], [], ['Autoreconf', 'Configure']], runs)
+
+	def test_scratch(self):
+		root_dir = pathlib.Path(self.root_dir.name)
+		source = root_dir/'default'/'src'
+		source.mkdir(parents=True)
+		(source/'configure').touch()
+		autotools = Autotools('autotools_project', config=ConfigDict(
+			directory=ConfigDict(source=source, build=root_dir/'build'),
+			scripts=ConfigDict(
+				autoreconf=[sys.executable, '-c', ''],
+				configure=[sys.executable, '-c', 'open("config.status", "w")']
+			)
+		))
+		build_config = ConfigDict(
+			language=ConfigDict({ i: ConfigDict(compiler='cc', flags=[]) for i in ('c', 'c++') }),
+			linker=ConfigDict(flags=[]),
+			scratch=ConfigDict(directory=root_dir/'shm')
+		)
+		self.run_target(autotools, build_config=build_config)
+		self.assertTrue((root_dir/'build').is_symlink())
+		self.assertEqual([root_dir/'shm'], [ i.parent for i in (root_dir/'shm').iterdir() ])
+		self.assertTrue((root_dir/'build'/'config.status').exists())
+
+class TestCMake(TargetTestCase):
+	def test_cmake(self):
+		root_dir = pathlib.Path(self.root_dir.name)
+		output_file = root_dir/'output.log'
+
+		cmake_mock = '''import sys
+open("{}", "a").write("CMake\\n"+repr(sys.argv[2:]))
+'''.format(output_file)
+
+		cmake, _ = self.mock_target(CMake, 'cmake_project', config=ConfigDict(
+			scripts=ConfigDict(
+				cmake=[shutil.which('python3'), '-c', cmake_mock]
+			)
+		))
+		self.run_target(cmake, build_config=ConfigDict(
+			language=ConfigDict({
+				'c': ConfigDict(
+					compiler='',
+					flags=[]
+				),
+				'c++': ConfigDict(
+					compiler='',
+					flags=[]
+				)
+			})
+		))
+
+		output = output_file.open().read()
+		self.assertTrue(output.startswith('CMake'))
+		output = output[6:].strip()
+		output = eval(output)
+
+		defines = { i for i in output if i.startswith('-D') }
+
+		self.assertEqual({
+			'-DCMAKE_INSTALL_PREFIX={}'.format(root_dir/'default'),
+			'-DCMAKE_C_FLAGS=""',
+			'-DCMAKE_CXX_FLAGS=""',
+			'-DCMAKE_C_COMPILER=""',
+			'-DCMAKE_CXX_COMPILER=""'
+		}, defines)
+
+class TestMake(TargetTestCase):
+	def test_make(self):
+		temp = pathlib.Path(self.root_dir.name)
+		output_file = temp/'output.log'
+
+		targets = ['a', 'b', 'c']
+		make, _ = self.mock_target(Make, 'make_target', config=ConfigDict({
+			'directory.source': temp,
+			'make.targets': targets,
+			'scripts.make': lambda config: [
+				shutil.which('python3'), '-c',
+				'open("{}", "w") .write("Make\\n{}\\n")'.format(
+					output_file, config['make.targets']
+				)
+			]
+		}))
+		self.run_target(make)
+
+		self.assertEqual('Make\n{}\n'.format(repr(targets)), output_file.open().read())
+
+class TestExecute(TargetTestCase):
+	def test_execute(self):
+		temp = pathlib.Path(self.root_dir.name)
+		output_file = temp/'output.log'
+
+		execute, _ = self.mock_target(Execute, 'exec_target', config=ConfigDict({
+			'process.name': sys.executable,
+			'process.args': [
+				'-c',
+				'open("{}", "w").write("Execute in {}\\n")'.format(output_file, temp)
+			],
+			'process.cwd': temp
+		}))
+		self.run_target(execute)
+
+		self.assertEqual('Execute in {}\n'.format(temp), output_file.open().read())
+
@@ -0,0 +1,47 @@
+import json
+import unittest
+
+from .telemetry import Telemetry
+
+class TestTelemetry(unittest.TestCase):
+	class Rusage:
+		ru_utime = 1.5
+		ru_stime = 0.5
+		ru_maxrss = 2048
+
+	class Target:
+		def __init__(self, name):
+			self.name = name
+
+	def test_summary(self):
+		telemetry = Telemetry()
+		record = telemetry.target(self.Target('foo'))
+		record.add_phase('dependencies', telemetry.start, telemetry.start+1.0)
+		with record.phase('build'):
+			record.add_process(self.Rusage())
+			record.add_process(self.Rusage())
+		telemetry.finish()
+
+		summary = telemetry.summary()['targets']['foo']
+		self.assertEqual(2, summary['children']['processes'])
+		self.assertEqual(3.0, summary['children']['cpu_user'])
+		self.assertEqual(2048, summary['children']['max_rss_kb'])
+		self.assertEqual(1.0, summary['time']['dependencies'])
+		self.assertEqual(0, summary['time']['post_build'])
+		self.assertIs(record, telemetry.target(self.Target('foo')))
+
+	def test_trace(self):
+		telemetry = Telemetry()
+		record = telemetry.target(self.Target('bar'))
+		record.add_phase('dependencies', telemetry.start, telemetry.start)
+		with record.phase('build'):
+			record.add_process(self.Rusage())
+		with record.phase('post_build'):
+			pass
+
+		events = telemetry.trace()['traceEvents']
+		self.assertEqual(['bar [build]', 'bar [post_build]'], [ i['name'] for i in events if i['ph'] == 'X' ])
+		self.assertEqual(1, len([ i for i in events if i['ph'] == 'C' ]))
+		self.assertEqual(['b', 'e'], [ i['ph'] for i in events if i.get('cat') == 'dependencies' ])
+		json.dumps(events)
+
@@ -0,0 +1,68 @@
+import pathlib
+import tempfile
+import unittest
+
+from .unidiff import PatchError, apply
+
+class TestUnifiedDiff(unittest.TestCase):
+	original = b''.join(b'line %d\n' % i for i in range(1, 21))
+
+	patch = b'''diff --git a/file.txt b/file.txt
+--- a/file.txt\t2020-01-01 00:00:00
++++ b/file.txt\t2020-01-01 00:00:00
+@@ -2,3 +2,3 @@
+ line 2
+-line 3
++line three
+ line 4
+@@ -17,4 +17,5 @@ context
+ line 17
+ line 18
++line 18.5
+ line 19
+ line 20
+--- /dev/null
++++ b/new/created.txt
+@@ -0,0 +1,2 @@
++first
++no newline
+\\ No newline at end of file
+'''
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.root = pathlib.Path(self.directory.name)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_apply(self):
+		(self.root/'file.txt').write_bytes(self.original)
+		touched = apply(self.patch, self.root, backup=self.root/'backup')
+		self.assertEqual({'file.txt': True, 'new/created.txt': False}, touched)
+
+		lines = (self.root/'file.txt').read_bytes().splitlines()
+		self.assertEqual(b'line three', lines[2])
+		self.assertEqual(b'line 18.5', lines[18])
+		self.assertEqual(21, len(lines))
+		self.assertEqual(b'first\nno newline', (self.root/'new'/'created.txt').read_bytes())
+		self.assertEqual(self.original, (self.root/'backup'/'file.txt').read_bytes())
+
+	def test_offset(self):
+		(self.root/'file.txt').write_bytes(b'inserted\n'*5+self.original)
+		apply(self.patch, self.root)
+		lines = (self.root/'file.txt').read_bytes().splitlines()
+		self.assertEqual(b'line three', lines[7])
+		self.assertEqual(b'line 18.5', lines[23])
+
+	def test_rejected(self):
+		(self.root/'file.txt').write_bytes(self.original.replace(b'line 18\n', b'changed\n'))
+		self.assertRaises(PatchError, apply, self.patch, self.root)
+		self.assertEqual(self.original.replace(b'line 18\n', b'changed\n'), (self.root/'file.txt').read_bytes())
+		self.assertFalse((self.root/'new').exists())
+
+	def test_delete(self):
+		(self.root/'gone.txt').write_bytes(b'a\nb\n')
+		apply(b'--- a/gone.txt\n+++ /dev/null\n@@ -1,2 +0,0 @@\n-a\n-b\n', self.root)
+		self.assertFalse((self.root/'gone.txt').exists())
+
@@ -0,0 +1,98 @@
+import collections.abc
+import contextlib
+import io
+import logging
+import os
+import pathlib
+import time
+
+from .base import Scope, Target, TargetConfig
+from .build import Build
+from .config import Config
+from .tests import TargetTestCase
+from .worker import Coordinator, _parse_address
+
+class _WriteProcessId(Target):
+	local_config_keys = {'file.name'}
+
+	def build(self):
+		pathlib.Path(self.config['file.name']).write_text(str(os.getpid()))
+
+	def post_build(self):
+		self.config['file.output', Scope.Local, Target.GlobalTargetLevel] = self.config['file.name']
+
+class _WriteConfig(Target):
+	local_config_keys = {'file.name', 'keys'}
+
+	def build(self):
+		values = { key: self.config[key] for key in self.config['keys'] }
+		pathlib.Path(self.config['file.name']).write_text(repr({ k: dict(v) if isinstance(v, collections.abc.Mapping) else v
+			for k, v in values.items() }))
+
+def _broken(config):
+	raise ValueError('broken resolver')
+
+class TestCoordinator(TargetTestCase):
+	def test_parse_address(self):
+		self.assertEqual(('localhost', 5000), _parse_address('localhost:5000'))
+		self.assertEqual('/tmp/builder.sock', _parse_address('/tmp/builder.sock'))
+
+	def test_workers(self):
+		root = pathlib.Path(self.root_dir.name)
+		first = _WriteProcessId('first', config={'file.name': str(root/'first')})
+		second = _WriteProcessId('second', config={'file.name': str(root/'second')})
+		after, after_config = self.mock_target(Target, 'after', dependencies={first, second})
+
+		build = self.mock_build(Build)
+		build.targets |= {after}
+		build(args=['--workers', '2'])
+
+		for name in ('first', 'second'):
+			self.assertNotEqual(str(os.getpid()), (root/name).read_text())
+			self.assertEqual(str(root/name), after_config.value['target.{}.file.output'.format(name)])
+		self.assertTrue(after_config.value['target.first.build'])
+
+	def test_lazy_config(self):
+		root = pathlib.Path(self.root_dir.name)
+		good = _WriteConfig('good', config={'file.name': str(root/'good'), 'keys': ['greeting', 'subtree']})
+		bad = _WriteConfig('bad', config={'file.name': str(root/'bad'), 'keys': ['broken']})
+		build = self.mock_build(Build, config={'greeting': 'hello', 'subtree.a': 1, 'subtree.b': 2, 'broken': _broken})
+		build.targets |= {good}
+		build(args=['--workers', '1'])
+		self.assertEqual({'greeting': 'hello', 'subtree': {'a': 1, 'b': 2}}, eval((root/'good').read_text()))
+
+		build.targets = {bad}
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			self.assertRaises(Exception, build, ['--workers', '1'])
+		self.assertIn('cannot send configuration key broken to worker: ValueError: broken resolver', output.getvalue())
+
+	def test_workers_lost(self):
+		root = pathlib.Path(self.root_dir.name)
+		target = _WriteProcessId('lost', config={'file.name': str(root/'lost')})
+		target.config = TargetConfig(target, target._configure(Config('default', {})))
+		coordinator = Coordinator()
+		try:
+			coordinator.spawn(2)
+			while len(coordinator._connections) < 2:
+				time.sleep(0.05)
+			for process in coordinator._processes:
+				process.kill()
+				process.wait()
+			with self.assertLogs(level=logging.WARNING) as logs:
+				self.assertFalse(coordinator.build(target))
+			self.assertIn('WARNING:root:lost: no workers available, building locally', logs.output)
+		finally:
+			coordinator.close()
+
+	def test_no_workers(self):
+		target = _WriteProcessId('lonely', config={'file.name': 'unused'})
+		target.config = TargetConfig(target, target._configure(Config('default', {})))
+		coordinator = Coordinator()
+		coordinator.connect_timeout = 0.2
+		try:
+			with self.assertLogs(level=logging.WARNING):
+				self.assertFalse(coordinator.build(target))
+		finally:
+			coordinator.close()
+
@@ -1,31 +1,7 @@
 import copy
-import functools
-import logging
-import pathlib
-import sys
 import tempfile
 import unittest
 
-def _log(level, msg):
-	logging.log(level, msg)
-
-def _fn_log(level):
-	def wrapper1(fn):
-		@functools.wraps(fn)
-		def wrapper2(*args, **kwargs):
-			_log(level, '{}({}, {})'.format(fn.__qualname__, ', '.join(map(repr, args)),
-				', '.join(['{}={}'.format(repr(k), repr(v)) for k, v in kwargs.items()]) ))
-			try:
-				r = fn(*args, **kwargs)
-				_log(level, '{}(...) = {}'.format(fn.__qualname__, repr(r)))
-			except:
-				exc_type, exc, trace = sys.exc_info()
-				_log(level, '{}(...) ----raise----> {} {}'.format(fn.__qualname__, exc_type, exc))
-				raise
-			return r
-		return wrapper2
-	return wrapper1
-
 class SkipType:
 	pass
 
@@ -61,3 +37,31 @@ class TestCase(unittest.TestCase):
 				return stdout, stderr
 
 		return MockProcess
+
+class TargetTestCase(TestCase):
+	def mock_build(self, cls, config=None):
+		from .config import Config
+		if config is None:
+			config = dict()
+		config = Config._flatten_dict(config)
+		if not 'directory.root' in config:
+			config['directory.root'] = self.root_dir.name
+		return cls(config=config)
+
+	def mock_target(self, cls, *args, **kwargs):
+		from .base import Target
+		target = cls(*args, **kwargs)
+		runtime_config_result = Result()
+
+		old_build = target.build if target.build.__func__ != Target.build else lambda: None
+		def build():
+			old_build()
+			runtime_config_result.value = copy.deepcopy(target.config)
+		target.build = build
+		return target, runtime_config_result
+
+	def run_target(self, target, build_config=None):
+		from .build import Build
+		build = self.mock_build(Build, config=build_config)
+		build.targets |= {target}
+		build()
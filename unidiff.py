@@ -0,0 +1,152 @@
+import collections
+import os
+import pathlib
+import re
+import tempfile
+
+Hunk = collections.namedtuple('Hunk', ['old_start', 'old', 'new'])
+
+_hunk_header = re.compile(rb'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+_null = b'/dev/null'
+
+class PatchError(Exception):
+	pass
+
+class FilePatch:
+	def __init__(self, source, target):
+		self.source = source
+		self.target = target
+		self.hunks = []
+
+	def __repr__(self):
+		return '<{} {}>'.format(self.__class__.__qualname__, self.path(0))
+
+	@property
+	def created(self):
+		return self.source == _null
+
+	@property
+	def deleted(self):
+		return self.target == _null
+
+	def path(self, strip):
+		name = self.source if self.deleted else self.target
+		parts = [ i for i in name.decode('utf-8').split('/') if i ]
+		if len(parts) <= strip:
+			raise PatchError('Cannot strip {} components from {}'.format(strip, name.decode('utf-8')))
+		return '/'.join(parts[strip:])
+
+	def apply(self, lines):
+		lines = list(lines)
+		offset = 0
+		for number, hunk in enumerate(self.hunks, 1):
+			expected = max(hunk.old_start-1, 0) + offset if hunk.old else hunk.old_start + offset
+			position = self._find(lines, hunk.old, expected)
+			if position is None:
+				raise PatchError('Hunk #{} of {} does not apply'.format(number, self.path(0)))
+			lines[position:position+len(hunk.old)] = hunk.new
+			offset = position - (expected - offset) + len(hunk.new) - len(hunk.old)
+		return lines
+
+	@staticmethod
+	def _find(lines, old, expected):
+		expected = min(max(expected, 0), len(lines))
+		for distance in range(max(expected, len(lines)-expected)+1):
+			for position in (expected-distance, expected+distance):
+				if 0 <= position <= len(lines)-len(old) and lines[position:position+len(old)] == old:
+					return position
+		return None
+
+def _name(line):
+	return line[4:].split(b'\t')[0].rstrip(b'\r\n').rstrip()
+
+def parse(text):
+	patches = []
+	lines = text.splitlines(keepends=True)
+	index = 0
+	while index < len(lines):
+		line = lines[index]
+		if line.startswith(b'--- ') and index+1 < len(lines) and lines[index+1].startswith(b'+++ '):
+			patches.append(FilePatch(_name(line), _name(lines[index+1])))
+			index += 2
+			continue
+		match = _hunk_header.match(line)
+		if match is None:
+			index += 1
+			continue
+		if not patches:
+			raise PatchError('Hunk without file header at line {}'.format(index+1))
+		old_count = int(match.group(2)) if match.group(2) is not None else 1
+		new_count = int(match.group(4)) if match.group(4) is not None else 1
+		old, new = [], []
+		index += 1
+		while (len(old) < old_count or len(new) < new_count) and index < len(lines):
+			line = lines[index]
+			tag, content = line[:1], line[1:]
+			if line in (b'\n', b'\r\n'):
+				tag, content = b' ', line
+			if tag == b' ':
+				old.append(content)
+				new.append(content)
+			elif tag == b'-':
+				old.append(content)
+			elif tag == b'+':
+				new.append(content)
+			elif tag != b'\\':
+				raise PatchError('Malformed hunk at line {}'.format(index+1))
+			index += 1
+			if index < len(lines) and lines[index].startswith(b'\\'):
+				for side in ((old,) if tag == b'-' else (new,) if tag == b'+' else (old, new)):
+					side[-1] = side[-1].rstrip(b'\r\n')
+				index += 1
+		if len(old) != old_count or len(new) != new_count:
+			raise PatchError('Truncated hunk in {}'.format(patches[-1].path(0)))
+		patches[-1].hunks.append(Hunk(int(match.group(1)), old, new))
+	return patches
+
+def _write(path, content, mode=None):
+	path.parent.mkdir(parents=True, exist_ok=True)
+	descriptor, temporary = tempfile.mkstemp(dir=str(path.parent), prefix='.'+path.name)
+	try:
+		with os.fdopen(descriptor, 'wb') as f:
+			f.write(content)
+		if mode is not None:
+			os.chmod(temporary, mode)
+		os.replace(temporary, str(path))
+	except:
+		os.unlink(temporary)
+		raise
+
+def apply(text, directory, strip=1, backup=None):
+	directory = pathlib.Path(directory)
+	originals = dict()
+	contents = dict()
+	for patch in parse(text):
+		relative = patch.path(strip)
+		if relative not in originals:
+			path = directory/relative
+			try:
+				originals[relative] = path.read_bytes()
+			except FileNotFoundError:
+				if not patch.created:
+					raise PatchError('File to patch {} does not exist'.format(path)) from None
+				originals[relative] = None
+			contents[relative] = originals[relative].splitlines(keepends=True) if originals[relative] is not None else []
+		contents[relative] = patch.apply(contents[relative])
+		if patch.deleted and not contents[relative]:
+			contents[relative] = None
+	if not originals:
+		raise PatchError('No file patches found')
+
+	if backup is not None:
+		for relative, original in originals.items():
+			if original is not None:
+				_write(pathlib.Path(backup)/relative, original)
+	for relative, content in contents.items():
+		path = directory/relative
+		if content is None:
+			path.unlink()
+		else:
+			_write(path, b''.join(content), os.stat(str(path)).st_mode & 0o7777 if path.exists() else None)
+	return { relative: original is not None for relative, original in originals.items() }
+
@@ -0,0 +1,255 @@
+import argparse
+import logging
+import multiprocessing.connection
+import os
+import pathlib
+import pickle
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from .base import Scope, Target, TargetConfig
+from .build import AuthkeyVariable
+from .config import Config, DefaultedDict
+from .telemetry import TargetTelemetry
+
+def _parse_address(address):
+	host, separator, port = address.rpartition(':')
+	if separator and port.isdigit():
+		return (host, int(port))
+	return address
+
+def _family(address):
+	return 'AF_INET' if isinstance(address, tuple) else 'AF_UNIX'
+
+class Coordinator:
+	_local_attributes = {'dependencies', '_config', 'config', '_telemetry', '_state', '_cpus'}
+	poll_interval = 0.5
+	connect_timeout = 30.0
+
+	def __init__(self, address=None, authkey=None):
+		self._directory = None
+		if address is None:
+			self._directory = tempfile.mkdtemp()
+			address = str(pathlib.Path(self._directory)/'workers.sock')
+		self.authkey = authkey if authkey is not None else os.urandom(16)
+		self._listener = multiprocessing.connection.Listener(address, family=_family(address), authkey=self.authkey)
+		self.address = self._listener.address
+		self._idle = queue.Queue()
+		self._connections = []
+		self._lock = threading.Lock()
+		self._processes = []
+		self._closed = False
+		self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+		self._accept_thread.start()
+		logging.info('Waiting for workers on {}'.format(self.address))
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def _accept(self):
+		while not self._closed:
+			try:
+				connection = self._listener.accept()
+			except (OSError, multiprocessing.AuthenticationError) as e:
+				if not self._closed:
+					logging.warning('Rejected worker connection: {}'.format(e))
+				continue
+			if self._closed:
+				connection.close()
+				break
+			logging.debug('Worker connected')
+			with self._lock:
+				self._connections.append(connection)
+			self._idle.put(connection)
+
+	def spawn(self, count):
+		env = dict(os.environ)
+		env[AuthkeyVariable] = self.authkey.hex()
+		env['PYTHONPATH'] = os.pathsep.join([str(pathlib.Path(__file__).parent.parent)]+[ i for i in sys.path if i ])
+		address = self.address if isinstance(self.address, str) else '{}:{}'.format(*self.address)
+		for _ in range(count):
+			self._processes.append(subprocess.Popen([sys.executable, '-m', __name__, address], env=env))
+
+	def _serialize(self, target):
+		if type(target).__module__ == '__main__':
+			return None
+		attributes = { k: v for k, v in target._attributes().items() if k not in self._local_attributes }
+		try:
+			return pickle.dumps((type(target), attributes))
+		except Exception as e:
+			target.log(logging.DEBUG, 'cannot be sent to a worker ({}), building locally'.format(e))
+			return None
+
+	def _lookup(self, target, key):
+		try:
+			value = target.config.config.get_single(key, top_config=target.config, resolve=True)
+			pickle.dumps(value)
+			return ('value', value)
+		except KeyError:
+			return ('missing', None)
+		except Exception as e:
+			target.log(logging.WARNING, 'cannot send configuration key {} to worker: {}: {}'.format(key, e.__class__.__qualname__, e))
+			return ('error', '{}: {}'.format(e.__class__.__qualname__, e))
+
+	def _connection(self):
+		start = time.monotonic()
+		while True:
+			try:
+				return self._idle.get(timeout=self.poll_interval)
+			except queue.Empty:
+				pass
+			with self._lock:
+				if self._connections:
+					continue
+			if self._processes and all(i.poll() is not None for i in self._processes):
+				return None
+			if time.monotonic() - start > self.connect_timeout:
+				return None
+
+	def build(self, target):
+		payload = self._serialize(target)
+		if payload is None:
+			return False
+
+		while True:
+			connection = self._connection()
+			if connection is None:
+				target.log(logging.WARNING, 'no workers available, building locally')
+				return False
+			try:
+				connection.send(('build', payload))
+				status, result = connection.recv()
+				while status in ('get', 'keys'):
+					connection.send(self._lookup(target, result) if status == 'get' else
+						('keys', list(target.config.config._subtree_keys(result))))
+					status, result = connection.recv()
+				break
+			except (EOFError, OSError):
+				with self._lock:
+					self._connections.remove(connection)
+				connection.close()
+				target.log(logging.WARNING, 'lost connection to worker, retrying')
+		self._idle.put(connection)
+
+		if status != 'done':
+			raise Exception('Worker failed to build "{}":\n{}'.format(target.name, result))
+		writes, record = result
+		for key, value in writes.items():
+			target.config.set(key, value, scope=Scope.Global, level=Target.GlobalTargetLevel)
+		if target._telemetry is not None:
+			target._telemetry.merge(record)
+		return True
+
+	def close(self):
+		self._closed = True
+		self._listener.close()
+		with self._lock:
+			connections, self._connections = self._connections, []
+		for connection in connections:
+			try:
+				connection.send(('stop', None))
+			except OSError:
+				pass
+			connection.close()
+		for process in self._processes:
+			try:
+				process.wait(timeout=10)
+			except subprocess.TimeoutExpired:
+				process.kill()
+				process.wait()
+		if self._directory is not None:
+			shutil.rmtree(self._directory, ignore_errors=True)
+
+class _RemoteValues:
+	def __init__(self, connection):
+		self._connection = connection
+		self._values = dict()
+		self._keys = dict()
+		self._lock = threading.Lock()
+
+	def _request(self, command, argument):
+		with self._lock:
+			self._connection.send((command, argument))
+			return self._connection.recv()
+
+	def __getitem__(self, key):
+		if key not in self._values:
+			self._values[key] = self._request('get', key)
+		status, value = self._values[key]
+		if status == 'missing':
+			raise KeyError(key)
+		if status == 'error':
+			raise Exception('Cannot read configuration key {}: {}'.format(key, value))
+		return value
+
+	def keys(self, prefix=''):
+		if prefix not in self._keys:
+			self._keys[prefix] = self._request('keys', prefix)[1]
+		return self._keys[prefix]
+
+	def __iter__(self):
+		return iter(self.keys())
+
+class _RemoteConfig(Config):
+	__slots__ = ()
+
+	def _level_keys(self, prefix):
+		return self.config.keys(prefix)
+
+def _execute(payload, connection):
+	cls, attributes = pickle.loads(payload)
+	target = cls.__new__(cls)
+	for name, value in attributes.items():
+		setattr(target, name, value)
+	target.dependencies = set()
+	target._config = DefaultedDict((), 'target.{}.'.format(target.code))
+	target._state = None
+	target._cpus = None
+
+	resolved = _RemoteConfig('resolved')
+	resolved.config = _RemoteValues(connection)
+	shared = Config(Target.GlobalTargetLevel, {}, resolved)
+	target.config = TargetConfig(target, Config('target.{}'.format(target.code), {}, shared))
+	target._telemetry = TargetTelemetry(target.name)
+
+	target.build()
+	target.post_build()
+	return shared.config, target._telemetry
+
+def work(address, authkey):
+	try:
+		connection = multiprocessing.connection.Client(address, family=_family(address), authkey=authkey)
+	except (OSError, EOFError) as e:
+		logging.warning('Could not connect to coordinator at {}: {}'.format(address, e))
+		return
+	logging.info('Worker {} connected to {}'.format(os.getpid(), address))
+	while True:
+		try:
+			command, payload = connection.recv()
+		except EOFError:
+			break
+		if command == 'stop':
+			break
+		try:
+			connection.send(('done', _execute(payload, connection)))
+		except Exception:
+			connection.send(('failed', traceback.format_exc()))
+	connection.close()
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Builder worker - builds targets sent by a coordinator')
+	parser.add_argument('address', help='Coordinator address, HOST:PORT or path of a Unix socket')
+	args = parser.parse_args(args)
+	authkey = os.environ.get(AuthkeyVariable)
+	if authkey is None:
+		raise Exception('Environment variable {} is not set'.format(AuthkeyVariable))
+	work(_parse_address(args.address), bytes.fromhex(authkey))
+
+if __name__ == '__main__':
+	main()